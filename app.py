@@ -1,14 +1,12 @@
 import streamlit as st
 import geopandas as gpd
 import pandas as pd
-import tempfile
 import os
-import shutil
 import folium
-import zipfile
 from streamlit_folium import st_folium
 from folium.plugins import Draw
-import glob
+import time
+import uuid
 
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(
@@ -69,154 +67,284 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # ... (Imports anteriores se mantienen arriba, agregamos estos)
-import rasterio
-from rasterio.warp import calculate_default_transform, reproject, Resampling
-import numpy as np
-from PIL import Image
 import fiona
+from layer_cache import hash_buffers, estimate_gdf_bytes
+from layer_store import layer_store
+from layer_memory import (compact_gdf, index_layer, touch, ensure_resident, enforce_budget, layer_columns,
+                          memory_table, footprint, layer_tiles, close_tiles, SESSION_MEMORY_BUDGET)
+from spatial_index import viewport_subset, view_bounds_from_center, folium_bounds_to_bbox, DEFAULT_FEATURE_BUDGET
+from spatial_index import LayerIndex, bounds_to_center_zoom
+from shapely.geometry import shape
+from vector_tiles import vector_tile_source, vector_grid_style
+from folium.plugins import VectorGridProtobuf
+from raster_tiles import raster_tile_source
+from ingest import IngestJob, background_ingest
+from jobs import scheduler, DONE, FAILED, CANCELLED
+from drawings import DrawingIndex
+from map_encoding import encode_geometries, to_topojson, is_topojson_candidate, feature_collection, STATIC_DETAIL_ZOOM
+from project_io import read_project
+from work_layer import with_feature_ids, next_feature_id, apply_edits, table_page, add_column, split_selection, FEATURE_ID, NEXT_ID_ATTR, COLUMN_TYPES
+from journal import EditJournal, session_journal, sweep_session_journals, SESSION_ID_CHARS
+from layer_diff import compare_layers
+from scratch import scratch
+from diagnostics import profile_rerun, phase_summary, history_jsonl
 
 # Habilitar soporte para KML en Fiona (a veces desactivado por defecto)
 fiona.drvsupport.supported_drivers['KML'] = 'rw'
 fiona.drvsupport.supported_drivers['LIBKML'] = 'rw'
 
-# --- FUNCIONES AUXILIARES (RASTER) ---
-def save_uploaded_files(uploaded_files):
-    """Guarda los archivos subidos (shp, shx, dbf, etc.) en una carpeta temporal."""
-    if not uploaded_files:
-        return None, None
-    
-    temp_dir = tempfile.mkdtemp()
-    
-    saved_files = []
-    
-    for uploaded_file in uploaded_files:
-        file_path = os.path.join(temp_dir, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        saved_files.append(file_path)
-    
-    # Retornamos el directorio temporal para buscar SHPs dentro
-    return None, temp_dir
+# --- FUNCIONES AUXILIARES ---
+def add_ref_layer(name, entry):
+    """Registra una capa de referencia en la sesión (con su índice de búsqueda si es vectorial).
 
+    Las capas de la caché (con clave) se toman del almacén compartido: la sesión
+    guarda un handle y una vista de solo lectura, y los índices son los de todas
+    las sesiones.
+    """
+    handle = layer_store.acquire(entry['key'], entry) if entry.get('key') else None
+    remove_ref_layer(name)
+    if handle:
+        entry = dict(handle.entry(), handle=handle)
+    elif entry['type'] == 'vector':
+        entry['data'] = compact_gdf(entry['data'])
+    if entry['type'] == 'vector':
+        index_layer(entry)
+    touch(entry)
+    st.session_state['ref_layers'][name] = entry
 
-def process_raster_upload(uploaded_file):
-    """Procesa una imagen georreferenciada: Reproyecta a 4326 y genera PNG + Bounds."""
-    try:
-        # Guardar archivo subido temporalmente
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{uploaded_file.name}") as tmp_src:
-            tmp_src.write(uploaded_file.getbuffer())
-            src_path = tmp_src.name
+def remove_ref_layer(name):
+    """Quita una capa de referencia de la sesión y suelta su handle del almacén (o su volcado)."""
+    layer = st.session_state['ref_layers'].pop(name, None)
+    if layer:
+        close_tiles(layer)
+    if layer and layer.get('handle'):
+        layer['handle'].release()
+    if layer and layer.get('spill_file'):
+        layer['spill_file'].close()
 
-        with rasterio.open(src_path) as src:
-            # Definir destino WGS84
-            dst_crs = 'EPSG:4326'
-            
-            # Calcular transformada para reproyección
-            transform, width, height = calculate_default_transform(
-                src.crs, dst_crs, src.width, src.height, *src.bounds)
-            
-            # Preparar array destino
-            # Leemos bandas (asumimos RGB o Gra)
-            # Simplificación: Usaremos la primera banda si es 1, o las 3 primeras si son más.
-            
-            if src.count >= 3:
-                bands_to_read = [1, 2, 3] # RGB
-                count = 3
-            else:
-                bands_to_read = [1] # Grayscale
-                count = 1
-
-            # Crear array destino para los datos reproyectados
-            dest_array = np.zeros((count, height, width), dtype=np.uint8)
-
-            for idx, band in enumerate(bands_to_read):
-                reproject(
-                    source=rasterio.band(src, band),
-                    destination=dest_array[idx],
-                    src_transform=src.transform,
-                    src_crs=src.crs,
-                    dst_transform=transform,
-                    dst_crs=dst_crs,
-                    resampling=Resampling.nearest)
-
-            # Generar Bounds [[lat_min, lon_min], [lat_max, lon_max]]
-            # Folium espera [[lat_min, lon_min], [lat_max, lon_max]] -> SW, NE
-            # Rasterio bounds: left, bottom, right, top -> lon_min, lat_min, lon_max, lat_max
-            # new_bounds = (transform * (0, height)) , ...
-            # Usaremos un método más directo para bounds lat/lon:
-            lon_min, lat_min, lon_max, lat_max = rasterio.transform.array_bounds(height, width, transform)
-            folium_bounds = [[lat_min, lon_min], [lat_max, lon_max]]
-
-            # Convertir array a Imagen PIL y guardar como PNG
-            # Formato (H, W, C) para PIL
-            img_data = np.moveaxis(dest_array, 0, -1)
-            
-            if count == 1:
-                img_data = img_data[:, :, 0] # Squeeze
-                img = Image.fromarray(img_data, mode='L')
-            else:
-                img = Image.fromarray(img_data, mode='RGB')
-                
-            # Hacer transparente lo negro/nulo si se desea (opcional complejo)
-            # Guardamos png temporal
-            png_fd, png_path = tempfile.mkstemp(suffix=".png")
-            os.close(png_fd)
-            img.save(png_path, format="PNG")
-            
-            return png_path, folium_bounds
+def work_layer_index():
+    """Índice espacial de la capa de trabajo (se construye una vez y se mantiene incrementalmente)."""
+    if st.session_state.get('work_index') is None:
+        st.session_state['work_index'] = LayerIndex.from_gdf(st.session_state['work_gdf'])
+    return st.session_state['work_index']
 
-    except Exception as e:
-        st.error(f"Error procesando raster: {e}")
-        return None, None
+def uploaded_content_hash(uploaded_files, salt=""):
+    """Hash de contenido de un grupo de archivos subidos (memoizado por file_id en la sesión)."""
+    memo = st.session_state.setdefault('upload_hashes', {})
+    memo_key = (salt,) + tuple(sorted(getattr(f, 'file_id', None) or f.name for f in uploaded_files))
+    if memo_key not in memo:
+        memo[memo_key] = hash_buffers([(f.name, f.getbuffer()) for f in uploaded_files], salt=salt)
+    return memo[memo_key]
 
-def handle_table_edit():
+def handle_table_edit(editor_key="data_editor"):
     """Callback para manejar cambios en la tabla antes de recargar el script."""
-    if "data_editor" not in st.session_state:
+    if editor_key not in st.session_state:
         return
         
-    changes = st.session_state["data_editor"]
-    needs_map_update = False
+    changes = st.session_state[editor_key]
     
-    # Referencia al DF de trabajo
+    # Las posiciones de la tabla se traducen a ids con la vista que se mostró
     gdf = st.session_state['work_gdf']
-    
-    # 1. Filas Editadas
-    # changes['edited_rows'] es {row_idx: {col_name: new_val}}
-    for idx_str, edits in changes.get("edited_rows", {}).items():
-        idx = int(idx_str)
-        # Verificar integridad índex
-        if idx < len(gdf):
-            for col, val in edits.items():
-                if col in gdf.columns:
-                    # Aplicar cambio
-                    gdf.at[idx, col] = val
-                    if col == 'Seleccionar':
-                        needs_map_update = True
-                        
-    # 2. Filas Borradas
-    deleted = changes.get("deleted_rows", [])
+    view_ids = st.session_state.get('table_view_ids', gdf.index)
+
+    # La columna "Ver" es la selección: no son datos, va al conjunto de ids
+    selected = st.session_state['selected_ids']
+    n_selected = len(selected)
+    for pos, edits in changes.get("edited_rows", {}).items():
+        if 'Seleccionar' in edits and int(pos) < len(view_ids):
+            fid = view_ids[int(pos)]
+            if edits['Seleccionar']:
+                selected.add(fid)
+            else:
+                selected.discard(fid)
+    needs_map_update = len(selected) != n_selected
+
+    gdf, edited_cols, deleted = apply_edits(gdf, view_ids, changes)
+    st.session_state['work_gdf'] = gdf
+    for col, (ids, values) in edited_cols.items():
+        journal_record('log_update', col, ids, values)
+    if deleted:
+        journal_record('log_delete', deleted)
+
+    # Borradas: los ids del resto no cambian, el índice espacial solo las da de baja
     if deleted:
-        # Borrar por índice y resetear
-        st.session_state['work_gdf'] = gdf.drop(index=deleted).reset_index(drop=True)
+        if st.session_state.get('work_index') is not None:
+            st.session_state['work_index'].remove(deleted, renumber=False)
+        selected.difference_update(deleted)
+        st.session_state['work_version'] += 1
+        st.session_state.pop('spatial_result', None)
+        # Nueva clave de tabla: las posiciones borradas no deben volver a aplicarse
+        st.session_state['table_version'] = st.session_state.get('table_version', 0) + 1
         needs_map_update = True
         
     # (Opcional) Filas Agregadas - st.data_editor puede agregar filas vacías si num_rows="dynamic"
     # Handling complejo en GIS sin geometría, lo dejamos básico o ignoramos si no hay geom.
     # Por ahora el usuario agrega columnas o dibuja, no agrega filas manuales en blanco.
     
-    # Si hubo cambio visual relevante, forzamos actualización de mapa
+    # Si hubo cambio visual relevante, actualizamos el mapa
     if needs_map_update:
-         if 'last_view' in st.session_state:
-             if st.session_state['last_view']['center']:
-                st.session_state['map_center'] = st.session_state['last_view']['center']
-             if st.session_state['last_view']['zoom']:
-                st.session_state['map_zoom'] = st.session_state['last_view']['zoom']
-         
-         st.session_state['map_key'] += 1
+        refresh_map()
+
+def journal_record(method, *args):
+    """Anota un cambio de la capa de trabajo en el journal de autoguardado (si está activo)."""
+    journal = st.session_state.get('journal')
+    if journal is None or not st.session_state.get('autosave', True):
+        return
+    getattr(journal, method)(*args)
+    if journal.needs_compaction():
+        save_in_background(journal)
+
+def submit_job(label, fn, *args, queue='ingesta', **info):
+    """Encola un trabajo en segundo plano y lo anota en la sesión (`info`: qué hacer al terminar)."""
+    job_id = scheduler.submit(label, fn, *args, queue=queue)
+    st.session_state.setdefault('jobs', {})[job_id] = dict(info, applied=False)
+    return job_id
+
+def save_running():
+    job = scheduler.get(st.session_state.get('save_job'))
+    return job is not None and not job.done
+
+def save_in_background(journal, retire=None):
+    """Guarda la capa de trabajo completa en el proyecto de `journal` sin bloquear. False si ya hay uno en curso.
+
+    `retire`: journal anterior de la sesión, que se descarta cuando el guardado termina bien.
+    """
+    if save_running():
+        return False
+    # Copia con copy-on-write: las ediciones posteriores no la alteran y van
+    # al journal después de la marca, así que la compactación las conserva
+    gdf = st.session_state['work_gdf'].copy(deep=False)
+    gdf.attrs[NEXT_ID_ATTR] = st.session_state['next_fid']
+    mark = journal.mark()
+
+    def save(job):
+        journal.compact(gdf, mark)
+        if retire is not None:
+            retire.discard()
+
+    st.session_state['save_job'] = submit_job(
+        f"Guardar {os.path.basename(journal.project_path)}", save, queue='guardado')
+    return True
+
+def collect_jobs():
+    """Aplica los trabajos terminados de la sesión: registra las capas ingeridas y avisa de los guardados."""
+    for job_id, info in st.session_state.get('jobs', {}).items():
+        job = scheduler.get(job_id)
+        if job is None or not job.done or info['applied']:
+            continue
+        info['applied'] = True
+        if job.status == DONE and info.get('layer'):
+            entry = layer_store.get(job.result)
+            if entry:
+                add_ref_layer(info['layer'], entry)
+            else:
+                info['error'] = "no se pudo leer de la caché"
+        elif job.status == DONE:
+            st.toast(f"{job.name}: listo")
+
+def sync_map_view():
+    """Copia la vista actual del cliente (last_view) a la vista con la que se monta el mapa."""
+    if 'last_view' in st.session_state:
+        if st.session_state['last_view']['center']:
+            st.session_state['map_center'] = st.session_state['last_view']['center']
+        if st.session_state['last_view']['zoom']:
+            st.session_state['map_zoom'] = st.session_state['last_view']['zoom']
+
+def refresh_map(force=False):
+    """Pide actualizar el mapa tras un cambio en los datos.
+
+    En modo incremental las capas dinámicas (selección, pendientes, resaltados)
+    se envían al componente ya montado, y la capa de trabajo remonta el mapa al
+    renderizar si cambió su versión. Solo se remonta aquí si `force` (p. ej.
+    para vaciar la capa de dibujo).
+    """
+    if force or not st.session_state.get('map_incremental', True):
+        sync_map_view()
+        st.session_state.pop('map_view_request', None)
+        st.session_state['map_key'] += 1
+
+def focus_map(bounds):
+    """Encuadra el mapa en bounds [[lat_min, lon_min], [lat_max, lon_max]]."""
+    st.session_state['map_active_bounds'] = bounds
+    refresh_map()
+
+def render_memory(panel):
+    """Memoria de cada capa de referencia y de la capa de trabajo frente al presupuesto de la sesión."""
+    layers = st.session_state['ref_layers']
+    used = sum(footprint(layer) for layer in layers.values())
+    work_bytes = estimate_gdf_bytes(st.session_state['work_gdf']) if not st.session_state['work_gdf'].empty else 0
+    with panel.container():
+        st.caption(f"Memoria de capas: {used / 2**20:.0f} de {SESSION_MEMORY_BUDGET / 2**20:.0f} MB "
+                   f"(+ {work_bytes / 2**20:.1f} MB capa de trabajo)")
+        st.progress(min(1.0, used / max(1, SESSION_MEMORY_BUDGET)))
+        st.dataframe(memory_table(layers), hide_index=True, use_container_width=True)
+
+def render_jobs():
+    """Trabajos de la sesión con su avance. Cuando uno termina se relanza la app para aplicarlo."""
+    jobs = st.session_state.setdefault('jobs', {})
+    current = {job_id: scheduler.get(job_id) for job_id in jobs}
+    for job_id in [k for k, job in current.items() if job is None]:
+        del jobs[job_id], current[job_id]  # olvidados por el planificador
+    if not jobs:
+        st.caption("Sin trabajos.")
+        return
+    for job_id, job in current.items():
+        if not job.done:
+            c_bar, c_cancel = st.columns([5, 1])
+            c_bar.progress(job.progress, text=f"{job.name} · {job.status} · {job.elapsed():.0f} s")
+            if c_cancel.button("⏹️", key=f"cancel_{job_id}", help="Cancelar"):
+                scheduler.cancel(job_id)
+                st.rerun(scope="fragment")
+        elif job.status == DONE:
+            error = jobs[job_id].get('error')
+            st.caption(f"✅ {job.name} ({job.elapsed():.0f} s)" + (f" · {error}" if error else ""))
+        elif job.status == FAILED:
+            st.error(f"{job.name}: {job.error}")
+        elif job.status == CANCELLED:
+            st.caption(f"⏹️ {job.name} (cancelado)")
+    if any(job.done and not jobs[job_id]['applied'] for job_id, job in current.items()):
+        st.rerun(scope="app")
+    if all(job.done for job in current.values()) and st.button("Limpiar terminados", key='jobs_clear'):
+        for job_id in current:
+            scheduler.forget(job_id)
+        jobs.clear()
+        st.rerun(scope="fragment")
+
+def render_diagnostics(panel, profile):
+    """Tiempos del rerun actual (y mediana del historial) y bytes por capa."""
+    history = list(st.session_state.get('diagnostics_history', [])) + [profile.record()]
+    with panel.container():
+        summary = phase_summary(history)
+        st.caption(f"Rerun: {profile.total():.3f} s ({len(history)} medidos)")
+        st.dataframe(pd.DataFrame(
+            [(phase, last, median) for phase, (last, median) in summary.items()],
+            columns=["Fase", "Este rerun (s)", "Mediana (s)"]
+        ).round(4), hide_index=True, use_container_width=True)
+        if profile.layers:
+            st.dataframe(pd.DataFrame(
+                sorted(((name, round(size / 1024, 1)) for name, size in profile.layers.items()), key=lambda r: -r[1]),
+                columns=["Capa", "KB"]
+            ), hide_index=True, use_container_width=True)
+        st.download_button("Exportar métricas (JSONL)", history_jsonl(history),
+                           file_name="geoeditor_diagnostico.jsonl", mime="application/json")
 
 # --- APP PRINCIPAL ---
 
+# Modos de render para capas de referencia que superan el presupuesto de entidades
+REF_LARGE_MODES = ["Completa", "Solo lo visible", "Teselas vectoriales"]
+# Modos de procesado de GeoTIFF
+RASTER_MODES = ["Imagen única", "Teselas"]
+# Consultas por ubicación
+SPATIAL_QUERY_MODES = ["Intersecta el dibujo", "Más cercanos", "Dentro de distancia"]
+WORK_LAYER_LABEL = "✏️ Capa de trabajo"
+TABLE_PAGE_SIZES = [50, 100, 250, 1000]
+# Intervalo de refresco del panel de trabajos mientras haya alguno activo
+JOB_POLL_SECONDS = 1.0
+
 def main():
+    profile = st.session_state['rerun_profile']
+    rerun_started = time.monotonic()
+
     # Título Flotante / Compacto
     st.markdown("""
         <div style="display: flex; align-items: center; gap: 10px; padding-bottom: 10px;">
@@ -227,7 +355,15 @@ def main():
     
     # --- ESTADO INICIAL ---
     if 'work_gdf' not in st.session_state:
-        st.session_state['work_gdf'] = gpd.GeoDataFrame(columns=['geometry'], geometry='geometry', crs="EPSG:4326")
+        st.session_state['work_gdf'] = with_feature_ids(gpd.GeoDataFrame(columns=['geometry'], geometry='geometry', crs="EPSG:4326"))
+    if 'selected_ids' not in st.session_state:
+        st.session_state['selected_ids'] = set()  # selección: ids de la capa de trabajo
+    if 'session_id' not in st.session_state:
+        st.session_state['session_id'] = uuid.uuid4().hex[:SESSION_ID_CHARS]
+    if 'next_fid' not in st.session_state:
+        st.session_state['next_fid'] = next_feature_id(st.session_state['work_gdf'])  # ids nunca reutilizados
+    if 'work_version' not in st.session_state:
+        st.session_state['work_version'] = 0  # cambia con altas/borrados (geometrías del mapa)
     if 'map_key' not in st.session_state:
         st.session_state['map_key'] = 0
     # Estado para capas de referencia persistentes (cache simple por nombre)
@@ -239,6 +375,9 @@ def main():
         st.session_state['map_center'] = [-33.4489, -70.6693]
     if 'map_zoom' not in st.session_state:
         st.session_state['map_zoom'] = 10
+    # Trabajos en segundo plano que terminaron desde el último rerun
+    collect_jobs()
+    profile.lap("estado inicial")
 
     # --- BARRA LATERAL ---
     with st.sidebar:
@@ -247,111 +386,197 @@ def main():
         # 1. GESTIÓN DE DATOS Y PROYECTO
         with st.expander("📂 Proyecto y Datos", expanded=True):
             st.markdown("**Archivo de Trabajo**")
-            default_path = os.path.join(os.getcwd(), "mis_dibujos.geojson")
+            default_path = os.path.join(os.getcwd(), "mis_dibujos.parquet")
             work_path = st.text_input("Ruta:", value=default_path, label_visibility="collapsed")
+            path_journal = EditJournal(work_path)
+
+            # Sesión nueva sin proyecto en disco: el autoguardado empieza en un archivo
+            # propio de la sesión junto a esa ruta (dos sesiones nuevas no comparten journal).
+            # Se borra al guardar el proyecto o al terminar la sesión.
+            if ('journal' not in st.session_state and st.session_state['work_gdf'].empty
+                    and not os.path.exists(work_path) and not path_journal.exists()):
+                sweep_session_journals(work_path)
+                st.session_state['journal'] = session_journal(work_path, st.session_state['session_id'])
             
             c_load, c_save = st.columns(2)
             if c_load.button("📂 Cargar"):
-                if os.path.exists(work_path):
+                if save_running():
+                    st.warning("Hay un guardado en curso: espera a que termine para cargar.")
+                elif os.path.exists(work_path) or path_journal.exists():
                     try:
-                        loaded_gdf = gpd.read_file(work_path)
-                        if loaded_gdf.crs and loaded_gdf.crs.to_string() != "EPSG:4326":
-                            loaded_gdf = loaded_gdf.to_crs(epsg=4326)
+                        # Proyecto + cambios del journal que no llegaron a compactarse
+                        loaded_gdf, recovered = path_journal.load()
+                        st.session_state['next_fid'] = next_feature_id(loaded_gdf)
+                        loaded_gdf, st.session_state['selected_ids'] = split_selection(loaded_gdf)
+                        loaded_gdf = compact_gdf(loaded_gdf, editable=True)
                         st.session_state['work_gdf'] = loaded_gdf
-                        st.session_state['map_key'] += 1
-                        st.success("Cargado")
+                        st.session_state['work_version'] += 1
+                        st.session_state['journal'] = path_journal
+                        st.session_state['work_index'] = None
+                        st.session_state.pop('spatial_result', None)
+                        refresh_map()
+                        st.success(f"Cargado ({recovered} cambio(s) recuperados del autoguardado)" if recovered else "Cargado")
                     except Exception as e: st.error(str(e))
             
             if c_save.button("💾 Guardar"):
-                try:
-                    gdf_save = st.session_state['work_gdf'].copy()
-                    if work_path.endswith(".shp"):
-                        gdf_save.to_file(work_path)
-                    else:
-                        gdf_save.to_file(work_path, driver="GeoJSON")
-                    st.success("Guardado!")
-                except Exception as e: st.error(str(e))
+                # Guardado completo en segundo plano: el journal de esa ruta se
+                # vacía al terminar y pasa a ser el activo desde ya
+                previous = st.session_state.get('journal')
+                retired = previous if previous is not None and previous.path != path_journal.path else None
+                if save_in_background(path_journal, retire=retired):
+                    st.session_state['journal'] = path_journal
+                    st.info("Guardando en segundo plano (ver ⚙️ Trabajos).")
+                else:
+                    st.warning("Ya hay un guardado en curso.")
+
+            st.checkbox("Autoguardado", value=True, key='autosave',
+                        help="Anota cada cambio en un journal junto al proyecto y lo compacta periódicamente.")
+            active_journal = st.session_state.get('journal')
+            if st.session_state['autosave']:
+                if active_journal is not None:
+                    st.caption(f"Autoguardado en {os.path.basename(active_journal.project_path)} "
+                               f"({len(active_journal)} cambio(s) sin compactar).")
+                elif path_journal.exists():
+                    st.caption("Hay cambios sin compactar en esa ruta: 📂 Cargar para recuperarlos.")
+                else:
+                    st.caption("Autoguardado inactivo hasta Cargar o Guardar el proyecto.")
                 
             st.divider()
             st.markdown("**Gestión de Campos**")
             new_col_name = st.text_input("Nombre Columna", placeholder="Ej: Comentario")
-            new_col_type = st.selectbox("Tipo", ["Texto", "Número Entero", "Número Decimal"], label_visibility="collapsed")
+            new_col_type = st.selectbox("Tipo", COLUMN_TYPES, label_visibility="collapsed")
             
             if st.button("➕ Crear Columna"):
                 if new_col_name:
                     if new_col_name not in st.session_state['work_gdf'].columns:
-                        if new_col_type == "Número Entero":
-                                st.session_state['work_gdf'][new_col_name] = pd.Series(dtype='Int64')
-                        elif new_col_type == "Número Decimal":
-                                st.session_state['work_gdf'][new_col_name] = pd.Series(dtype='float')
-                        else:
-                                st.session_state['work_gdf'][new_col_name] = None
+                        add_column(st.session_state['work_gdf'], new_col_name, new_col_type)
+                        journal_record('log_add_column', new_col_name, new_col_type)
                         st.success(f"Campo '{new_col_name}' ok.")
                         st.rerun()
                 else:
                     st.warning("Esa columna ya existe.")
 
         # 2. CAPAS Y ESTILOS
+        memory_panel = None
         with st.expander("🎨 Capas y Estilos", expanded=False):
             st.markdown("**Capas de Referencia**")
             uploaded_refs = st.file_uploader(
-                "Subir (SHP/KML/TIF)", 
+                "Subir (SHP/ZIP/KML/TIF)", 
                 accept_multiple_files=True, 
                 key="refs",
             )
             
+            raster_mode = st.radio("Raster (TIF)", RASTER_MODES, horizontal=True, key='raster_mode',
+                                   help="'Teselas' sirve el GeoTIFF como pirámide XYZ generada bajo demanda: "
+                                        "memoria acotada y solo se procesa lo visible.")
+            raster_max_size, raster_fit_zoom = 0, False
+            if raster_mode == RASTER_MODES[0]:
+                raster_max_size = st.number_input("Lado máx. imagen (px, 0 = completa)", min_value=0,
+                                                  value=0, step=1024, key='raster_max_size')
+                raster_fit_zoom = st.checkbox("Limitar al detalle del zoom actual", key='raster_fit_zoom')
+
             if uploaded_refs:
                 if st.button("🔄 Procesar Capas"):
-                    with st.spinner("Procesando..."):
-                        _, temp_dir = save_uploaded_files(uploaded_refs)
-                        
-                        # SHP
-                        if temp_dir:
-                            import glob
-                            shapefiles_found = glob.glob(os.path.join(temp_dir, "*.shp"))
-                            for shp_path in shapefiles_found:
-                                try:
-                                    gdf = gpd.read_file(shp_path)
-                                    if gdf.crs and gdf.crs.to_string() != "EPSG:4326":
-                                        gdf = gdf.to_crs(epsg=4326)
-                                    name = os.path.basename(shp_path)
-                                    st.session_state['ref_layers'][name] = {'type': 'vector', 'data': gdf}
-                                except Exception as e: st.error(f"{shp_path}: {e}")
-                        
-                        # Raster/KML
-                        for f in uploaded_refs:
-                            if f.name.lower().endswith(('.tif', '.tiff')):
-                                png_path, bounds = process_raster_upload(f)
-                                if png_path: st.session_state['ref_layers'][f.name] = {'type': 'raster', 'data': png_path, 'bounds': bounds}
-                            elif f.name.lower().endswith(('.kml', '.kmz')):
-                                try:
-                                    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{f.name}") as tmp:
-                                        tmp.write(f.getbuffer())
-                                        path = tmp.name
-                                    # Lógica básica KML
-                                    gdf_kml = gpd.read_file(path) # Puede fallar si no hay soporte, try/catch wrap
-                                    if not gdf_kml.empty:
-                                        if gdf_kml.crs and gdf_kml.crs.to_string() != "EPSG:4326": gdf_kml = gdf_kml.to_crs(epsg=4326)
-                                        st.session_state['ref_layers'][f.name] = {'type': 'vector', 'data': gdf_kml}
-                                except: pass 
-
-                        st.success(f"Capas: {len(st.session_state['ref_layers'])}")
+                    # Agrupar por nombre base: un SHP viaja con sus .shx/.dbf/.prj
+                    shp_groups = {}
+                    for f in uploaded_refs:
+                        shp_groups.setdefault(os.path.splitext(f.name)[0], []).append(f)
+
+                    # Trabajos de ingesta: lo que ya está en caché se registra directamente
+                    jobs = []
+                    for group in shp_groups.values():
+                        shp_files = [f for f in group if f.name.lower().endswith('.shp')]
+                        if not shp_files:
+                            continue
+                        key = uploaded_content_hash(group)
+                        cached = layer_store.get(key)
+                        if cached:
+                            add_ref_layer(shp_files[0].name, cached)
+                        else:
+                            jobs.append(IngestJob(shp_files[0].name, 'vector', key,
+                                                  [(f.name, f.getbuffer()) for f in group]))
+
+                    for f in uploaded_refs:
+                        if not f.name.lower().endswith(('.tif', '.tiff', '.kml', '.kmz', '.zip')):
+                            continue
+                        is_raster = f.name.lower().endswith(('.tif', '.tiff'))
+                        tiled = is_raster and raster_mode == RASTER_MODES[1]
+                        salt, raster_zoom = "", None
+                        if tiled:
+                            salt = "tiles"
+                        elif is_raster:
+                            if raster_fit_zoom:
+                                raster_zoom = st.session_state.get('last_view', {}).get('zoom') or st.session_state['map_zoom']
+                            salt = f"png:{raster_max_size}:{raster_zoom}"
+                        key = uploaded_content_hash([f], salt=salt)
+                        cached = layer_store.get(key)
+                        if cached:
+                            add_ref_layer(f.name, cached)
+                        else:
+                            kind = 'raster_tiles' if tiled else 'raster' if is_raster else 'vector'
+                            options = {'max_size': raster_max_size or None, 'target_zoom': raster_zoom} if kind == 'raster' else None
+                            jobs.append(IngestJob(f.name, kind, key, [(f.name, f.getbuffer())], options))
+
+                    # Cada archivo es un trabajo en segundo plano: el mapa y la tabla
+                    # siguen respondiendo y la capa se registra al terminar
+                    for job in jobs:
+                        submit_job(f"Capa {job.name}", background_ingest, job, layer=job.name)
+
+                    st.success(f"Capas: {len(st.session_state['ref_layers'])}"
+                               + (f" · {len(jobs)} en proceso (ver ⚙️ Trabajos)" if jobs else ""))
+
+            if st.session_state['ref_layers']:
+                c_remove, c_remove_btn = st.columns([4, 1])
+                remove_name = c_remove.selectbox("Quitar capa", list(st.session_state['ref_layers']),
+                                                 label_visibility="collapsed", key='ref_remove')
+                if c_remove_btn.button("🗑️", help="Quitar la capa de la sesión"):
+                    remove_ref_layer(remove_name)
+                    refresh_map(force=True)
+                    st.rerun()
+                # Se completa tras dibujar el mapa (después de volcar las capas que no caben)
+                memory_panel = st.empty()
             
             st.divider()
             st.markdown("**Estilo Dibujo**")
             work_color = st.color_picker("Color Dibujo", st.session_state.get('style_work_color', "#2563eb"))
             st.session_state['style_work_color'] = work_color
+            st.checkbox("Actualización incremental del mapa", value=True, key='map_incremental',
+                        help="Mantiene el mapa montado y solo envía las capas que cambian "
+                             "(selección, dibujos pendientes, resaltados) en vez de reconstruirlo.")
+
+            st.markdown("**Codificación del mapa**")
+            st.checkbox("Simplificar según zoom", value=True, key='enc_simplify',
+                        help="Quita vértices que no se distinguen a la escala actual (medio píxel).")
+            st.number_input("Decimales (0 = según zoom)", min_value=0, max_value=15, value=0, key='enc_digits')
+            st.checkbox("TopoJSON en capas completas", value=False, key='enc_topojson',
+                        help="Capas de referencia de líneas/polígonos en modo 'Completa': bordes compartidos una sola vez.")
             
             if st.session_state['ref_layers']:
+                st.markdown("**Render Referencias**")
+                st.radio("Capas grandes", REF_LARGE_MODES, index=1, key='ref_large_mode',
+                         help="'Solo lo visible' envía las entidades de la vista actual simplificadas según el zoom. "
+                              "'Teselas vectoriales' sirve la capa como MVT desde un servidor local.")
+                st.number_input("Máx. entidades por capa", min_value=100, max_value=100000,
+                                value=DEFAULT_FEATURE_BUDGET, step=500, key='ref_feature_budget')
+
                 st.markdown("**Estilo Referencias**")
                 for name, layer in st.session_state['ref_layers'].items():
+                    c_visible, c_color = st.columns([1, 3])
+                    visible = c_visible.checkbox("Ver", value=layer.get('visible', True), key=f"ref_visible_{name}",
+                                                 help="Las capas ocultas no se dibujan y pueden volcarse a disco.")
+                    if visible != layer.get('visible', True):
+                        layer['visible'] = visible
+                        refresh_map(force=True)
+                        st.rerun()
                     if layer['type'] == 'vector':
                         current = layer.get('color', '#555555')
-                        new = st.color_picker(f"{name}", current)
+                        new = c_color.color_picker(f"{name}", current)
                         if new != current:
                             st.session_state['ref_layers'][name]['color'] = new
-                            st.session_state['map_key'] += 1
+                            refresh_map(force=True)
                             st.rerun()
+                    else:
+                        c_color.caption(name)
 
         # 3. BUSQUEDA
         with st.expander("� Buscador", expanded=False):
@@ -359,23 +584,154 @@ def main():
              if vector_layers:
                 sel_layer = st.selectbox("Capa", list(vector_layers.keys()))
                 if sel_layer:
-                    gdf_s = vector_layers[sel_layer]['data']
-                    cols_s = list(gdf_s.columns.drop('geometry'))
+                    layer_s = vector_layers[sel_layer]
+                    cols_s = layer_columns(layer_s)
                     col_id = st.selectbox("Campo", cols_s)
                     if col_id:
-                        val = st.selectbox("Valor", gdf_s[col_id].astype(str).unique())
-                        if st.button("� Localizar"):
-                             subset = gdf_s[gdf_s[col_id].astype(str) == val]
-                             if not subset.empty:
-                                 geom = subset.geometry.iloc[0]
-                                 minx, miny, maxx, maxy = geom.bounds
-                                 st.session_state['map_active_bounds'] = [[miny, minx], [maxy, maxx]]
-                                 st.session_state['map_key'] += 1
-                                 st.session_state['search_highlight'] = geom.__geo_interface__
+                        query = st.text_input("Buscar", placeholder="Prefijo o texto aproximado")
+                        # Una capa volcada a disco se vuelve a cargar solo al buscar en ella
+                        matches = []
+                        if query and ensure_resident(layer_s):
+                            gdf_s = layer_s['data']
+                            if 'search' not in layer_s:
+                                index_layer(layer_s)
+                            matches = layer_s['search'].search(col_id, query)
+                        if matches:
+                            choice = st.selectbox("Valor", matches, format_func=lambda m: f"{m[1]} ({m[2]})")
+                            if st.button("🔍 Localizar"):
+                                 rows, (minx, miny, maxx, maxy) = layer_s['search'].locate(col_id, choice[0])
+                                 focus_map([[miny, minx], [maxy, maxx]])
+                                 st.session_state['search_highlight'] = gdf_s.geometry.iloc[rows[:100]].__geo_interface__
                                  st.rerun()
+                        else:
+                            st.caption("Sin coincidencias.")
              else:
                  st.caption("Carga capas para buscar.")
 
+        # 4. CONSULTA ESPACIAL
+        with st.expander("📐 Consulta Espacial", expanded=False):
+            query_layers = [WORK_LAYER_LABEL] if not st.session_state['work_gdf'].empty else []
+            query_layers += [k for k, v in st.session_state['ref_layers'].items() if v['type'] == 'vector']
+            pending_q = st.session_state.get('pending_drawings', [])
+            if not query_layers:
+                st.caption("Carga capas para consultar.")
+            elif not pending_q:
+                st.caption("Dibuja un polígono, línea o punto: el último dibujo en espera es la geometría de consulta.")
+            else:
+                q_layer = st.selectbox("Capa", query_layers, key='sq_layer')
+                q_mode = st.radio("Consulta", SPATIAL_QUERY_MODES, key='sq_mode')
+                if q_mode == SPATIAL_QUERY_MODES[1]:
+                    q_n = st.number_input("Cantidad", min_value=1, max_value=1000, value=5)
+                elif q_mode == SPATIAL_QUERY_MODES[2]:
+                    q_dist = st.number_input("Metros", min_value=0.0, value=100.0, step=50.0)
+
+                q_ref = None if q_layer == WORK_LAYER_LABEL else st.session_state['ref_layers'][q_layer]
+                q_clicked = st.button("📐 Consultar")
+                if q_clicked and q_ref is not None and not ensure_resident(q_ref):
+                    st.error("La capa ya no está en la caché: vuelve a subirla.")
+                    q_clicked = False
+                if q_clicked:
+                    q_geom = shape(pending_q[-1]['geometry'])
+                    if q_ref is None:
+                        q_gdf, q_index = st.session_state['work_gdf'], work_layer_index()
+                    else:
+                        if 'sindex' not in q_ref:
+                            index_layer(q_ref)
+                        q_gdf, q_index = q_ref['data'], q_ref['sindex']
+                    q_distances = None
+                    if q_mode == SPATIAL_QUERY_MODES[0]:
+                        q_rows = q_index.intersecting(q_geom)
+                    elif q_mode == SPATIAL_QUERY_MODES[1]:
+                        q_rows, q_distances = q_index.nearest(q_geom, int(q_n), crs=q_gdf.crs or "EPSG:4326")
+                    else:
+                        q_rows, q_distances = q_index.within_distance(q_geom, q_dist, crs=q_gdf.crs or "EPSG:4326")
+
+                    st.session_state['spatial_result'] = {
+                        'layer': q_layer, 'rows': q_rows.tolist(),
+                        'distances': None if q_distances is None else q_distances.tolist(),
+                    }
+                    if len(q_rows):
+                        q_found = q_gdf.geometry.loc[q_rows]
+                        minx, miny, maxx, maxy = q_found.total_bounds
+                        focus_map([[miny, minx], [maxy, maxx]])
+                        st.session_state['search_highlight'] = q_found.iloc[:500].__geo_interface__
+                    st.rerun()
+
+            q_result = st.session_state.get('spatial_result')
+            if q_result and q_result['layer'] != WORK_LAYER_LABEL and q_result['layer'] in query_layers:
+                if not ensure_resident(st.session_state['ref_layers'][q_result['layer']]):
+                    q_result = None
+            if q_result and q_result['layer'] in query_layers:
+                q_gdf = st.session_state['work_gdf'] if q_result['layer'] == WORK_LAYER_LABEL else st.session_state['ref_layers'][q_result['layer']]['data']
+                st.caption(f"{len(q_result['rows'])} entidad(es) en '{q_result['layer']}'.")
+                if q_result['rows']:
+                    q_table = pd.DataFrame(q_gdf.loc[q_result['rows'][:200]].drop(columns=q_gdf.geometry.name))
+                    if q_result['distances'] is not None:
+                        q_table.insert(0, 'Distancia (m)', [round(d, 1) for d in q_result['distances'][:200]])
+                    st.dataframe(q_table, use_container_width=True, height=200)
+                    if q_result['layer'] == WORK_LAYER_LABEL and st.button("✔️ Seleccionar en tabla"):
+                        st.session_state['selected_ids'].update(q_result['rows'])
+                        refresh_map()
+                        st.rerun()
+
+        # 5. COMPARAR CAPAS
+        with st.expander("🔀 Comparar Capas", expanded=False):
+            vector_refs = [k for k, v in st.session_state['ref_layers'].items() if v['type'] == 'vector']
+            if len(vector_refs) < 2:
+                st.caption("Carga al menos dos capas vectoriales para compararlas.")
+            else:
+                diff_a = st.selectbox("Referencia (A)", vector_refs, key='diff_a')
+                diff_b = st.selectbox("Comparación (B)", [k for k in vector_refs if k != diff_a], key='diff_b')
+                layer_a, layer_b = st.session_state['ref_layers'][diff_a], st.session_state['ref_layers'][diff_b]
+                common_cols = [c for c in layer_columns(layer_a) if c in layer_columns(layer_b)]
+                diff_key = st.multiselect("Clave (vacío = por geometría)", common_cols, key='diff_key')
+                diff_tol = st.number_input("Tolerancia geométrica (m)", min_value=0.0, value=0.0, step=0.5, key='diff_tol')
+                diff_radius = diff_tol
+                if not diff_key:
+                    diff_radius = st.number_input("Radio de emparejamiento (m)", min_value=0.0, value=max(diff_tol, 1.0),
+                                                  step=1.0, key='diff_radius')
+
+                if st.button("🔀 Comparar"):
+                    with st.spinner("Comparando..."):
+                        try:
+                            if not (ensure_resident(layer_a) and ensure_resident(layer_b)):
+                                raise ValueError("una de las capas ya no está en la caché")
+                            out_csv, out_parquet = scratch.path(".csv"), scratch.path(".parquet")
+                            report = compare_layers(layer_a['data'], layer_b['data'], key=diff_key or None, tolerance=diff_tol,
+                                                    match_distance=diff_radius, out=[out_csv, out_parquet])
+                            st.session_state['diff_result'] = {'a': diff_a, 'b': diff_b, 'report': report}
+                        except (ValueError, OSError) as e:
+                            st.error(f"No se pudo comparar: {e}")
+
+            diff_result = st.session_state.get('diff_result')
+            if diff_result and os.path.exists(diff_result['report'].outputs[0]):
+                report = diff_result['report']
+                st.caption(f"'{diff_result['b']}' contra '{diff_result['a']}'")
+                st.dataframe(report.summary, hide_index=True, use_container_width=True)
+                st.dataframe(report.schema, hide_index=True, use_container_width=True, height=150)
+                st.write(" · ".join(f"{k}: **{v}**" for k, v in report.counts.items()))
+                out_csv, out_parquet = report.outputs
+                with open(out_csv, "rb") as f:
+                    st.download_button("⬇️ Diferencias (CSV)", f, file_name="diferencias.csv", mime="text/csv")
+                if sum(report.counts.values()) > report.counts['iguales'] and st.button("🗺️ Ver diferencias en el mapa"):
+                    diff_gdf = read_project(out_parquet)
+                    if diff_gdf.crs and diff_gdf.crs.to_string() != "EPSG:4326":
+                        diff_gdf = diff_gdf.to_crs(epsg=4326)
+                    add_ref_layer(f"Diferencias {diff_result['b']}", {'type': 'vector', 'data': diff_gdf, 'color': '#dc2626'})
+                    refresh_map(force=True)
+                    st.rerun()
+        profile.lap("barra lateral")
+
+        # 6. TRABAJOS EN SEGUNDO PLANO (se refrescan solos mientras haya alguno activo)
+        active_jobs = any(not job.done for job in map(scheduler.get, st.session_state.get('jobs', {})) if job)
+        with st.expander("⚙️ Trabajos", expanded=active_jobs):
+            st.fragment(render_jobs, run_every=JOB_POLL_SECONDS if active_jobs else None)()
+
+        # 7. DIAGNÓSTICO (se completa al final del rerun)
+        with st.expander("⏱️ Diagnóstico", expanded=False):
+            st.checkbox("Medir reruns", key='diagnostics',
+                        help="Tiempo por fase de cada rerun y bytes enviados por capa del mapa.")
+            diagnostics_panel = st.empty()
 
     # --- ZONA PRINCIPAL ---
     # Layout Simplicado: Mapa arriba, Tabla abajo.
@@ -383,12 +739,34 @@ def main():
     
     st.subheader("🌍 Mapa de Trabajo")
     
-    if 'Seleccionar' not in st.session_state['work_gdf'].columns:
-        st.session_state['work_gdf'].insert(0, 'Seleccionar', False)
     
     # Estado temporal para la vista (evita reset al mover el mapa)
     if 'last_view' not in st.session_state:
-        st.session_state['last_view'] = {'center': None, 'zoom': None}
+        st.session_state['last_view'] = {'center': None, 'zoom': None, 'bounds': None}
+
+    # Modo incremental: el mapa base (fondos, referencias, capa de trabajo, dibujo)
+    # solo cambia al remontarlo; lo que cambia a menudo (selección, pendientes,
+    # resaltados) va en grupos que st_folium reemplaza en el cliente sin
+    # reconstruir el mapa.
+    incremental = st.session_state.get('map_incremental', True)
+    dynamic_groups = []
+    enc_simplify = st.session_state.get('enc_simplify', True)
+    enc_digits = st.session_state.get('enc_digits', 0) or None
+    w_color = st.session_state.get('style_work_color', '#2563eb')
+
+    # La capa de trabajo va en el mapa base: se remonta solo cuando cambian sus
+    # geometrías (work_version) o cómo se dibuja, no en cada rerun.
+    work_render_key = (st.session_state['work_version'], enc_simplify, enc_digits)
+    if st.session_state.get('work_mounted') != work_render_key + (w_color,):
+        st.session_state['work_mounted'] = work_render_key + (w_color,)
+        refresh_map(force=True)
+
+    def dynamic_layer(name):
+        if not incremental:
+            return m
+        group = folium.FeatureGroup(name=name)
+        dynamic_groups.append(group)
+        return group
         
     # Crear mapa
     m = folium.Map(
@@ -406,69 +784,163 @@ def main():
         control=True
     ).add_to(m)
     
-    # Aplicar Zoom
+    # Aplicar Zoom (en modo incremental se pide al cliente sin remontar el mapa)
     if 'map_active_bounds' in st.session_state:
-        m.fit_bounds(st.session_state['map_active_bounds'])
+        if incremental:
+            st.session_state['map_view_request'] = bounds_to_center_zoom(st.session_state['map_active_bounds'])
+        else:
+            m.fit_bounds(st.session_state['map_active_bounds'])
         del st.session_state['map_active_bounds']
 
     # Highlight Búsqueda
     if 'search_highlight' in st.session_state:
+        profile.layer_bytes("Resultado Búsqueda", st.session_state['search_highlight'])
         folium.GeoJson(
             st.session_state['search_highlight'],
             name="Resultado Búsqueda",
             style_function=lambda x: {'color': 'orange', 'weight': 4, 'fillOpacity': 0.0, 'dashArray': '5, 5'}
-        ).add_to(m)
+        ).add_to(dynamic_layer("Resultado Búsqueda"))
     
     st.markdown("""<style>.leaflet-div-icon { background: #fff; border: 1px solid #666; border-radius: 50%; }</style>""", unsafe_allow_html=True)
     
     # RENDER REFERENCIAS
+    # Las capas grandes en modo "solo lo visible" van a un grupo dinámico: st_folium
+    # lo actualiza al mover el mapa sin volver a montar el componente.
+    large_mode = st.session_state.get('ref_large_mode', REF_LARGE_MODES[1])
+    feature_budget = st.session_state.get('ref_feature_budget', DEFAULT_FEATURE_BUDGET)
+    enc_topojson = st.session_state.get('enc_topojson', False)
+    view_zoom = st.session_state['last_view']['zoom'] or st.session_state['map_zoom']
+    view_bbox = folium_bounds_to_bbox(st.session_state['last_view'].get('bounds')) or view_bounds_from_center(
+        st.session_state['last_view']['center'] or st.session_state['map_center'], view_zoom)
+    viewport_group = folium.FeatureGroup(name="Referencias (vista)")
+    viewport_used = False
+
     for name, layer in st.session_state['ref_layers'].items():
+        if not layer.get('visible', True):
+            continue
         if layer['type'] == 'vector':
+            if not ensure_resident(layer):
+                st.caption(f"'{name}' ya no está en la caché: vuelve a subirla.")
+                continue
             valid_tooltip_cols = [c for c in layer['data'].columns if c != 'geometry' and c != 'style']
             tooltip_fields = valid_tooltip_cols[:3]
             layer_color = layer.get('color', '#555555')
+            layer_data = layer['data']
+            target = m
+
+            if large_mode == REF_LARGE_MODES[2] and len(layer_data) > feature_budget:
+                # Teselas MVT desde el servidor local: el navegador pide solo lo que ve
+                tiles = layer_tiles(layer, tuple(tooltip_fields),
+                                    lambda layer_data=layer_data, fields=tooltip_fields: vector_tile_source(layer_data, fields))
+                VectorGridProtobuf(
+                    tiles.url,
+                    name=f"Ref: {name}", options=vector_grid_style(layer_color)
+                ).add_to(m)
+                continue
+
+            if large_mode == REF_LARGE_MODES[1] and len(layer_data) > feature_budget:
+                layer_data, in_view = viewport_subset(layer_data, view_bbox, view_zoom, feature_budget)
+                if in_view > len(layer_data):
+                    st.caption(f"'{name}': {len(layer_data)} de {in_view} entidades en vista (acerca el zoom para ver todas).")
+                target = viewport_group
+                viewport_used = True
+                if layer_data.empty:
+                    continue
+                # Ya simplificada para la vista: solo se cuantiza
+                layer_data = encode_geometries(layer_data, view_zoom, simplify=False, digits=enc_digits)
+                profile.layer_bytes(f"Ref: {name} (vista)", layer_data)
+            else:
+                # Capa montada con el mapa: se codifica una vez a zoom de detalle y se guarda
+                use_topojson = enc_topojson and is_topojson_candidate(layer_data)
+                params = (enc_simplify, enc_digits, use_topojson, tuple(tooltip_fields))
+
+                def build_encoded(layer_data=layer_data, use_topojson=use_topojson, tooltip_fields=tooltip_fields):
+                    encoded = encode_geometries(layer_data, STATIC_DETAIL_ZOOM, simplify=enc_simplify,
+                                                digits=enc_digits, coverage=use_topojson)
+                    return to_topojson(encoded, properties=tooltip_fields) if use_topojson else encoded
+
+                # Compartida entre sesiones si la capa viene del almacén
+                if layer.get('handle'):
+                    layer_data = layer['handle'].derived(('encoded',) + params, build_encoded)
+                else:
+                    if layer.get('encoded', (None,))[0] != params:
+                        layer['encoded'] = (params, build_encoded())
+                    layer_data = layer['encoded'][1]
+                profile.layer_bytes(f"Ref: {name}", layer_data)
+                if use_topojson:
+                    folium.TopoJson(
+                        layer_data, "objects.data", name=f"Ref: {name}",
+                        style_function=lambda x, col=layer_color: {'color': col, 'weight': 1, 'fillOpacity': 0.1},
+                        tooltip=folium.GeoJsonTooltip(fields=tooltip_fields) if tooltip_fields else None
+                    ).add_to(m)
+                    continue
             
             folium.GeoJson(
-                layer['data'], name=f"Ref: {name}",
+                layer_data, name=f"Ref: {name}",
                 style_function=lambda x, col=layer_color: {'color': col, 'weight': 1, 'fillOpacity': 0.1},
                 tooltip=folium.GeoJsonTooltip(fields=tooltip_fields) if tooltip_fields else None,
                 popup=folium.GeoJsonPopup(fields=valid_tooltip_cols, localize=True) if valid_tooltip_cols else None
-            ).add_to(m)
+            ).add_to(target)
         elif layer['type'] == 'raster':
+            if not os.path.exists(layer['data']):
+                continue # PNG expulsado de la caché en disco
+            profile.layer_bytes(f"Img: {name}", layer['data'])
             folium.raster_layers.ImageOverlay(
                 image=layer['data'], bounds=layer['bounds'], opacity=0.6, name=f"Img: {name}"
             ).add_to(m)
+        elif layer['type'] == 'raster_tiles':
+            if not os.path.exists(layer['data']):
+                continue # GeoTIFF expulsado de la caché en disco
+            tiles = layer_tiles(layer, (), lambda layer=layer: raster_tile_source(layer['data'], layer.get('tiles_dir')))
+            folium.TileLayer(
+                tiles=tiles.url, attr=name, name=f"Img: {name}", overlay=True, control=True,
+                opacity=0.8, max_native_zoom=tiles.max_zoom, max_zoom=22, bounds=layer['bounds']
+            ).add_to(m)
+
+    # Presupuesto de memoria: se vuelcan a disco las capas que no se usaron en este rerun
+    enforce_budget(st.session_state['ref_layers'], since=rerun_started)
+    if memory_panel is not None:
+        render_memory(memory_panel)
+    profile.lap("referencias")
 
     # CAPA DE TRABAJO
     wgdf = st.session_state['work_gdf']
-    w_color = st.session_state.get('style_work_color', '#2563eb')
     
     if not wgdf.empty:
-        st.session_state['work_gdf']['Seleccionar'] = st.session_state['work_gdf']['Seleccionar'].astype(bool)
-        selected_mask = wgdf['Seleccionar']
-        
-        if not wgdf[~selected_mask].empty:
-            folium.GeoJson(
-                wgdf[~selected_mask].drop(columns=['Seleccionar']), name="Datos",
-                style_function=lambda x: {'color': w_color, 'weight': 3, 'fillOpacity': 0.4},
-                marker=folium.CircleMarker(radius=4, fill_color=w_color, fill_opacity=0.6, color='white', weight=1)
-            ).add_to(m)
-        if not wgdf[selected_mask].empty:
+        # La capa se serializa (solo geometría e id) una vez por versión de los datos, a
+        # zoom de detalle; la selección es un subconjunto por id dibujado encima, sin copiar la capa.
+        cached_render = st.session_state.get('work_render')
+        if cached_render is None or cached_render[0] != work_render_key:
+            geometry_only = wgdf[[wgdf.geometry.name]]
+            encoded = encode_geometries(geometry_only, STATIC_DETAIL_ZOOM, simplify=enc_simplify, digits=enc_digits)
+            cached_render = st.session_state['work_render'] = (work_render_key,) + feature_collection(encoded)
+        _, work_collection, work_features = cached_render
+        selected_features = [work_features[i] for i in st.session_state['selected_ids'] if i in work_features]
+        profile.layer_bytes("Datos", work_collection)
+
+        folium.GeoJson(
+            work_collection, name="Datos",
+            style_function=lambda x: {'color': w_color, 'weight': 3, 'fillOpacity': 0.4},
+            marker=folium.CircleMarker(radius=4, fill_color=w_color, fill_opacity=0.6, color='white', weight=1)
+        ).add_to(m)
+        if selected_features:
+            profile.layer_bytes("Seleccionados", selected_features)
             folium.GeoJson(
-                wgdf[selected_mask].drop(columns=['Seleccionar']), name="Seleccionados",
+                {"type": "FeatureCollection", "features": selected_features}, name="Seleccionados",
                 style_function=lambda x: {'color': '#ef4444', 'weight': 5, 'fillOpacity': 0.7},
                 marker=folium.CircleMarker(radius=6, fill_color='#ef4444', fill_opacity=0.9, color='black', weight=2)
-            ).add_to(m)
+            ).add_to(dynamic_layer("Seleccionados"))
 
     # DIBUJOS PENDIENTES (Visualización Persistente)
     pending = st.session_state.get('pending_drawings', [])
     if pending:
+        profile.layer_bytes("Dibujos en Espera", pending)
         folium.GeoJson(
             {"type": "FeatureCollection", "features": pending},
             name="Dibujos en Espera",
             style_function=lambda x: {'color': '#f59e0b', 'weight': 3, 'dashArray': '5, 5', 'fillOpacity': 0.2},
             tooltip="Elemento no guardado"
-        ).add_to(m)
+        ).add_to(dynamic_layer("Dibujos en Espera"))
 
     # DIBUJO
     draw = Draw(
@@ -482,13 +954,28 @@ def main():
     draw.add_to(m)
     folium.LayerControl().add_to(m)
     
+    profile.lap("capa de trabajo")
+
     # RENDER ST_FOLIUM
-    # Restringimos returned_objects para evitar recargas excesivas al mover el mapa (bounds, etc).
+    # Restringimos returned_objects a lo necesario: bounds solo alimenta el render por vista
+    # de referencias ("Solo lo visible"), así que se pide únicamente si alguna capa lo usa.
+    returned_objects = ["all_drawings", "zoom", "center"]
+    if viewport_used:
+        dynamic_groups.insert(0, viewport_group)
+        returned_objects.append("bounds")
+    else:
+        # Sin seguimiento de la vista, unos bounds guardados quedarían obsoletos
+        st.session_state['last_view']['bounds'] = None
+    view_request = st.session_state.get('map_view_request') if incremental else None
     output = st_folium(
         m, width="100%", height=500, 
         key=f"map_{st.session_state['map_key']}",
-        returned_objects=["all_drawings", "zoom", "center"]
+        returned_objects=returned_objects,
+        feature_group_to_add=dynamic_groups if (incremental or viewport_used) else None,
+        center=view_request[0] if view_request else None,
+        zoom=view_request[1] if view_request else None
     )
+    profile.lap("st_folium")
     
     # Persistir Vista (Solo en memoria temporal, NO en el state que reinicia el mapa)
     if output:
@@ -496,6 +983,8 @@ def main():
              st.session_state['last_view']['center'] = [output["center"]["lat"], output["center"]["lng"]]
         if "zoom" in output and output["zoom"]:
              st.session_state['last_view']['zoom'] = output["zoom"]
+        if "bounds" in output and folium_bounds_to_bbox(output["bounds"]):
+             st.session_state['last_view']['bounds'] = output["bounds"]
 
     # LOGICA DE CAPTURA ROBUSTA
     if output and "all_drawings" in output:
@@ -513,32 +1002,33 @@ def main():
             # Capturamos lo nuevo, lo agregamos a pending, y forzamos rerun.
             # Al hacer rerun, el mapa se regenera (Draw vacío) y mostramos los items como GeoJson fijo.
             
-            import json
             current_pending = st.session_state.get('pending_drawings', [])
             
-            # Deduplicación básica usando GeoJSON string
-            # (El cliente puede devolver lo mismo si no hubo reset, evitamos duplicados)
-            existing_geoms = {json.dumps(f['geometry'], sort_keys=True) for f in current_pending}
+            # Deduplicación por clave canónica de la geometría (el cliente devuelve
+            # también lo ya capturado). Con el mapa montado, el cliente sigue devolviendo
+            # dibujos ya guardados o descartados: el índice recuerda los de este montaje.
+            drawing_index = st.session_state.get('drawing_index')
+            if drawing_index is None or drawing_index.count != len(current_pending):
+                drawing_index = st.session_state['drawing_index'] = DrawingIndex(current_pending)
+            drawing_index.mount(st.session_state['map_key'])
             
             added_count = 0
             for f in features_captured:
-                f_geom_str = json.dumps(f['geometry'], sort_keys=True)
-                if f_geom_str not in existing_geoms:
+                if drawing_index.add(f):
                     current_pending.append(f)
-                    existing_geoms.add(f_geom_str)
                     added_count += 1
             
             if added_count > 0:
                 st.session_state['pending_drawings'] = current_pending
                 
                 # Sincronizar vista para que no se resetee al redibujar el mapa
-                if st.session_state['last_view']['center']:
-                     st.session_state['map_center'] = st.session_state['last_view']['center']
-                if st.session_state['last_view']['zoom']:
-                     st.session_state['map_zoom'] = st.session_state['last_view']['zoom']
+                if not incremental:
+                    sync_map_view()
                 
                 st.rerun()
 
+    profile.lap("captura")
+
     # MENU DE GUARDADO (Si hay pendientes)
     final_features = st.session_state.get('pending_drawings', [])
     if final_features:
@@ -552,21 +1042,23 @@ def main():
                 for col in st.session_state['work_gdf'].columns:
                     if col not in new_gdf.columns and col != 'geometry':
                          # Inicializar vacíos. Cuidado con tipos.
-                        new_gdf[col] = False if col == 'Seleccionar' else None
+                        new_gdf[col] = None
                 
-                # Concatenar
-                st.session_state['work_gdf'] = pd.concat([st.session_state['work_gdf'], new_gdf], ignore_index=True)
+                # Concatenar con ids nuevos (los existentes no cambian)
+                new_gdf = with_feature_ids(new_gdf, start=st.session_state['next_fid'])
+                st.session_state['next_fid'] += len(new_gdf)
+                st.session_state['work_gdf'] = pd.concat([st.session_state['work_gdf'], new_gdf])
+                if st.session_state.get('work_index') is not None:
+                    st.session_state['work_index'].add(list(new_gdf.geometry), new_gdf.index.tolist())
+                st.session_state['work_version'] += 1
+                journal_record('log_insert', new_gdf)
                 
-                # Sincronizar vista antes de recargar
-                if st.session_state['last_view']['center']:
-                     st.session_state['map_center'] = st.session_state['last_view']['center']
-                if st.session_state['last_view']['zoom']:
-                     st.session_state['map_zoom'] = st.session_state['last_view']['zoom']
-
-                st.session_state['map_key'] += 1
+                refresh_map()
                 
                 # Limpiar pendientes tras guardar
                 st.session_state['pending_drawings'] = []
+                if 'drawing_index' in st.session_state:
+                    st.session_state['drawing_index'].clear()
                 
                 st.success("Guardado ok")
                 st.rerun()
@@ -575,6 +1067,10 @@ def main():
         
         if c_clear.button("🗑️ Descartar Pendientes"):
              st.session_state['pending_drawings'] = []
+             if 'drawing_index' in st.session_state:
+                 st.session_state['drawing_index'].clear()
+             # Remontar para vaciar también la capa de dibujo del cliente
+             refresh_map(force=True)
              st.rerun()
 
     # TABLA (Abajo)
@@ -582,21 +1078,63 @@ def main():
     st.subheader("📋 Tabla de Atributos")
     
     if not st.session_state['work_gdf'].empty:
-        cols = ['Seleccionar'] + [c for c in st.session_state['work_gdf'].columns if c != 'Seleccionar' and c != 'geometry']
-        
-        edited_df = st.data_editor(
-            st.session_state['work_gdf'][cols],
+        # "Seleccionar" es la columna de selección de la vista, no un campo de la capa
+        cols = [c for c in st.session_state['work_gdf'].columns
+                if c not in (st.session_state['work_gdf'].geometry.name, 'Seleccionar')]
+
+        # Tabla por páginas: filtro y orden en el servidor, al navegador solo va la página
+        t_filter_col, t_filter_text, t_sort, t_desc, t_size = st.columns([2, 3, 2, 1, 1])
+        filter_col = t_filter_col.selectbox("Filtrar por", cols, key='table_filter_col')
+        filter_text = t_filter_text.text_input("Contiene", key='table_filter_text')
+        sort_by = t_sort.selectbox("Ordenar por", [FEATURE_ID] + cols, key='table_sort')
+        descending = t_desc.checkbox("Desc.", key='table_desc')
+        page_size = t_size.selectbox("Filas", TABLE_PAGE_SIZES, index=1, key='table_page_size')
+
+        wgdf = st.session_state['work_gdf']
+        page = st.session_state.get('table_page', 1) - 1
+        page_df, n_filtered = table_page(wgdf, cols, sort_by=sort_by, descending=descending,
+                                         filter_col=filter_col, filter_text=filter_text,
+                                         page=page, page_size=page_size)
+        n_pages = max(1, -(-n_filtered // page_size))
+        if page >= n_pages:
+            # El filtro o los borrados dejaron la página fuera de rango: ir a la última
+            page = n_pages - 1
+            page_df, n_filtered = table_page(wgdf, cols, sort_by=sort_by, descending=descending,
+                                             filter_col=filter_col, filter_text=filter_text,
+                                             page=page, page_size=page_size)
+            st.session_state['table_page'] = n_pages
+        t_page, t_info = st.columns([1, 4])
+        t_page.number_input("Página", min_value=1, max_value=n_pages, key='table_page')
+        t_info.caption(f"Filas {page * page_size + 1 if n_filtered else 0}–{page * page_size + len(page_df)} "
+                       f"de {n_filtered} ({len(wgdf)} en la capa).")
+
+        page_df.insert(0, 'Seleccionar', page_df.index.isin(st.session_state['selected_ids']))
+
+        # Ids de las filas mostradas: el callback traduce posiciones de la tabla a ids.
+        # Cada vista (página, orden, filtro) tiene su propia clave de editor.
+        st.session_state['table_view_ids'] = page_df.index.to_numpy()
+        view_key = hash((filter_col, filter_text, sort_by, descending, page, page_size,
+                         st.session_state.get('table_version', 0)))
+        editor_key = f"data_editor_{view_key}"
+        st.data_editor(
+            page_df,
             num_rows="dynamic", 
             use_container_width=True,
-            key="data_editor",
+            key=editor_key,
             column_config={"Seleccionar": st.column_config.CheckboxColumn("Ver", width="small")},
-            on_change=handle_table_edit
+            on_change=handle_table_edit,
+            args=(editor_key,)
         )
         
         # Sincronización manejada por callback 'handle_table_edit' para evitar doble refresco y perdida de foco.
         pass
     else:
         st.info("No hay datos aún.")
+    profile.lap("tabla")
+
+    if profile.enabled:
+        render_diagnostics(diagnostics_panel, profile)
 
 if __name__ == "__main__":
-    main()
+    with profile_rerun(st.session_state):
+        main()
@@ -0,0 +1,384 @@
+"""Benchmarks de los caminos críticos, sin Streamlit.
+
+Cada caso genera datos sintéticos (N entidades con V vértices, rasters de
+W×H), mide el tiempo de pared de la operación (mejor y mediana de varias
+repeticiones), el pico de RSS y los bytes que produce o consume, y compara
+con una línea base guardada en JSON. Cada caso corre en un proceso aparte
+para que el pico de RSS sea suyo y las cachés no se hereden entre casos.
+
+    python benchmarks.py                      # ejecutar y comparar con la base (código 1 si hay
+                                              # regresiones, casos con error o casos de la base sin ejecutar)
+    python benchmarks.py --save-baseline      # ejecutar y guardar como base
+    python benchmarks.py --quick --only render_work_layer table_edit
+
+Casos:
+- ingest_shp / ingest_kml: lectura desde bytes + to_crs + caché (ingest.run_job).
+- ingest_raster: GeoTIFF en memoria -> PNG reproyectado (ingest.run_job).
+- render_work_layer: codificación + FeatureCollection + HTML de folium.
+- render_topojson: codificación de cobertura + TopoJSON de una capa de referencia.
+- table_edit: apply_edits de una página editada (lo que hace handle_table_edit); la
+  página y su Arrow se preparan fuera del tiempo medido.
+- search: índice del Buscador + consultas y ubicación de resultados.
+
+Los bytes son la salida hacia el navegador (HTML, TopoJSON, PNG, página Arrow,
+sugerencias) o, en la ingesta de vectores, los bytes subidos.
+
+El código se escribe como si ejecutara la app: las carpetas de caché y de
+scratch se redirigen a un temporal antes de importar nada del proyecto.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# Tolerancia antes de marcar una regresión (fracción sobre la base)
+DEFAULT_TOLERANCE = 0.25
+# Métricas que se comparan con la base
+COMPARED_METRICS = ("best_s", "peak_rss_mb", "payload_bytes")
+
+# Tamaños por defecto y en modo --quick
+SIZES = {
+    "full": {"features": 20000, "vertices": 32, "raster": 4096, "repeat": 5},
+    "quick": {"features": 2000, "vertices": 16, "raster": 1024, "repeat": 3},
+}
+
+
+# --- DATOS SINTÉTICOS ---
+def synthetic_polygons(n, vertices=16, seed=0, crs="EPSG:32719"):
+    """N polígonos estrellados de `vertices` vértices en una rejilla (UTM 19S por defecto)."""
+    import geopandas as gpd
+    import numpy as np
+    import shapely
+
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n)))
+    cx = 340000 + (np.arange(n) % side) * 120.0
+    cy = 6290000 + (np.arange(n) // side) * 120.0
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = 30 + 25 * rng.random((n, vertices))
+    x = cx[:, None] + radii * np.cos(angles)
+    y = cy[:, None] + radii * np.sin(angles)
+    rings = np.stack([x, y], axis=-1)
+    rings = np.concatenate([rings, rings[:, :1]], axis=1)
+    geoms = shapely.polygons(rings)
+    names = np.array(["Alameda", "Bellavista", "Cerrillos", "Ñuñoa", "Providencia", "Recoleta"])
+    return gpd.GeoDataFrame({
+        "nombre": [f"{names[i % len(names)]} {i}" for i in range(n)],
+        "valor": rng.random(n),
+        "clase": rng.integers(0, 10, n),
+    }, geometry=geoms, crs=crs)
+
+
+def synthetic_points(n, seed=0):
+    """N puntos en EPSG:4326 alrededor de Santiago."""
+    import geopandas as gpd
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    return gpd.GeoDataFrame({"n": np.arange(n)}, crs="EPSG:4326",
+                            geometry=gpd.points_from_xy(-70.9 + rng.random(n) * 0.5, -33.7 + rng.random(n) * 0.5))
+
+
+def shapefile_files(gdf):
+    """[(nombre, bytes)] de un Shapefile, como los entrega el cargador de archivos."""
+    with tempfile.TemporaryDirectory() as tmp:
+        gdf.to_file(os.path.join(tmp, "capa.shp"))
+        files = []
+        for name in sorted(os.listdir(tmp)):
+            with open(os.path.join(tmp, name), "rb") as f:
+                files.append((name, f.read()))
+    return files
+
+
+def kml_bytes(gdf):
+    import io
+
+    buffer = io.BytesIO()
+    gdf.to_crs(epsg=4326).to_file(buffer, driver="KML")
+    return buffer.getvalue()
+
+
+def geotiff_bytes(width, height, bands=3, seed=0):
+    """GeoTIFF uint8 de W×H en UTM 19S (obliga a reproyectar)."""
+    import numpy as np
+    from rasterio.io import MemoryFile
+    from rasterio.transform import from_origin
+
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    data = np.stack([((xx + yy * (b + 1)) % 256).astype(np.uint8) for b in range(bands)])
+    data[:, rng.random((height, width)) < 0.01] = 0
+    profile = {"driver": "GTiff", "width": width, "height": height, "count": bands, "dtype": "uint8",
+               "crs": "EPSG:32719", "transform": from_origin(340000, 6300000, 2.0, 2.0),
+               "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate"}
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(data)
+        return memfile.read()
+
+
+# --- CASOS ---
+# Cada caso recibe los tamaños y devuelve (preparar, ejecutar): preparar() arma
+# los datos (no se mide) y ejecutar(estado) devuelve los bytes de salida/entrada.
+def case_ingest_shp(sizes):
+    from ingest import IngestJob, run_job
+
+    def setup():
+        return shapefile_files(synthetic_polygons(sizes["features"], sizes["vertices"]))
+
+    def run(files):
+        run_job(IngestJob("capa.shp", "vector", f"bench-shp-{time.perf_counter_ns()}", files))
+        return sum(len(data) for _, data in files)
+    return setup, run
+
+
+def case_ingest_kml(sizes):
+    from ingest import IngestJob, run_job
+
+    def setup():
+        return kml_bytes(synthetic_polygons(sizes["features"] // 4, sizes["vertices"]))
+
+    def run(data):
+        run_job(IngestJob("capa.kml", "vector", f"bench-kml-{time.perf_counter_ns()}", [("capa.kml", data)]))
+        return len(data)
+    return setup, run
+
+
+def case_ingest_raster(sizes):
+    from ingest import IngestJob, run_job
+    from layer_cache import shared_cache
+
+    def setup():
+        return geotiff_bytes(sizes["raster"], sizes["raster"])
+
+    def run(data):
+        key = run_job(IngestJob("imagen.tif", "raster", f"bench-tif-{time.perf_counter_ns()}", [("imagen.tif", data)]))
+        return os.path.getsize(shared_cache.get(key)["data"])
+    return setup, run
+
+
+def case_render_work_layer(sizes):
+    import folium
+
+    from map_encoding import STATIC_DETAIL_ZOOM, encode_geometries, feature_collection
+    from work_layer import with_feature_ids
+
+    def setup():
+        return with_feature_ids(synthetic_polygons(sizes["features"], sizes["vertices"]).to_crs(epsg=4326))
+
+    def run(gdf):
+        encoded = encode_geometries(gdf[[gdf.geometry.name]], STATIC_DETAIL_ZOOM)
+        collection, _ = feature_collection(encoded)
+        m = folium.Map(location=[-33.45, -70.66], zoom_start=12, tiles=None)
+        folium.GeoJson(collection, name="Datos").add_to(m)
+        return len(m.get_root().render().encode())
+    return setup, run
+
+
+def case_render_topojson(sizes):
+    from map_encoding import STATIC_DETAIL_ZOOM, encode_geometries, to_topojson
+
+    def setup():
+        return synthetic_polygons(sizes["features"], sizes["vertices"]).to_crs(epsg=4326)
+
+    def run(gdf):
+        encoded = encode_geometries(gdf, STATIC_DETAIL_ZOOM, coverage=True)
+        return len(json.dumps(to_topojson(encoded, ["nombre"])).encode())
+    return setup, run
+
+
+def case_table_edit(sizes):
+    import numpy as np
+    import pyarrow as pa
+
+    from work_layer import apply_edits, table_page, with_feature_ids
+
+    n = sizes["features"] * 10
+
+    def setup():
+        gdf = with_feature_ids(synthetic_points(n).assign(texto=None, valor=np.arange(n, dtype=float)))
+        page, _ = table_page(gdf, ["texto", "valor"], sort_by="valor", descending=True, page=3, page_size=100)
+        # Lo que viaja al navegador: la página como Arrow
+        sink = pa.BufferOutputStream()
+        table = pa.Table.from_pandas(page)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        # apply_edits modifica la capa: una copia por repetición, hecha fuera del tiempo medido
+        copies = [gdf.copy() for _ in range(sizes["repeat"])]
+        return copies, page.index.to_numpy(), sink.getvalue().size
+
+    def run(state):
+        copies, view_ids, payload = state
+        changes = {
+            "edited_rows": {i: {"texto": f"t{i}", "valor": float(i)} for i in range(0, 100, 2)},
+            "deleted_rows": [1, 3, 5],
+        }
+        apply_edits(copies.pop(), view_ids, changes)
+        return payload
+    return setup, run
+
+
+def case_search(sizes):
+    from search_index import LayerSearchIndex
+
+    queries = ["ala", "bella", "ñuño", "provdencia", "recoleta 12", "cerrillos 9"]
+
+    def setup():
+        return synthetic_polygons(sizes["features"] * 5, 5).to_crs(epsg=4326)
+
+    def run(gdf):
+        index = LayerSearchIndex(gdf)
+        found = []
+        for query in queries:
+            for value_id, value, count in index.search("nombre", query):
+                found.append((str(value), count, index.locate("nombre", value_id)[1]))
+        return len(json.dumps(found).encode())
+    return setup, run
+
+
+CASES = {
+    "ingest_shp": case_ingest_shp,
+    "ingest_kml": case_ingest_kml,
+    "ingest_raster": case_ingest_raster,
+    "render_work_layer": case_render_work_layer,
+    "render_topojson": case_render_topojson,
+    "table_edit": case_table_edit,
+    "search": case_search,
+}
+
+
+# --- EJECUCIÓN ---
+def _rss_mb():
+    # ru_maxrss: pico del proceso en KB (Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(name, sizes):
+    """Ejecuta un caso en este proceso. Retorna sus métricas."""
+    setup, run = CASES[name](sizes)
+    state = setup()
+    setup_rss = _rss_mb()
+    times, payload = [], 0
+    for _ in range(sizes["repeat"]):
+        start = time.perf_counter()
+        payload = run(state)
+        times.append(time.perf_counter() - start)
+    return {
+        "best_s": round(min(times), 4),
+        "median_s": round(statistics.median(times), 4),
+        "peak_rss_mb": round(_rss_mb(), 1),
+        "run_rss_mb": round(_rss_mb() - setup_rss, 1),
+        "payload_bytes": payload,
+    }
+
+
+def run_isolated(name, sizes, workdir):
+    """Ejecuta un caso en un proceso nuevo con caché y scratch propios."""
+    env = dict(os.environ,
+               GEOEDITOR_CACHE_DIR=os.path.join(workdir, "cache"),
+               GEOEDITOR_SCRATCH_DIR=os.path.join(workdir, "scratch"))
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", name, "--sizes", json.dumps(sizes)],
+                          env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": (proc.stderr.strip().splitlines() or ["falló"])[-1]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """{caso: {métrica: cambio relativo}} de lo que empeoró más que `tolerance`."""
+    regressions = {}
+    for name, metrics in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base or "error" in metrics:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = base.get(metric), metrics.get(metric)
+            if old and new is not None and (new - old) / old > tolerance:
+                regressions.setdefault(name, {})[metric] = (new - old) / old
+    return regressions
+
+
+def _format_row(name, metrics, base):
+    if "error" in metrics:
+        return f"{name:<20} ERROR {metrics['error']}"
+    row = f"{name:<20} {metrics['best_s']:>9.4f} {metrics['median_s']:>9.4f} {metrics['peak_rss_mb']:>9.1f} " \
+          f"{metrics['run_rss_mb']:>8.1f} {metrics['payload_bytes']:>12}"
+    if base and base.get("best_s"):
+        row += f" {metrics['best_s'] / base['best_s']:>7.2f}x"
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(CASES), help="casos a ejecutar")
+    parser.add_argument("--quick", action="store_true", help="tamaños pequeños")
+    parser.add_argument("--features", type=int, help="entidades por capa")
+    parser.add_argument("--vertices", type=int, help="vértices por polígono")
+    parser.add_argument("--raster", type=int, help="lado del raster en píxeles")
+    parser.add_argument("--repeat", type=int, help="repeticiones por caso")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="archivo JSON de la línea base")
+    parser.add_argument("--save-baseline", action="store_true", help="guardar los resultados como base")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="regresión tolerada (fracción)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--sizes", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        # Proceso hijo: un solo caso, resultado como JSON en la última línea
+        print(json.dumps(run_case(args.case, json.loads(args.sizes))))
+        return 0
+
+    sizes = dict(SIZES["quick" if args.quick else "full"])
+    for option in ("features", "vertices", "raster", "repeat"):
+        if getattr(args, option):
+            sizes[option] = getattr(args, option)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("sizes") != sizes:
+            print(f"Aviso: la base se midió con otros tamaños ({baseline.get('sizes')})")
+
+    print(f"Tamaños: {sizes}")
+    print(f"{'caso':<20} {'mejor s':>9} {'mediana s':>9} {'RSS MB':>9} {'+RSS MB':>8} {'bytes':>12} {'vs base':>8}")
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="geoeditor-bench-") as workdir:
+        for name in args.only or CASES:
+            results[name] = run_isolated(name, sizes, workdir)
+            print(_format_row(name, results[name], baseline.get("results", {}).get(name)), flush=True)
+
+    failed = [name for name, metrics in results.items() if "error" in metrics]
+    for name in failed:
+        print(f"ERROR {name}: {results[name]['error']}")
+
+    if args.save_baseline:
+        if failed:
+            print("Base no guardada: hay casos con error")
+            return 1
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"sizes": sizes, "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "cpus": os.cpu_count(), "results": results}, f, indent=2)
+        print(f"Base guardada en {args.baseline}")
+        return 0
+
+    # Sin --only deben estar todos los casos de la base (uno renombrado o quitado no pasa en silencio)
+    missing = [] if args.only else sorted(set(baseline.get("results", {})) - set(results))
+    for name in missing:
+        print(f"ERROR {name}: está en la base pero no se ejecutó")
+
+    regressions = compare(results, baseline, args.tolerance) if baseline else {}
+    for name, metrics in regressions.items():
+        for metric, change in metrics.items():
+            print(f"REGRESIÓN {name}: {metric} +{change:.0%}")
+    return 1 if regressions or failed or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
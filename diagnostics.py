@@ -0,0 +1,140 @@
+"""Diagnóstico de reruns: tiempo por fase y bytes enviados por capa.
+
+Con el modo diagnóstico activo (casilla en la barra lateral o la variable
+GEOEDITOR_DIAGNOSTICS=1) cada rerun de main() se cronometra por fases
+(estado inicial, barra lateral, referencias, capa de trabajo, st_folium,
+captura, tabla) y se mide lo que se serializa para cada capa del mapa. Las
+capas se anotan durante su fase y se miden al pedir el registro, fuera de los
+tiempos (serializarlas para medirlas inflaría la fase).
+Cada rerun queda como un registro en el historial de la sesión, se escribe
+como una línea JSON en el logger "geoeditor.diagnostics" y, si se define
+GEOEDITOR_DIAGNOSTICS_LOG, se añade a ese archivo (JSONL).
+
+Desactivado no mide nada: lap() y layer_bytes() retornan sin hacer nada.
+"""
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DIAGNOSTICS_DEFAULT = os.environ.get("GEOEDITOR_DIAGNOSTICS", "") not in ("", "0")
+DIAGNOSTICS_LOG = os.environ.get("GEOEDITOR_DIAGNOSTICS_LOG")
+# Reruns que se guardan en la sesión
+HISTORY_SIZE = 50
+
+logger = logging.getLogger("geoeditor.diagnostics")
+
+
+def payload_size(data):
+    """Bytes que folium embebe para `data` (GeoDataFrame, dict, lista o ruta de imagen).
+
+    Una imagen local viaja como data URI en base64: se cuenta ese tamaño, no el del archivo.
+    """
+    if data is None:
+        return 0
+    if hasattr(data, "to_json"):
+        return len(data.to_json().encode())
+    if isinstance(data, str) and os.path.exists(data):
+        header = f"data:image/{os.path.splitext(data)[1][1:]};base64,"
+        return len(header) + 4 * ((os.path.getsize(data) + 2) // 3)
+    return len(json.dumps(data, default=str).encode())
+
+
+class RerunProfile:
+    """Tiempos por fase y bytes por capa de un rerun."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.time()
+        self.phases = {}
+        self._payloads = []  # (capa, datos) anotados; se miden en `layers`
+        self._layers = None
+        self.interrupted = False
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        """Cierra la fase `phase`: el tiempo desde el lap anterior (o el inicio)."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last)
+        self._last = now
+
+    def layer_bytes(self, name, data):
+        """Anota los datos de una capa; se miden después, fuera de las fases."""
+        if self.enabled:
+            self._payloads.append((name, data))
+            self._layers = None
+
+    @property
+    def layers(self):
+        """{capa: bytes} de las capas anotadas (se miden la primera vez que se piden)."""
+        if self._layers is None:
+            self._layers = {}
+            for name, data in self._payloads:
+                self._layers[name] = self._layers.get(name, 0) + payload_size(data)
+        return self._layers
+
+    def total(self):
+        return sum(self.phases.values())
+
+    def record(self):
+        return {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "total_s": round(self.total(), 4),
+            "phases": {k: round(v, 4) for k, v in self.phases.items()},
+            "layers": dict(self.layers),
+            "interrupted": self.interrupted,
+        }
+
+
+@contextmanager
+def profile_rerun(state, enabled=None):
+    """Perfil del rerun en curso, en state['rerun_profile']; al salir se guarda en el historial.
+
+    Un rerun cortado por st.rerun() (o por un error) también se registra,
+    marcado como interrumpido.
+    """
+    if enabled is None:
+        enabled = state.get('diagnostics', DIAGNOSTICS_DEFAULT)
+    profile = state['rerun_profile'] = RerunProfile(enabled)
+    try:
+        yield profile
+    except BaseException:
+        profile.interrupted = True
+        raise
+    finally:
+        if profile.enabled and profile.phases:
+            record = profile.record()
+            state.setdefault('diagnostics_history', deque(maxlen=HISTORY_SIZE)).append(record)
+            _export(record)
+
+
+def _export(record):
+    line = json.dumps(record, ensure_ascii=False)
+    logger.info(line)
+    if DIAGNOSTICS_LOG:
+        try:
+            with open(DIAGNOSTICS_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.warning("No se pudo escribir %s: %s", DIAGNOSTICS_LOG, e)
+
+
+def history_jsonl(history):
+    """Historial como JSONL (para descargar)."""
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in history)
+
+
+def phase_summary(history):
+    """{fase: (último, mediana)} en segundos sobre los reruns completos del historial."""
+    complete = [r for r in history if not r["interrupted"]]
+    summary = {}
+    for record in complete:
+        for phase in record["phases"]:
+            summary.setdefault(phase, [])
+    for phase, values in summary.items():
+        values.extend(r["phases"].get(phase, 0.0) for r in complete)
+    return {phase: (values[-1], sorted(values)[len(values) // 2]) for phase, values in summary.items()}
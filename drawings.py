@@ -0,0 +1,60 @@
+"""Dibujos en espera: deduplicación por hash canónico de la geometría.
+
+El componente de dibujo devuelve en cada interacción todos los dibujos que
+tiene el mapa montado, no solo los nuevos. Para no duplicarlos se guarda una
+clave por geometría: hash del WKB de la geometría normalizada (orden de
+anillos y punto de inicio canónicos) y redondeada a DRAWING_DIGITS decimales,
+así que dos dibujos que solo difieren en ruido de coma flotante tienen la
+misma clave. El índice se mantiene al capturar, guardar y descartar; no se
+recalcula sobre todos los dibujos en cada rerun.
+"""
+import hashlib
+import json
+
+import shapely
+from shapely.geometry import shape
+
+# Decimales de grado con los que se comparan dibujos (~1 cm)
+DRAWING_DIGITS = 7
+
+
+def drawing_key(geometry, digits=DRAWING_DIGITS):
+    """Clave canónica (bytes) de una geometría GeoJSON."""
+    try:
+        geom = shapely.normalize(shapely.set_precision(shape(geometry), 10.0 ** -digits))
+        data = shapely.to_wkb(geom)
+    except Exception:
+        # Geometría que shapely no acepta: se compara por su texto
+        data = json.dumps(geometry, sort_keys=True).encode()
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class DrawingIndex:
+    """Claves de los dibujos en espera y de los ya capturados por el montaje actual del mapa."""
+
+    def __init__(self, features=()):
+        self.pending = {drawing_key(f['geometry']) for f in features}
+        self.count = len(features)  # dibujos en espera que cubre el índice
+        self.captured = set()
+        self.map_key = None
+
+    def mount(self, map_key):
+        """Un montaje nuevo del mapa empieza sin dibujos capturados."""
+        if map_key != self.map_key:
+            self.captured.clear()
+            self.map_key = map_key
+
+    def add(self, feature):
+        """Registra un dibujo devuelto por el mapa. True si es nuevo (va a espera)."""
+        key = drawing_key(feature['geometry'])
+        is_new = key not in self.pending and key not in self.captured
+        self.captured.add(key)
+        if is_new:
+            self.pending.add(key)
+            self.count += 1
+        return is_new
+
+    def clear(self):
+        """Tras guardar o descartar: no queda nada en espera."""
+        self.pending.clear()
+        self.count = 0
@@ -0,0 +1,149 @@
+"""Ingesta en segundo plano de capas de referencia subidas.
+
+Cada archivo (o grupo SHP) es un trabajo independiente del planificador
+(jobs): lee, reproyecta y deja el resultado en la caché de capas en disco.
+Los archivos se leen desde los bytes subidos, sin copiarlos a /tmp: los
+vectores con el sistema de archivos virtual de GDAL (un grupo SHP se
+empaqueta en un ZIP en memoria y los ZIP subidos se leen sin extraer) y los
+rasters con MemoryFile. La app solo recibe la clave de caché de cada capa a
+medida que termina, así que las capas se van registrando una a una y el fallo
+de un archivo no afecta a los demás. La concurrencia está acotada por las
+JOB_WORKERS hebras de la cola de ingesta; cada raster reproyecta con los
+núcleos repartidos entre los rasters en curso al empezar (raster_share).
+"""
+import io
+import os
+import threading
+import zipfile
+from contextlib import contextmanager
+from functools import partial
+
+import geopandas as gpd
+from rasterio.io import MemoryFile
+
+from jobs import run_in_process
+from layer_cache import shared_cache
+from layer_memory import compact_gdf
+from raster_processing import raster_to_png
+from raster_tiles import raster_bounds_4326
+
+# Formatos que se buscan dentro de un ZIP subido
+VECTOR_EXTENSIONS = (".shp", ".gpkg", ".geojson", ".json", ".kml", ".gml")
+# Tamaño desde el que un trabajo en segundo plano se ingiere en un proceso aparte
+PROCESS_MIN_BYTES = 16 * 1024 * 1024
+
+
+class IngestJob:
+    """Un archivo a ingerir.
+
+    kind: 'vector' (SHP/KML/ZIP), 'raster' (PNG único) o 'raster_tiles' (pirámide).
+    files: [(nombre, bytes)] del trabajo (un SHP con sus .shx/.dbf/.prj).
+    options: argumentos extra para raster_to_png (max_size, target_zoom...).
+    """
+
+    def __init__(self, name, kind, key, files, options=None):
+        self.name = name
+        self.kind = kind
+        self.key = key
+        self.files = files
+        self.options = dict(options or {})
+
+
+def _pack(files):
+    """ZIP sin compresión en memoria con los archivos dados (en la raíz)."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in files:
+            archive.writestr(os.path.basename(name), data)
+    return buffer.getvalue()
+
+
+def vector_source(files):
+    """Bytes legibles por GDAL para un archivo vectorial, un ZIP o un grupo SHP."""
+    if len(files) > 1:
+        # SHP + sidecars
+        return _pack(files)
+    name, data = files[0]
+    if not name.lower().endswith(".zip"):
+        return bytes(data)
+
+    # GDAL solo busca capas en la raíz del ZIP: si la primera está en una
+    # subcarpeta se reempaquetan (sin descomprimir a disco) sus archivos
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        names = [n for n in archive.namelist() if not n.endswith("/")]
+        layers = [n for n in names if n.lower().endswith(VECTOR_EXTENSIONS)]
+        if not layers:
+            raise ValueError("el ZIP no contiene capas vectoriales")
+        if "/" not in layers[0]:
+            return bytes(data)
+        stem = os.path.splitext(layers[0])[0]
+        return _pack([(n, archive.read(n)) for n in names if os.path.splitext(n)[0] == stem])
+
+
+def run_job(job, progress=None, workers=None):
+    """Procesa un trabajo y lo guarda en la caché. Retorna la clave de caché.
+
+    progress(hechos, total): avance (pasos de la lectura o bloques reproyectados).
+    workers: hebras de reproyección de un raster (None = todos los núcleos).
+    """
+    progress = progress or (lambda done, total: None)
+    if job.kind == 'vector':
+        gdf = gpd.read_file(vector_source(job.files))
+        if gdf.empty:
+            raise ValueError("la capa no tiene entidades")
+        progress(1, 3)
+        if gdf.crs and gdf.crs.to_string() != "EPSG:4326":
+            gdf = gdf.to_crs(epsg=4326)
+        progress(2, 3)
+        shared_cache.put_vector(job.key, compact_gdf(gdf))
+    elif job.kind in ('raster', 'raster_tiles'):
+        data = job.files[0][1]
+        with MemoryFile(data) as memfile:
+            if job.kind == 'raster':
+                # Las hebras de reproyección abren la ruta /vsimem/ por su cuenta
+                png_path, bounds = raster_to_png(memfile.name, progress=progress, workers=workers or os.cpu_count() or 1,
+                                               **job.options)
+                shared_cache.put_raster(job.key, png_path, bounds)
+            else:
+                shared_cache.put_raster_tiles(job.key, data, raster_bounds_4326(memfile.name))
+    else:
+        raise ValueError(f"tipo de trabajo desconocido: {job.kind}")
+    return job.key
+
+
+_rasters_running = 0
+_rasters_lock = threading.Lock()
+
+
+@contextmanager
+def raster_share():
+    """Hebras para un raster que empieza ahora: los núcleos entre los rasters en curso (incluido este)."""
+    global _rasters_running
+    with _rasters_lock:
+        _rasters_running += 1
+        share = max(1, (os.cpu_count() or 1) // _rasters_running)
+    try:
+        yield share
+    finally:
+        with _rasters_lock:
+            _rasters_running -= 1
+
+
+def background_ingest(job, ingest_job):
+    """Tarea del planificador (jobs.scheduler): ingiere `ingest_job` y retorna su clave de caché.
+
+    Los rasters a PNG y los archivos desde PROCESS_MIN_BYTES van a un proceso
+    aparte, que se puede cortar en cualquier punto; los pequeños se leen en la
+    hebra del trabajo (arrancar un proceso cuesta más que leerlos).
+    """
+    # Los buffers de Streamlit (memoryview) se liberan al cambiar el uploader
+    ingest_job.files = [(name, bytes(data)) for name, data in ingest_job.files]
+    size = sum(len(data) for _, data in ingest_job.files)
+    if ingest_job.kind == 'raster':
+        with raster_share() as workers:
+            return run_in_process(job, partial(run_job, workers=workers), ingest_job)
+    if size >= PROCESS_MIN_BYTES:
+        return run_in_process(job, run_job, ingest_job)
+    job.check()
+    return run_job(ingest_job, progress=lambda done, total: job.report(done / total))
+
@@ -0,0 +1,192 @@
+"""Trabajos en segundo plano: ingesta de capas y guardados fuera del rerun.
+
+Reproyectar un raster, leer un SHP/KML grande o reescribir el proyecto
+completo dentro del script congelaba la página hasta terminar. Aquí cada
+tarea es un trabajo con id que corre en un pool de hebras compartido por el
+proceso, y la sesión solo guarda los ids:
+
+- submit(nombre, fn, *args, queue=...) encola fn(job, *args) y retorna el id.
+  Cada cola tiene su propio pool (JOB_QUEUES): un raster de varios minutos no
+  retrasa un guardado.
+- El trabajo informa su avance con job.report(fracción, mensaje) y comprueba
+  job.check() entre pasos para cortar si se canceló.
+- run_in_process() ejecuta una función en un proceso aparte (spawn) y vigila
+  su avance: cancelar termina el proceso, así que también se cortan las
+  llamadas largas a GDAL que no pasan por job.check(). Los temporales que deje
+  a medias en el área de scratch los limpia su barrido por antigüedad.
+- Los trabajos terminados se conservan FINISHED_TTL segundos para que la
+  sesión recoja su resultado; después se olvidan.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("GEOEDITOR_JOB_WORKERS", "0")) or max(2, os.cpu_count() or 1)
+# Pools por cola: los guardados van de uno en uno (un escritor por archivo)
+JOB_QUEUES = {'ingesta': JOB_WORKERS, 'guardado': 1}
+# Segundos que se conserva un trabajo terminado sin que nadie lo recoja
+FINISHED_TTL = 3600
+# Intervalo con el que se vigila un proceso hijo
+POLL_INTERVAL = 0.2
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "en cola", "en curso", "terminado", "error", "cancelado"
+
+logger = logging.getLogger("geoeditor.jobs")
+
+
+class JobCancelled(Exception):
+    """El trabajo se canceló mientras corría."""
+
+
+class Job:
+    """Estado de un trabajo: avance, mensaje y resultado (o error)."""
+
+    def __init__(self, name, queue):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.queue = queue
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def report(self, fraction, message=None):
+        self.progress = min(1.0, max(0.0, fraction))
+        if message is not None:
+            self.message = message
+
+    def check(self):
+        """Corta el trabajo (JobCancelled) si se pidió cancelarlo."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.submitted
+
+
+class JobScheduler:
+    """Trabajos de todas las sesiones del proceso, por id."""
+
+    def __init__(self, queues=JOB_QUEUES):
+        self._pools = {name: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"geoeditor-{name}")
+                       for name, n in queues.items()}
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args, queue='ingesta', **kwargs):
+        """Encola fn(job, *args, **kwargs). Retorna el id del trabajo."""
+        job = Job(name, queue)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        job._future = self._pools[queue].submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Pide cancelar el trabajo. Si aún no empezó, no llega a correr."""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return
+        job._cancel.set()
+        if job._future is not None and job._future.cancel():
+            self._finish(job, CANCELLED)
+
+    def forget(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    # --- INTERNOS ---
+    def _run(self, job, fn, args, kwargs):
+        if job.cancelled:
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        try:
+            job.result = fn(job, *args, **kwargs)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            logger.warning("Trabajo '%s' falló: %s", job.name, e)
+            job.error = str(e) or type(e).__name__
+            self._finish(job, FAILED)
+        else:
+            job.progress = 1.0
+            self._finish(job, DONE)
+
+    def _finish(self, job, status):
+        job.finished = time.time()
+        job.status = status
+
+    def _prune(self):
+        limit = time.time() - FINISHED_TTL
+        for job_id in [k for k, job in self._jobs.items() if job.done and job.finished < limit]:
+            del self._jobs[job_id]
+
+
+# --- PROCESOS HIJOS ---
+def _child(conn, progress, fn, args):
+    def report(done, total):
+        progress.value = done / total if total else 1.0
+    try:
+        conn.send((True, fn(*args, progress=report)))
+    except Exception as e:
+        conn.send((False, str(e) or type(e).__name__))
+    finally:
+        conn.close()
+
+
+def run_in_process(job, fn, *args):
+    """fn(*args, progress=callback(hechos, total)) en un proceso aparte, cancelable.
+
+    spawn: el proceso de Streamlit tiene hilos (servidor de teselas, GDAL) y
+    fork no es seguro. Los argumentos y el resultado deben poder serializarse.
+    """
+    context = multiprocessing.get_context("spawn")
+    progress = context.Value('d', 0.0, lock=False)
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(sender, progress, fn, args), daemon=True)
+    process.start()
+    sender.close()
+    try:
+        while not receiver.poll(POLL_INTERVAL):
+            job.report(progress.value)
+            if job.cancelled:
+                process.terminate()
+                raise JobCancelled()
+            if not process.is_alive() and not receiver.poll():
+                raise RuntimeError(f"el proceso terminó inesperadamente (código {process.exitcode})")
+        ok, value = receiver.recv()
+    finally:
+        process.join()
+        receiver.close()
+    if not ok:
+        raise RuntimeError(value)
+    return value
+
+
+# Instancia compartida por todas las sesiones del proceso
+scheduler = JobScheduler()
@@ -0,0 +1,231 @@
+"""Autoguardado de la capa de trabajo con un journal de cambios append-only.
+
+Cada cambio (altas, ediciones por columna, borrados, campos nuevos) se añade
+como una línea JSON a `<proyecto>.journal` en cuanto ocurre, con fsync, así que
+guardar cuesta lo que el cambio y no lo que la capa. Cada COMPACT_ENTRIES
+cambios (o COMPACT_BYTES) el journal se compacta: se reescribe el proyecto
+completo y se vacía el journal.
+
+La compactación puede correr en segundo plano (jobs): mark() anota hasta
+dónde llega el journal al tomar la copia de la capa, y compact(gdf, mark)
+conserva lo anotado después (los cambios hechos mientras se escribía).
+
+Al cargar un proyecto se reaplica su journal (recuperación tras un cierre
+inesperado). Reaplicar es idempotente: si el proceso murió entre escribir el
+proyecto y vaciar el journal, las altas ya presentes se ignoran.
+
+Una sesión nueva sin proyecto escribe en un journal propio,
+`<proyecto>.<sesión>` (session_journal). Nadie más lo carga, así que sus
+archivos se borran al guardarlo en un proyecto (discard) o al terminar la
+sesión, y los que dejó un proceso anterior se barren la primera vez que se
+usa esa ruta (sweep_session_journals).
+"""
+import glob
+import json
+import os
+import threading
+import weakref
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from project_io import read_project, write_project
+from work_layer import FEATURE_ID, NEXT_ID_ATTR, add_column, next_feature_id, with_feature_ids
+
+JOURNAL_SUFFIX = ".journal"
+COMPACT_ENTRIES = 500
+COMPACT_BYTES = 16 * 1024 * 1024
+# Caracteres hexadecimales del id de sesión en el nombre de los journals de sesión
+SESSION_ID_CHARS = 8
+
+_swept = set()
+_swept_lock = threading.Lock()
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is pd.NA or value is pd.NaT:
+        return None
+    return str(value)
+
+
+class EditJournal:
+    """Journal de cambios ligado a un archivo de proyecto."""
+
+    def __init__(self, project_path):
+        self.project_path = project_path
+        self.path = project_path + JOURNAL_SUFFIX
+        self.entries = 0  # cambios anotados desde la última compactación (se cuentan al cargar)
+        self._lock = threading.Lock()  # anotar y recortar pueden venir de hebras distintas
+        self._cleanup = None  # solo en journals de sesión (session_journal)
+
+    def __len__(self):
+        return self.entries
+
+    def exists(self):
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def discard(self):
+        """Borra los archivos de un journal de sesión (ya guardado en otro proyecto)."""
+        if self._cleanup is not None:
+            self._cleanup()
+
+    # --- ESCRITURA ---
+    def _append(self, entry):
+        line = json.dumps(entry, default=_json_default, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries += 1
+
+    def log_insert(self, gdf):
+        """Altas: ids, propiedades y geometría (WKB hex) de cada entidad nueva."""
+        props = gdf.drop(columns=gdf.geometry.name)
+        rows = [{"fid": fid, "properties": p, "geometry": wkb}
+                for fid, p, wkb in zip(gdf.index.tolist(), props.to_dict("records"),
+                                       shapely.to_wkb(gdf.geometry.values, hex=True).tolist())]
+        self._append({"op": "insert", "rows": rows})
+
+    def log_update(self, column, ids, values):
+        self._append({"op": "update", "column": column, "ids": list(ids), "values": list(values)})
+
+    def log_delete(self, ids):
+        self._append({"op": "delete", "ids": list(ids)})
+
+    def log_add_column(self, name, kind):
+        self._append({"op": "add_column", "name": name, "kind": kind})
+
+    def needs_compaction(self):
+        return self.entries >= COMPACT_ENTRIES or (
+            os.path.exists(self.path) and os.path.getsize(self.path) >= COMPACT_BYTES)
+
+    def mark(self):
+        """(bytes, cambios) del journal ahora: lo que cubre una copia de la capa tomada en este momento."""
+        with self._lock:
+            return (os.path.getsize(self.path) if os.path.exists(self.path) else 0), self.entries
+
+    def compact(self, gdf, mark=None):
+        """Escribe el proyecto completo y vacía el journal (en ese orden).
+
+        Con `mark` (de mark()) solo se descarta lo anotado hasta ese punto.
+        """
+        write_project(gdf, self.project_path)
+        with self._lock:
+            offset, entries = mark or (0, self.entries)
+            tail = b""
+            if mark and os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    f.seek(offset)
+                    tail = f.read()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.entries = max(0, self.entries - entries)
+
+    # --- RECUPERACIÓN ---
+    def _read(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _drop_partial_tail(self):
+        """Descarta una última línea a medio escribir (cierre durante un append)."""
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def load(self, crs="EPSG:4326"):
+        """Proyecto en disco + journal reaplicado. Retorna (gdf, cambios_recuperados).
+
+        gdf.attrs[NEXT_ID_ATTR] queda con el siguiente id sin usar, contando
+        también las altas del journal que se borraron después.
+        """
+        if os.path.exists(self.project_path):
+            gdf = read_project(self.project_path)
+            if gdf.crs and gdf.crs.to_string() != "EPSG:4326":
+                gdf = gdf.to_crs(epsg=4326)
+        else:
+            gdf = gpd.GeoDataFrame(columns=['geometry'], geometry='geometry', crs=crs)
+        gdf = with_feature_ids(gdf)
+        next_id = next_feature_id(gdf)
+        count = 0
+        if os.path.exists(self.path):
+            self._drop_partial_tail()
+            for entry in self._read():
+                gdf = apply_entry(gdf, entry)
+                if entry["op"] == "insert" and entry["rows"]:
+                    next_id = max(next_id, max(r["fid"] for r in entry["rows"]) + 1)
+                count += 1
+            self.entries = count
+        gdf.attrs[NEXT_ID_ATTR] = next_id
+        return gdf, count
+
+
+# --- JOURNALS DE SESIÓN ---
+def _remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def session_journal(project_path, session_id):
+    """Journal propio de una sesión nueva junto a `project_path`.
+
+    Sus archivos se borran con discard() o cuando el journal se recolecta
+    (fin de la sesión que lo guarda en su estado).
+    """
+    stem, ext = os.path.splitext(project_path)
+    journal = EditJournal(f"{stem}.{session_id}{ext}")
+    journal._cleanup = weakref.finalize(journal, _remove_files, journal.path, journal.project_path)
+    return journal
+
+
+def sweep_session_journals(project_path):
+    """Borra los journals de sesión huérfanos junto a `project_path`, una vez por proceso.
+
+    Las sesiones de un proceso anterior ya no existen; las de este crean su
+    journal después del barrido de esa ruta.
+    """
+    with _swept_lock:
+        if project_path in _swept:
+            return
+        _swept.add(project_path)
+    stem, ext = os.path.splitext(project_path)
+    pattern = f"{glob.escape(stem)}.{'[0-9a-f]' * SESSION_ID_CHARS}{ext}"
+    for path in glob.glob(pattern) + glob.glob(pattern + JOURNAL_SUFFIX):
+        _remove_files(path)
+
+
+def apply_entry(gdf, entry):
+    """Reaplica una entrada del journal sobre `gdf`."""
+    op = entry["op"]
+    if op == "insert":
+        rows = [r for r in entry["rows"] if r["fid"] not in gdf.index]
+        if rows:
+            new = gpd.GeoDataFrame(
+                [r["properties"] for r in rows],
+                geometry=shapely.from_wkb([r["geometry"] for r in rows]),
+                crs=gdf.crs,
+                index=pd.Index([r["fid"] for r in rows], name=FEATURE_ID))
+            gdf = pd.concat([gdf, new])
+    elif op == "update":
+        present = pd.Index(entry["ids"]).isin(gdf.index)
+        if present.any():
+            gdf.loc[np.asarray(entry["ids"])[present], entry["column"]] = np.asarray(entry["values"], dtype=object)[present]
+    elif op == "delete":
+        gdf = gdf.drop(index=entry["ids"], errors="ignore")
+    elif op == "add_column":
+        gdf = add_column(gdf, entry["name"], entry["kind"])
+    return gdf
@@ -0,0 +1,242 @@
+"""Caché persistente de capas de referencia procesadas.
+
+Las capas se indexan por el hash de su contenido (no por su nombre), de modo que
+volver a subir los mismos bytes, en la misma sesión o en otra, devuelve la capa
+ya reproyectada sin leer ni transformar nada. Las entradas viven en disco:
+una carpeta por capa (GeoParquet, PNG + bounds o GeoTIFF de origen + teselas
+ya generadas), LRU acotado por bytes.
+
+La caché no retiene nada en memoria: las capas en uso las tiene el almacén de
+capas (layer_store), una copia por clave con contador de referencias, así que
+al soltar la última referencia (o volcar la capa) la memoria se libera.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import geopandas as gpd
+import shapely
+
+# Cambiar al modificar el pipeline de procesado para invalidar entradas viejas
+CACHE_VERSION = "2"
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "GEOEDITOR_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "geoeditor"),
+)
+DEFAULT_DISK_LIMIT = int(os.environ.get("GEOEDITOR_CACHE_DISK_MB", "4096")) * 1024 * 1024
+
+# Segundos que una entrada sin meta.json se considera "en escritura" y no se desaloja
+INCOMPLETE_GRACE = 3600
+# Segundos entre recorridos completos del disco: entre uno y otro el tamaño de
+# cada entrada se lleva en memoria (las pirámides de teselas crecen al navegar
+# y se vuelven a medir en el siguiente recorrido)
+SCAN_INTERVAL = 300
+
+_META_FILE = "meta.json"
+_VECTOR_FILE = "data.parquet"
+_RASTER_FILE = "image.png"
+_RASTER_SOURCE_FILE = "source.tif"
+_TILES_DIR = "tiles"
+
+
+def hash_buffers(named_buffers, salt=""):
+    """Hash de contenido para un grupo de archivos [(nombre, bytes), ...].
+
+    Solo se usa la extensión del nombre: el mismo contenido con otro nombre
+    reutiliza la entrada de caché. `salt` separa variantes de procesado del
+    mismo archivo (p. ej. PNG único vs. pirámide de teselas).
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(CACHE_VERSION.encode())
+    digest.update(salt.encode())
+    items = sorted(named_buffers, key=lambda item: os.path.splitext(item[0])[1].lower())
+    for name, buffer in items:
+        digest.update(os.path.splitext(name)[1].lower().encode())
+        view = memoryview(buffer)
+        digest.update(len(view).to_bytes(8, "little"))
+        digest.update(view)
+    return digest.hexdigest()
+
+
+def estimate_gdf_bytes(gdf):
+    """Estimación barata del tamaño en memoria de un GeoDataFrame."""
+    attrs = gdf.drop(columns=gdf.geometry.name).memory_usage(deep=True).sum()
+    # ~16 bytes por coordenada + cabecera de cada objeto shapely
+    coords = int(shapely.get_num_coordinates(gdf.geometry.values).sum())
+    return int(attrs + coords * 16 + len(gdf) * 64)
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class LayerCache:
+    """Caché LRU en disco para capas procesadas."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, disk_limit=DEFAULT_DISK_LIMIT):
+        self.cache_dir = cache_dir
+        self.disk_limit = disk_limit
+        self._lock = threading.RLock()
+        self._sizes = None  # {clave: [último uso, bytes]} desde el último recorrido
+        self._scanned = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # --- API PÚBLICA ---
+    def get(self, key):
+        """Devuelve la entrada ({'type', 'data', 'key', 'bounds'?}) o None si no existe."""
+        with self._lock:
+            entry = self._read_disk(key)
+        return None if entry is None else dict(entry, key=key)
+
+    def put_vector(self, key, gdf):
+        """Guarda una capa vectorial ya reproyectada. Devuelve la entrada cacheada."""
+        entry = {'type': 'vector', 'data': gdf}
+        with self._lock:
+            entry_dir = self._prepare_dir(key)
+            gdf.to_parquet(os.path.join(entry_dir, _VECTOR_FILE))
+            self._write_meta(entry_dir, {'type': 'vector'})
+            self._evict_disk(key)
+        return dict(entry, key=key)
+
+    def put_raster(self, key, png_path, bounds):
+        """Mueve el PNG generado a la caché. Devuelve la entrada con la ruta definitiva."""
+        with self._lock:
+            entry_dir = self._prepare_dir(key)
+            cached_png = os.path.join(entry_dir, _RASTER_FILE)
+            shutil.move(png_path, cached_png)
+            self._write_meta(entry_dir, {'type': 'raster', 'bounds': bounds})
+            entry = {'type': 'raster', 'data': cached_png, 'bounds': bounds}
+            self._evict_disk(key)
+        return dict(entry, key=key)
+
+    def put_raster_tiles(self, key, source, bounds):
+        """Guarda el GeoTIFF de origen en la caché para servirlo como pirámide de teselas.
+
+        `source` es una ruta (se mueve) o los bytes del archivo (se escriben una
+        vez, directamente en la entrada). Las teselas se generan bajo demanda en
+        la subcarpeta 'tiles_dir' de la entrada.
+        """
+        with self._lock:
+            entry_dir = self._prepare_dir(key)
+            cached_src = os.path.join(entry_dir, _RASTER_SOURCE_FILE)
+            if isinstance(source, (str, os.PathLike)):
+                shutil.move(source, cached_src)
+            else:
+                with open(cached_src, "wb") as f:
+                    f.write(source)
+            os.makedirs(os.path.join(entry_dir, _TILES_DIR))
+            self._write_meta(entry_dir, {'type': 'raster_tiles', 'bounds': bounds})
+            entry = self._raster_tiles_entry(entry_dir, bounds)
+            self._evict_disk(key)
+        return dict(entry, key=key)
+
+    def clear(self):
+        """Vacía la caché."""
+        with self._lock:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # --- INTERNOS ---
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _prepare_dir(self, key):
+        entry_dir = self._entry_dir(key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.makedirs(entry_dir)
+        return entry_dir
+
+    def _write_meta(self, entry_dir, meta):
+        # meta.json se escribe al final: su presencia marca la entrada como completa
+        meta['created'] = time.time()
+        tmp_path = os.path.join(entry_dir, _META_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(entry_dir, _META_FILE))
+
+    def _touch(self, key):
+        meta_path = os.path.join(self._entry_dir(key), _META_FILE)
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+
+    def _read_disk(self, key):
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, _META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['type'] == 'vector':
+                entry = {'type': 'vector', 'data': gpd.read_parquet(os.path.join(entry_dir, _VECTOR_FILE))}
+            elif meta['type'] == 'raster_tiles':
+                entry = self._raster_tiles_entry(entry_dir, meta['bounds'])
+                if not os.path.exists(entry['data']):
+                    return None
+            else:
+                png_path = os.path.join(entry_dir, _RASTER_FILE)
+                if not os.path.exists(png_path):
+                    return None
+                entry = {'type': 'raster', 'data': png_path, 'bounds': meta['bounds']}
+        except Exception:
+            # Entrada corrupta o de un formato anterior: se descarta
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        self._touch(key)
+        if self._sizes is not None and key in self._sizes:
+            self._sizes[key][0] = time.time()
+        return entry
+
+    @staticmethod
+    def _raster_tiles_entry(entry_dir, bounds):
+        return {'type': 'raster_tiles', 'data': os.path.join(entry_dir, _RASTER_SOURCE_FILE),
+                'tiles_dir': os.path.join(entry_dir, _TILES_DIR), 'bounds': bounds}
+
+    def _scan(self):
+        """Mide todas las entradas del disco: {clave: [último uso, bytes]}."""
+        sizes = {}
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir():
+                continue
+            meta_path = os.path.join(entry.path, _META_FILE)
+            try:
+                last_used = os.stat(meta_path).st_mtime
+            except OSError:
+                # Entrada incompleta: si es reciente la está escribiendo otro proceso (ingesta)
+                if time.time() - entry.stat().st_mtime < INCOMPLETE_GRACE:
+                    continue
+                last_used = 0  # abandonada: primera candidata
+            sizes[entry.name] = [last_used, _dir_size(entry.path)]
+        self._sizes, self._scanned = sizes, time.time()
+
+    def _evict_disk(self, key):
+        """Anota la entrada recién escrita y desaloja las menos usadas si se supera el límite.
+
+        Solo se mide `key`; el recorrido completo se hace cada SCAN_INTERVAL.
+        """
+        if self._sizes is None or time.time() - self._scanned > SCAN_INTERVAL:
+            self._scan()
+        else:
+            self._sizes[key] = [time.time(), _dir_size(self._entry_dir(key))]
+        total = sum(size for _, size in self._sizes.values())
+        for last_used, old_key in sorted((v[0], k) for k, v in self._sizes.items()):
+            if total <= self.disk_limit:
+                break
+            shutil.rmtree(self._entry_dir(old_key), ignore_errors=True)
+            total -= self._sizes.pop(old_key)[1]
+
+# Instancia compartida por todas las sesiones del proceso
+shared_cache = LayerCache()
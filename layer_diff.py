@@ -0,0 +1,388 @@
+"""Comparación de dos capas vectoriales (A = referencia, B = comparación).
+
+- Resumen: filas, columnas y CRS de cada capa; esquema columna a columna.
+- Emparejamiento de entidades por clave (una o más columnas, con un merge) o,
+  sin clave, espacial: primero geometrías idénticas (hash del WKB
+  normalizado) y luego, entre las que quedan, el candidato más parecido
+  (distancia de Hausdorff) dentro de `match_distance` con un STRtree.
+- Para cada par: atributos comparados columna a columna en bloque y
+  geometría igual si la distancia de Hausdorff no supera `tolerance`.
+- Informe: una fila por entidad añadida, eliminada o modificada, escrita por
+  bloques en CSV (geometría WKT) y/o GeoParquet a medida que se calcula.
+
+Las capas se leen una vez; el trabajo por pares se hace en bloques de
+CHUNK_SIZE, así que la memoria extra es la de unos pocos bloques y no la del
+informe completo. Las operaciones de shapely liberan el GIL: los bloques se
+reparten entre DIFF_WORKERS hilos, que comparten las capas sin copiarlas.
+
+Uso sin la app:
+
+    python layer_diff.py a.shp b.parquet --key ROL --tolerance 0.5 --out diff.parquet diff.csv
+"""
+import argparse
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import shapely
+
+from project_io import is_project_file, read_project
+
+DIFF_WORKERS = int(os.environ.get("GEOEDITOR_DIFF_WORKERS", "0")) or (os.cpu_count() or 1)
+# Pares por bloque de trabajo (y filas por escritura del informe)
+CHUNK_SIZE = 50_000
+
+ADDED, REMOVED, MODIFIED = "añadida", "eliminada", "modificada"
+REPORT_SCHEMA = pa.schema([
+    ("estado", pa.string()),
+    ("fila_a", pa.int64()),
+    ("fila_b", pa.int64()),
+    ("clave", pa.string()),
+    ("campos", pa.string()),
+    ("geometria_cambiada", pa.bool_()),
+    ("desplazamiento", pa.float64()),
+])
+
+
+class DiffReport:
+    """Resultado de compare_layers: resumen, esquema y conteos (el detalle va a los archivos)."""
+
+    def __init__(self, summary, schema, counts, outputs):
+        self.summary = summary
+        self.schema = schema
+        self.counts = counts
+        self.outputs = outputs
+
+    def __repr__(self):
+        return f"DiffReport({self.counts})"
+
+
+# --- RESUMEN Y ESQUEMA ---
+def _crs_name(gdf):
+    return gdf.crs.to_string() if gdf.crs else "(sin CRS)"
+
+
+def compare_summary(a, b):
+    """Filas, columnas y CRS de cada capa."""
+    return pd.DataFrame({
+        "Propiedad": ["Filas", "Columnas", "CRS"],
+        "A": [str(len(a)), str(len(a.columns) - 1), _crs_name(a)],
+        "B": [str(len(b)), str(len(b.columns) - 1), _crs_name(b)],
+    })
+
+
+def compare_schemas(a, b):
+    """Una fila por columna: tipo en A, tipo en B y estado."""
+    rows = []
+    for col in dict.fromkeys(list(a.columns) + list(b.columns)):
+        if col in (a.geometry.name, b.geometry.name):
+            continue
+        type_a = str(a[col].dtype) if col in a.columns else None
+        type_b = str(b[col].dtype) if col in b.columns else None
+        if type_a is None:
+            status = "solo en B"
+        elif type_b is None:
+            status = "solo en A"
+        else:
+            status = "igual" if type_a == type_b else "tipo distinto"
+        rows.append((col, type_a, type_b, status))
+    return pd.DataFrame(rows, columns=["Columna", "Tipo A", "Tipo B", "Estado"])
+
+
+# --- EMPAREJAMIENTO ---
+def _in_blocks(n, size=CHUNK_SIZE):
+    return [slice(start, min(start + size, n)) for start in range(0, n, size)]
+
+
+def _parallel(fn, blocks, workers):
+    """Aplica fn a cada bloque (en hilos si workers > 1) y devuelve los resultados en orden."""
+    if workers <= 1 or len(blocks) <= 1:
+        return [fn(block) for block in blocks]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, blocks))
+
+
+def match_by_key(a, b, key):
+    """(pos_a, pos_b) de las entidades con la misma clave. La clave debe ser única en cada capa."""
+    key = [key] if isinstance(key, str) else list(key)
+    for name, gdf in (("A", a), ("B", b)):
+        missing = [k for k in key if k not in gdf.columns]
+        if missing:
+            raise ValueError(f"la capa {name} no tiene la columna clave {missing}")
+        duplicated = int(gdf.duplicated(subset=key).sum())
+        if duplicated:
+            raise ValueError(f"la clave {key} se repite en {duplicated} fila(s) de la capa {name}")
+    left = pd.DataFrame({k: a[k].to_numpy() for k in key}).assign(_pos_a=np.arange(len(a)))
+    right = pd.DataFrame({k: b[k].to_numpy() for k in key}).assign(_pos_b=np.arange(len(b)))
+    pairs = left.merge(right, on=key, how="inner")
+    return pairs["_pos_a"].to_numpy(), pairs["_pos_b"].to_numpy()
+
+
+def geometry_hashes(geoms, grid=0.0, workers=DIFF_WORKERS):
+    """Hash (int64) del WKB normalizado de cada geometría, redondeada a `grid` si > 0."""
+    def block_hashes(block):
+        part = geoms[block]
+        if grid:
+            part = shapely.set_precision(part, grid)
+        wkbs = shapely.to_wkb(shapely.normalize(part))
+        return np.array([int.from_bytes(hashlib.blake2b(w or b"", digest_size=8).digest(), "little", signed=True)
+                         for w in wkbs], dtype=np.int64)
+
+    blocks = _in_blocks(len(geoms))
+    return np.concatenate(_parallel(block_hashes, blocks, workers)) if blocks else np.empty(0, dtype=np.int64)
+
+
+def _pair_duplicates(hashes_a, hashes_b):
+    """Empareja posiciones con el mismo hash; los repetidos se emparejan en orden (1 a 1)."""
+    left = pd.DataFrame({"h": hashes_a, "_pos_a": np.arange(len(hashes_a))})
+    right = pd.DataFrame({"h": hashes_b, "_pos_b": np.arange(len(hashes_b))})
+    left["n"] = left.groupby("h").cumcount()
+    right["n"] = right.groupby("h").cumcount()
+    pairs = left.merge(right, on=["h", "n"], how="inner")
+    return pairs["_pos_a"].to_numpy(), pairs["_pos_b"].to_numpy()
+
+
+def match_spatial(geoms_a, geoms_b, match_distance=0.0, workers=DIFF_WORKERS):
+    """(pos_a, pos_b) por geometría: idénticas primero, luego el candidato más cercano (Hausdorff)."""
+    grid = match_distance / 10 if match_distance else 0.0
+    pos_a, pos_b = _pair_duplicates(geometry_hashes(geoms_a, grid, workers),
+                                    geometry_hashes(geoms_b, grid, workers))
+    if not match_distance:
+        return pos_a, pos_b
+
+    rest_a = np.setdiff1d(np.arange(len(geoms_a)), pos_a)
+    rest_b = np.setdiff1d(np.arange(len(geoms_b)), pos_b)
+    if not len(rest_a) or not len(rest_b):
+        return pos_a, pos_b
+
+    tree = shapely.STRtree(geoms_b[rest_b])
+
+    def block_candidates(block):
+        src, dst = tree.query(geoms_a[rest_a[block]], predicate="dwithin", distance=match_distance)
+        src, dst = rest_a[block][src], rest_b[dst]
+        distance = shapely.hausdorff_distance(geoms_a[src], geoms_b[dst])
+        keep = distance <= match_distance
+        return src[keep], dst[keep], distance[keep]
+
+    found = _parallel(block_candidates, _in_blocks(len(rest_a)), workers)
+    candidates = pd.DataFrame({
+        "a": np.concatenate([f[0] for f in found]),
+        "b": np.concatenate([f[1] for f in found]),
+        "d": np.concatenate([f[2] for f in found]),
+    })
+    # Asignación voraz por distancia: cada entidad se usa una sola vez
+    candidates = candidates.sort_values("d", kind="stable").drop_duplicates("a").drop_duplicates("b")
+    return (np.concatenate([pos_a, candidates["a"].to_numpy()]),
+            np.concatenate([pos_b, candidates["b"].to_numpy()]))
+
+
+# --- DIFERENCIAS POR PAR ---
+def _changed_columns(a, b, columns, pos_a, pos_b):
+    """Matriz (pares × columnas) de atributos distintos (dos nulos cuentan como iguales)."""
+    changed = np.zeros((len(pos_a), len(columns)), dtype=bool)
+    for j, col in enumerate(columns):
+        va = a[col].iloc[pos_a].reset_index(drop=True)
+        vb = b[col].iloc[pos_b].reset_index(drop=True)
+        try:
+            equal = va.eq(vb).fillna(False).to_numpy(dtype=bool)
+        except TypeError:
+            equal = (va.astype(str) == vb.astype(str)).to_numpy()
+        changed[:, j] = ~(equal | (va.isna() & vb.isna()).to_numpy())
+    return changed
+
+
+def _geometry_changes(geoms_a, geoms_b, tolerance):
+    """(cambió, desplazamiento): Hausdorff solo donde los vértices no coinciden."""
+    same = shapely.equals_exact(geoms_a, geoms_b, tolerance=tolerance)
+    distance = np.zeros(len(geoms_a))
+    check = ~same
+    if check.any():
+        distance[check] = shapely.hausdorff_distance(geoms_a[check], geoms_b[check])
+    return distance > tolerance, distance
+
+
+def _key_labels(gdf, key, positions):
+    if not key:
+        return None
+    values = gdf[key].iloc[positions].astype(str)
+    return values.agg("|".join, axis=1).to_numpy() if len(key) > 1 else values.iloc[:, 0].to_numpy()
+
+
+# --- INFORME ---
+class _ReportWriter:
+    """Escribe el informe por bloques en CSV y/o GeoParquet (temporal + rename al cerrar)."""
+
+    def __init__(self, paths, crs):
+        self.paths = list(paths)
+        self._writers = []
+        schema = REPORT_SCHEMA
+        self._schemas = {}
+        for path in self.paths:
+            tmp_path = f"{path}.tmp"
+            if is_project_file(path):
+                geo = {"version": "1.0.0", "primary_column": "geometry",
+                       "columns": {"geometry": {"encoding": "WKB", "geometry_types": [],
+                                                "crs": crs.to_json_dict() if crs else None}}}
+                parquet_schema = schema.append(pa.field("geometry", pa.binary())).with_metadata(
+                    {b"geo": json.dumps(geo).encode()})
+                self._schemas["parquet"] = parquet_schema
+                writer = pq.ParquetWriter(tmp_path, parquet_schema, compression="zstd")
+                self._writers.append(("parquet", tmp_path, path, writer))
+            else:
+                csv_schema = self._schemas["csv"] = schema.append(pa.field("geometry", pa.string()))
+                writer = pa_csv.CSVWriter(tmp_path, csv_schema)
+                self._writers.append(("csv", tmp_path, path, writer))
+
+    def write(self, columns, geoms):
+        if not len(geoms):
+            return
+        arrays = [pa.array(columns[f.name], type=f.type) for f in REPORT_SCHEMA]
+        for kind, _, _, writer in self._writers:
+            if kind == "parquet":
+                geometry = pa.array(shapely.to_wkb(geoms), type=pa.binary())
+            else:
+                geometry = pa.array(shapely.to_wkt(geoms, rounding_precision=-1), type=pa.string())
+            writer.write_table(pa.Table.from_arrays(arrays + [geometry], schema=self._schemas[kind]))
+
+    def close(self, ok=True):
+        for _, tmp_path, path, writer in self._writers:
+            writer.close()
+            if ok:
+                os.replace(tmp_path, path)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _unmatched_rows(status, gdf, positions, key, writer, column_name):
+    for block in _in_blocks(len(positions)):
+        pos = positions[block]
+        n = len(pos)
+        labels = _key_labels(gdf, key, pos)
+        writer.write({
+            "estado": [status] * n,
+            "fila_a": pos if column_name == "fila_a" else [None] * n,
+            "fila_b": pos if column_name == "fila_b" else [None] * n,
+            "clave": labels if labels is not None else [None] * n,
+            "campos": [None] * n,
+            "geometria_cambiada": [None] * n,
+            "desplazamiento": [None] * n,
+        }, gdf.geometry.values[pos])
+
+
+def _load(layer):
+    return layer if isinstance(layer, gpd.GeoDataFrame) else read_project(layer)
+
+
+def compare_layers(a, b, key=None, tolerance=0.0, match_distance=None, out=(), workers=DIFF_WORKERS):
+    """Compara la capa `b` contra `a` (GeoDataFrames o rutas).
+
+    - key: columna(s) para emparejar; None = emparejamiento espacial.
+    - tolerance: desplazamiento máximo (Hausdorff) para considerar igual una geometría.
+    - match_distance: radio del emparejamiento espacial (por defecto = tolerance).
+    Las distancias van en unidades del CRS de A, o en metros si es geográfico
+    (la comparación se hace en la UTM de A; el informe conserva las geometrías
+    originales). B se lleva al CRS de A si difieren.
+    - out: ruta o rutas del informe (.parquet/.geoparquet = GeoParquet, otra = CSV).
+    """
+    a, b = _load(a), _load(b)
+    if isinstance(key, str):
+        key = [key]
+    key = list(key) if key else None
+    outputs = [out] if isinstance(out, (str, os.PathLike)) else list(out)
+    summary, schema = compare_summary(a, b), compare_schemas(a, b)
+    if match_distance is None:
+        match_distance = tolerance
+
+    if a.crs and b.crs and a.crs != b.crs:
+        b = b.to_crs(a.crs)
+    geoms_a, geoms_b = a.geometry.values, b.geometry.values
+    if a.crs and a.crs.is_geographic and (tolerance or (not key and match_distance)):
+        metric = a.estimate_utm_crs()
+        geoms_a, geoms_b = geoms_a.to_crs(metric), geoms_b.to_crs(metric)
+    geoms_a, geoms_b = np.asarray(geoms_a), np.asarray(geoms_b)
+
+    if key:
+        pos_a, pos_b = match_by_key(a, b, key)
+    else:
+        pos_a, pos_b = match_spatial(geoms_a, geoms_b, match_distance, workers)
+    order = np.argsort(pos_a, kind="stable")
+    pos_a, pos_b = pos_a[order], pos_b[order]
+    removed = np.setdiff1d(np.arange(len(a)), pos_a)
+    added = np.setdiff1d(np.arange(len(b)), pos_b)
+
+    columns = [c for c in a.columns if c in b.columns and c != a.geometry.name and c not in (key or ())]
+
+    def block_diff(block):
+        pa_, pb_ = pos_a[block], pos_b[block]
+        changed = _changed_columns(a, b, columns, pa_, pb_)
+        geom_changed, distance = _geometry_changes(geoms_a[pa_], geoms_b[pb_], tolerance)
+        modified = changed.any(axis=1) | geom_changed
+        rows = np.flatnonzero(modified)
+        names = np.asarray(columns, dtype=object)
+        labels = _key_labels(a, key, pa_[rows])
+        return {
+            "estado": [MODIFIED] * len(rows),
+            "fila_a": pa_[rows],
+            "fila_b": pb_[rows],
+            "clave": labels if labels is not None else [None] * len(rows),
+            "campos": [";".join(names[changed[r]]) or None for r in rows],
+            "geometria_cambiada": geom_changed[rows],
+            "desplazamiento": distance[rows],
+        }, pb_[rows]
+
+    writer = _ReportWriter(outputs, a.crs)
+    n_modified, ok = 0, False
+    try:
+        _unmatched_rows(REMOVED, a, removed, key, writer, "fila_a")
+        _unmatched_rows(ADDED, b, added, key, writer, "fila_b")
+        # Bloques en paralelo, escritos en orden; como mucho 2 por hilo en vuelo
+        blocks = deque(_in_blocks(len(pos_a)))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = deque()
+            while blocks or pending:
+                while blocks and len(pending) < 2 * max(1, workers):
+                    pending.append(pool.submit(block_diff, blocks.popleft()))
+                rows, b_positions = pending.popleft().result()
+                n_modified += len(b_positions)
+                writer.write(rows, b.geometry.values[b_positions])
+        ok = True
+    finally:
+        writer.close(ok)
+
+    counts = {ADDED: len(added), REMOVED: len(removed), MODIFIED: n_modified,
+              "iguales": len(pos_a) - n_modified}
+    return DiffReport(summary, schema, counts, outputs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara la capa B contra la capa A.")
+    parser.add_argument("a", help="capa de referencia")
+    parser.add_argument("b", help="capa a comparar")
+    parser.add_argument("--key", nargs="+", help="columna(s) clave; sin clave se empareja por geometría")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="desplazamiento tolerado (m si el CRS es geográfico)")
+    parser.add_argument("--match-distance", type=float, help="radio del emparejamiento espacial")
+    parser.add_argument("--out", nargs="+", default=[], help="informe: .parquet/.geoparquet y/o .csv")
+    parser.add_argument("--workers", type=int, default=DIFF_WORKERS)
+    args = parser.parse_args(argv)
+
+    report = compare_layers(args.a, args.b, key=args.key, tolerance=args.tolerance,
+                            match_distance=args.match_distance, out=args.out, workers=args.workers)
+    print(report.summary.to_string(index=False))
+    print()
+    print(report.schema.to_string(index=False))
+    print()
+    for status, count in report.counts.items():
+        print(f"{status}: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
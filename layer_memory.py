@@ -0,0 +1,185 @@
+"""Memoria de las capas de una sesión: representación compacta y presupuesto.
+
+- compact_gdf(): columnas de texto como categorías (si se repiten mucho) o
+  como texto de Arrow (dtype "str" de pandas 3, fijado en requirements.txt),
+  y enteros reducidos al tipo más pequeño que los contiene. Los decimales no se reducen (se perdería precisión).
+- Presupuesto por sesión (SESSION_MEMORY_BUDGET): si las capas de referencia
+  en memoria lo superan, las menos usadas recientemente se vuelcan a disco.
+  Una capa volcada guarda solo su esquema; sus geometrías quedan como WKB en
+  GeoParquet hasta que se vuelve a mostrar o consultar. Las capas de la caché
+  (con clave) no se reescriben: se suelta el handle del almacén compartido y
+  se vuelve a pedir al usarla. Las demás se escriben en el área de scratch como
+  archivos fijados (scratch.pin): el barrido por antigüedad no los borra
+  mientras la sesión los conserve.
+"""
+import os
+import time
+
+import pandas as pd
+
+from layer_cache import estimate_gdf_bytes
+from layer_store import layer_store
+from project_io import read_project, write_project
+from scratch import scratch
+from search_index import layer_search_index
+from spatial_index import layer_index
+
+SESSION_MEMORY_BUDGET = int(os.environ.get("GEOEDITOR_SESSION_MEMORY_MB", "1024")) * 1024 * 1024
+# Texto con menos de esta proporción de valores distintos se guarda como categoría
+CATEGORY_MAX_RATIO = 0.5
+
+
+# --- REPRESENTACIÓN COMPACTA ---
+def compact_gdf(gdf, editable=False):
+    """Copia de `gdf` con tipos compactos. `editable`: solo texto de Arrow (la tabla acepta valores nuevos)."""
+    out = gdf.copy(deep=False)
+    for col in out.columns:
+        if col == out.geometry.name:
+            continue
+        series = out[col]
+        if series.dtype == object:
+            values = series.dropna()
+            if len(values) and pd.api.types.infer_dtype(values, skipna=True) != "string":
+                continue  # mezcla de tipos: se deja como está
+            n_unique = values.nunique()
+            if not editable and len(values) and n_unique / len(values) < CATEGORY_MAX_RATIO:
+                out[col] = series.astype("category")
+            else:
+                out[col] = series.astype("str")
+        elif pd.api.types.is_string_dtype(series.dtype) and not editable and len(series):
+            if series.nunique() / len(series) < CATEGORY_MAX_RATIO:
+                out[col] = series.astype("category")
+        elif pd.api.types.is_integer_dtype(series.dtype) and not editable and series.dtype.kind in "iu":
+            out[col] = pd.to_numeric(series, downcast="unsigned" if series.dtype.kind == "u" else "integer")
+    return out
+
+
+# --- ÍNDICES ---
+def index_layer(layer):
+    """Índices de búsqueda y espacial de una capa vectorial (compartidos si viene del almacén)."""
+    data, handle = layer['data'], layer.get('handle')
+    if handle:
+        layer['search'] = handle.derived('search', lambda: layer_search_index(data))
+        layer['sindex'] = handle.derived('sindex', lambda: layer_index(data))
+    else:
+        layer['search'] = layer_search_index(data)
+        layer['sindex'] = layer_index(data)
+
+
+# --- TESELAS ---
+def layer_tiles(layer, params, build):
+    """Fuente de teselas de la capa (TileRegistration) para `params`.
+
+    Con handle es un derivado del almacén (se da de baja al soltar el último
+    handle); si no, la guarda la capa y se cierra al cambiar `params`, al
+    volcarla o al quitarla.
+    """
+    if layer.get('handle'):
+        return layer['handle'].derived(('tiles',) + tuple(params), build)
+    if layer.get('tiles', (None,))[0] != params:
+        close_tiles(layer)
+        layer['tiles'] = (params, build())
+    return layer['tiles'][1]
+
+
+def close_tiles(layer):
+    tiles = layer.pop('tiles', None)
+    if tiles:
+        tiles[1].close()
+
+
+# --- PRESUPUESTO ---
+def footprint(layer):
+    """Bytes estimados en memoria de una capa de referencia (0 si está en disco o es raster)."""
+    if layer['type'] != 'vector' or layer.get('spilled'):
+        return 0
+    if 'bytes' not in layer:
+        layer['bytes'] = estimate_gdf_bytes(layer['data'])
+    return layer['bytes']
+
+
+def layer_columns(layer):
+    """Columnas de atributos de una capa vectorial, esté en memoria o volcada."""
+    if layer.get('spilled'):
+        return layer['columns']
+    return [c for c in layer['data'].columns if c != layer['data'].geometry.name]
+
+
+def touch(layer):
+    layer['last_used'] = time.monotonic()
+
+
+def spill(layer):
+    """Vuelca una capa vectorial a disco y suelta sus datos e índices."""
+    if layer['type'] != 'vector' or layer.get('spilled'):
+        return
+    layer['columns'] = layer_columns(layer)
+    close_tiles(layer)
+    if layer.get('handle'):
+        # La copia en disco es la de la caché de capas
+        layer['handle'].release()
+        layer['handle'] = None
+    else:
+        layer['spill_file'] = scratch.pin(".parquet", nbytes=footprint(layer))
+        write_project(layer['data'], layer['spill_file'].path)
+    for name in ('data', 'search', 'sindex', 'encoded', 'bytes'):
+        layer.pop(name, None)
+    layer['spilled'] = True
+
+
+def ensure_resident(layer):
+    """Carga de nuevo una capa volcada. False si ya no está en disco (expulsada de la caché)."""
+    touch(layer)
+    if not layer.get('spilled'):
+        return True
+    if layer.get('key'):
+        handle = layer_store.acquire(layer['key'])
+        if handle is None:
+            return False
+        layer.update(handle.entry(), handle=handle)
+    else:
+        spill_file = layer.get('spill_file')
+        if spill_file is None or not os.path.exists(spill_file.path):
+            return False
+        layer['data'] = read_project(spill_file.path)
+        layer.pop('spill_file').close()
+    layer['spilled'] = False
+    index_layer(layer)
+    return True
+
+
+def enforce_budget(layers, budget=SESSION_MEMORY_BUDGET, since=None):
+    """Vuelca las capas menos usadas hasta quedar dentro de `budget`.
+
+    Las usadas desde `since` (p. ej. en este rerun) no se vuelcan. Retorna los
+    nombres volcados.
+    """
+    total = sum(footprint(layer) for layer in layers.values())
+    spilled = []
+    candidates = sorted(
+        (item for item in layers.items() if footprint(item[1]) and
+         (since is None or item[1].get('last_used', 0) < since)),
+        key=lambda item: item[1].get('last_used', 0))
+    for name, layer in candidates:
+        if total <= budget:
+            break
+        total -= footprint(layer)
+        spill(layer)
+        spilled.append(name)
+    return spilled
+
+
+def memory_table(layers):
+    """Filas (capa, estado, MB, sesiones) para la vista de memoria."""
+    refs = {key: n for key, _, n, _ in layer_store.stats()}
+    rows = []
+    for name, layer in layers.items():
+        if layer['type'] != 'vector':
+            state = "disco (imagen)"
+        elif layer.get('spilled'):
+            state = "en disco"
+        else:
+            state = "en memoria"
+        sessions = refs.get(layer.get('key'), 1) if layer.get('handle') else 1
+        rows.append((name, state, round(footprint(layer) / 2**20, 1), sessions))
+    return pd.DataFrame(rows, columns=["Capa", "Estado", "MB", "Sesiones"])
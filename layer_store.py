@@ -0,0 +1,143 @@
+"""Almacén de capas de referencia compartido por todas las sesiones del proceso.
+
+La caché de capas (layer_cache) evita reingerir un archivo ya procesado, pero
+cada sesión que abre una capa guarda su propia referencia a los datos, y si
+la caché en memoria ya la desalojó, cada sesión vuelve a leerla de disco:
+diez analistas con la misma capa base eran diez copias. Aquí hay una sola
+copia por clave de contenido, con un contador de referencias:
+
+- acquire(key) entrega un LayerHandle a la sesión; la capa se carga de la
+  caché solo si ninguna otra sesión la tiene.
+- handle.entry() es una vista de solo lectura: copia superficial con
+  copy-on-write (pandas), así que si una sesión modifica su vista la copia
+  se hace en ese momento y sin tocar la compartida.
+- handle.derived(nombre, build) comparte también lo que se calcula a partir
+  de la capa (índices, geometrías codificadas para el mapa).
+- Al liberar el último handle (release() o la sesión termina y el handle se
+  recolecta) la capa y sus derivados salen del almacén. Los derivados con
+  close() (p. ej. fuentes del servidor de teselas) se cierran al salir.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+
+from layer_cache import estimate_gdf_bytes, shared_cache
+
+# Derivados que se guardan por capa (p. ej. codificaciones con distintos parámetros)
+DERIVED_LIMIT = 8
+
+
+class LayerHandle:
+    """Referencia de una sesión a una capa del almacén."""
+
+    def __init__(self, store, key):
+        self.key = key
+        self._store = store
+        # Se libera al llamar release() o cuando el handle se recolecta (fin de la sesión)
+        self._finalizer = weakref.finalize(self, store._release, key)
+
+    @property
+    def released(self):
+        return not self._finalizer.alive
+
+    def entry(self):
+        return self._store._view(self.key)
+
+    def derived(self, name, build):
+        """Valor derivado de la capa, calculado una vez para todas las sesiones."""
+        return self._store._derived(self.key, name, build)
+
+    def release(self):
+        self._finalizer()
+
+
+class LayerStore:
+    """Capas en uso por alguna sesión, una copia por clave, con contador de referencias."""
+
+    def __init__(self, cache=shared_cache):
+        self._cache = cache
+        self._layers = {}  # clave -> {'entry', 'refs', 'bytes', 'derived'}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Vista de la capa si alguna sesión la tiene; si no, la entrada de la caché (o None)."""
+        with self._lock:
+            if key in self._layers:
+                return self._view_locked(key)
+        return self._cache.get(key)
+
+    def acquire(self, key, entry=None):
+        """Handle de la capa `key`. `entry` evita releerla de la caché si ya se tiene. None si no existe."""
+        with self._lock:
+            if key not in self._layers:
+                if entry is None:
+                    entry = self._cache.get(key)
+                if entry is None:
+                    return None
+                size = estimate_gdf_bytes(entry['data']) if entry['type'] == 'vector' else 0
+                self._layers[key] = {'entry': entry, 'refs': 0, 'bytes': size, 'derived': OrderedDict()}
+            self._layers[key]['refs'] += 1
+        return LayerHandle(self, key)
+
+    def stats(self):
+        """[(clave, tipo, referencias, bytes estimados)] de las capas en uso."""
+        with self._lock:
+            return [(key, slot['entry']['type'], slot['refs'], slot['bytes']) for key, slot in self._layers.items()]
+
+    def __len__(self):
+        return len(self._layers)
+
+    # --- INTERNOS ---
+    def _release(self, key):
+        with self._lock:
+            slot = self._layers.get(key)
+            if slot is None:
+                return
+            slot['refs'] -= 1
+            if slot['refs'] > 0:
+                return
+            del self._layers[key]
+        _close(slot['derived'].values())
+
+    def _view(self, key):
+        with self._lock:
+            return self._view_locked(key)
+
+    def _view_locked(self, key):
+        view = dict(self._layers[key]['entry'], key=key)
+        if view['type'] == 'vector':
+            view['data'] = view['data'].copy(deep=False)
+        return view
+
+    def _derived(self, key, name, build):
+        with self._lock:
+            derived = self._layers[key]['derived']
+            if name in derived:
+                derived.move_to_end(name)
+                return derived[name]
+        # Se construye fuera del lock: si dos sesiones coinciden, se queda el primero
+        built = build()
+        dropped = []
+        with self._lock:
+            slot = self._layers.get(key)
+            if slot is None:
+                return built
+            value = slot['derived'].setdefault(name, built)
+            if value is not built:
+                dropped.append(built)
+            while len(slot['derived']) > DERIVED_LIMIT:
+                dropped.append(slot['derived'].popitem(last=False)[1])
+        _close(dropped)
+        return value
+
+
+def _close(values):
+    """Cierra los derivados que lo admiten (fuentes de teselas)."""
+    for value in values:
+        close = getattr(value, "close", None)
+        if callable(close):
+            close()
+
+
+# Instancia compartida por todas las sesiones del proceso
+layer_store = LayerStore()
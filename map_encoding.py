@@ -0,0 +1,245 @@
+"""Codificación de capas para el mapa: simplificación, cuantización y TopoJSON.
+
+Lo que se embebe en el HTML del mapa no necesita más detalle del que se ve:
+- Simplificación por zoom (Douglas-Peucker que preserva topología) con
+  tolerancia de medio píxel.
+- Cuantización: coordenadas redondeadas a los decimales que distingue un
+  píxel a ese zoom (sin 15 dígitos por coordenada).
+- TopoJSON opcional: coordenadas enteras con codificación delta y los bordes
+  compartidos entre entidades (p. ej. predios vecinos) se escriben una vez.
+"""
+import math
+
+import numpy as np
+import shapely
+
+from spatial_index import zoom_tolerance
+
+# Decimales mínimos y máximos de la cuantización automática
+MIN_DIGITS = 4
+MAX_DIGITS = 9
+# Zoom de detalle para capas que se montan con el mapa (no se recodifican al hacer zoom)
+STATIC_DETAIL_ZOOM = 16
+# Resolución de la rejilla entera de TopoJSON (por eje)
+TOPOJSON_QUANTIZATION = 1_000_000
+
+
+def zoom_digits(zoom, pixels=0.25):
+    """Decimales que distinguen `pixels` de píxel a ese zoom."""
+    step = zoom_tolerance(zoom, pixels)
+    return max(MIN_DIGITS, min(MAX_DIGITS, int(math.ceil(-math.log10(step)))))
+
+
+def encode_geometries(gdf, zoom=None, simplify=True, digits=None, coverage=False):
+    """Copia de `gdf` con las geometrías simplificadas y cuantizadas para `zoom`.
+
+    - simplify: tolerancia de medio píxel (requiere zoom).
+    - digits: decimales de salida; None = según el zoom (sin zoom no se cuantiza).
+    - coverage: simplificar los polígonos como cobertura, de modo que los bordes
+      compartidos se simplifiquen igual en ambos lados (para TopoJSON). Solo en
+      capas de polígonos; las demás se simplifican entidad por entidad.
+    Las geometrías que quedan vacías se descartan.
+    """
+    geoms = gdf.geometry.values
+    if simplify and zoom is not None:
+        if coverage and is_topojson_candidate(gdf):
+            # coverage_simplify no admite nulos ni vacíos: se simplifica el resto y se reubica
+            geoms = np.asarray(geoms)
+            valid = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+            geoms = geoms.copy()
+            geoms[valid] = shapely.coverage_simplify(geoms[valid], zoom_tolerance(zoom))
+        else:
+            geoms = shapely.simplify(geoms, zoom_tolerance(zoom), preserve_topology=True)
+    if digits is None and zoom is not None:
+        digits = zoom_digits(zoom)
+    if digits is not None:
+        geoms = shapely.set_precision(geoms, 10.0 ** -digits)
+        # set_precision deja la rejilla, el redondeo acorta la representación decimal
+        geoms = shapely.transform(geoms, lambda coords: np.round(coords, digits))
+    out = gdf.set_geometry(np.asarray(geoms), crs=gdf.crs)
+    return out[~shapely.is_empty(np.asarray(geoms))]
+
+
+# --- TOPOJSON ---
+def _parts(geom):
+    """Descompone una geometría en (tipo, anillos/líneas como arrays de coordenadas)."""
+    kind = shapely.get_type_id(geom)
+    if kind == 1:  # LineString
+        return "LineString", [np.asarray(geom.coords)]
+    if kind == 3:  # Polygon
+        return "Polygon", [[np.asarray(geom.exterior.coords)] + [np.asarray(r.coords) for r in geom.interiors]]
+    if kind == 5:  # MultiLineString
+        return "MultiLineString", [np.asarray(g.coords) for g in geom.geoms]
+    if kind == 6:  # MultiPolygon
+        return "MultiPolygon", [[np.asarray(p.exterior.coords)] + [np.asarray(r.coords) for r in p.interiors]
+                                for p in geom.geoms]
+    return None, None
+
+
+class _ArcBuilder:
+    """Corta líneas en los nodos compartidos y deduplica arcos (también invertidos)."""
+
+    def __init__(self, lines):
+        # Nodo: punto usado por varias líneas con vecinos distintos, o extremo de una línea abierta
+        neighbours = {}
+        self.junctions = set()
+        for line, closed in lines:
+            n = len(line)
+            for i, point in enumerate(line):
+                if closed and i == n - 1:
+                    break
+                if closed:
+                    prev, nxt = line[i - 1] if i else line[n - 2], line[i + 1]
+                else:
+                    if i == 0 or i == n - 1:
+                        self.junctions.add(point)
+                        continue
+                    prev, nxt = line[i - 1], line[i + 1]
+                pair = (prev, nxt) if prev <= nxt else (nxt, prev)
+                seen = neighbours.get(point)
+                if seen is None:
+                    neighbours[point] = pair
+                elif seen != pair:
+                    self.junctions.add(point)
+        self.arcs = []
+        self._index = {}
+
+    def _arc(self, points):
+        key = tuple(points)
+        if key in self._index:
+            return self._index[key]
+        reverse = key[::-1]
+        if reverse in self._index:
+            return ~self._index[reverse]
+        self._index[key] = len(self.arcs)
+        self.arcs.append(points)
+        return self._index[key]
+
+    def split(self, line, closed):
+        """Índices de arco de una línea (anillo si `closed`)."""
+        if closed:
+            body = line[:-1]
+            cuts = [i for i, p in enumerate(body) if p in self.junctions]
+            if not cuts:
+                # Anillo sin nodos: un solo arco, empezando en el punto menor para deduplicar
+                start = body.index(min(body))
+                ring = body[start:] + body[:start]
+                return [self._arc(ring + [ring[0]])]
+            body = body[cuts[0]:] + body[:cuts[0]]
+            line = body + [body[0]]
+        arcs, start = [], 0
+        for i in range(1, len(line)):
+            if i == len(line) - 1 or line[i] in self.junctions:
+                arcs.append(self._arc(line[start:i + 1]))
+                start = i
+        return arcs
+
+
+def _json_value(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def to_topojson(gdf, properties=(), object_name="data", quantization=TOPOJSON_QUANTIZATION):
+    """Topología TopoJSON (dict) de una capa de líneas/polígonos.
+
+    Las coordenadas se cuantizan a una rejilla entera de `quantization` pasos
+    por eje y los arcos se codifican en delta. Puntos y geometrías vacías se
+    omiten (usar GeoJSON para capas de puntos).
+    """
+    geoms = gdf.geometry.values
+    minx, miny, maxx, maxy = shapely.total_bounds(geoms)
+    kx = (maxx - minx) / (quantization - 1) or 1.0
+    ky = (maxy - miny) / (quantization - 1) or 1.0
+
+    def quantize(coords):
+        q = np.empty((len(coords), 2), dtype=np.int64)
+        q[:, 0] = np.round((coords[:, 0] - minx) / kx)
+        q[:, 1] = np.round((coords[:, 1] - miny) / ky)
+        # Quitar puntos repetidos tras cuantizar
+        keep = np.ones(len(q), dtype=bool)
+        keep[1:] = np.any(q[1:] != q[:-1], axis=1)
+        return [tuple(p) for p in q[keep].tolist()]
+
+    features = []
+    for i, geom in enumerate(geoms):
+        if geom is None or geom.is_empty:
+            continue
+        kind, parts = _parts(geom)
+        if kind is None:
+            continue
+        if kind == "Polygon":
+            parts = [[quantize(r) for r in parts[0]]]
+        elif kind == "MultiPolygon":
+            parts = [[quantize(r) for r in poly] for poly in parts]
+        else:
+            parts = [quantize(l) for l in parts]
+        features.append((i, kind, parts))
+
+    lines = []
+    for _, kind, parts in features:
+        if kind in ("Polygon", "MultiPolygon"):
+            lines.extend((ring, True) for poly in parts for ring in poly if len(ring) >= 4)
+        else:
+            lines.extend((line, False) for line in parts if len(line) >= 2)
+    builder = _ArcBuilder(lines)
+
+    records = gdf[list(properties)].to_dict("records") if properties else None
+    objects = []
+    for i, kind, parts in features:
+        if kind == "Polygon":
+            arcs = [builder.split(r, True) for r in parts[0] if len(r) >= 4]
+        elif kind == "MultiPolygon":
+            arcs = [[builder.split(r, True) for r in poly if len(r) >= 4] for poly in parts]
+        elif kind == "LineString":
+            arcs = builder.split(parts[0], False) if len(parts[0]) >= 2 else []
+        else:
+            arcs = [builder.split(l, False) for l in parts if len(l) >= 2]
+        if not arcs:
+            continue
+        obj = {"type": kind, "arcs": arcs}
+        if records is not None:
+            obj["properties"] = {k: _json_value(v) for k, v in records[i].items()}
+        objects.append(obj)
+
+    encoded = []
+    for arc in builder.arcs:
+        points = np.asarray(arc, dtype=np.int64)
+        points[1:] = points[1:] - points[:-1]
+        encoded.append(points.tolist())
+
+    return {
+        "type": "Topology",
+        "transform": {"scale": [kx, ky], "translate": [minx, miny]},
+        "objects": {object_name: {"type": "GeometryCollection", "geometries": objects}},
+        "arcs": encoded,
+    }
+
+
+def is_topojson_candidate(gdf):
+    """True si la capa es de polígonos (Polygon/MultiPolygon, admite nulos).
+
+    Los bordes compartidos que TopoJSON escribe una vez son los de polígonos
+    vecinos; la simplificación de cobertura solo acepta polígonos.
+    """
+    types = shapely.get_type_id(gdf.geometry.values)
+    types = types[types >= 0]
+    return len(types) > 0 and np.isin(types, (3, 6)).all()
+
+
+def feature_collection(gdf):
+    """FeatureCollection solo con geometría e id (el índice) de cada entidad.
+
+    Retorna (collection, {id: feature}) para poder armar subconjuntos (p. ej.
+    la selección) sin volver a serializar ni copiar la capa.
+    """
+    features = [
+        {"type": "Feature", "id": fid, "properties": {}, "geometry": geom.__geo_interface__}
+        for fid, geom in zip(gdf.index.tolist(), gdf.geometry.values)
+    ]
+    return {"type": "FeatureCollection", "features": features}, dict(zip(gdf.index.tolist(), features))
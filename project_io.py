@@ -0,0 +1,58 @@
+"""Lectura y escritura del archivo de trabajo (Cargar / Guardar).
+
+El formato de proyecto es GeoParquet: columnar, comprimido y con la geometría
+en WKB, así que abrir un proyecto grande no pasa por parsear texto. Se escribe
+con una columna de bbox por entidad y grupos de filas acotados, lo que permite
+leer solo algunas columnas o solo las entidades de un área sin leer el resto,
+y se puede abrir con memory-map. GeoJSON, Shapefile y demás formatos de GDAL
+se siguen aceptando por extensión.
+"""
+import json
+import os
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+PROJECT_EXTENSIONS = (".parquet", ".geoparquet")
+# Filas por grupo: granularidad del filtrado por bbox al leer
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def is_project_file(path):
+    return path.lower().endswith(PROJECT_EXTENSIONS)
+
+
+def read_project(path, columns=None, bbox=None, memory_map=True):
+    """Lee el archivo de trabajo.
+
+    - columns: solo estas columnas (la geometría se añade siempre).
+    - bbox: (minx, miny, maxx, maxy), solo las entidades que lo intersectan.
+    - memory_map: en GeoParquet, mapear el archivo en vez de leerlo a memoria.
+    """
+    if is_project_file(path):
+        if columns is not None:
+            columns = list(dict.fromkeys(list(columns) + [_geometry_column(path)]))
+        return gpd.read_parquet(path, columns=columns, bbox=bbox, memory_map=memory_map)
+    return gpd.read_file(path, columns=columns, bbox=bbox)
+
+
+def write_project(gdf, path):
+    """Guarda el archivo de trabajo. La escritura es atómica (temporal + rename)."""
+    tmp_path = f"{path}.tmp"
+    if is_project_file(path):
+        gdf.to_parquet(tmp_path, compression="zstd", write_covering_bbox=True,
+                       row_group_size=ROW_GROUP_SIZE)
+    elif path.lower().endswith(".shp"):
+        # Un Shapefile son varios archivos: no se puede renombrar como uno solo
+        gdf.to_file(path)
+        return
+    else:
+        gdf.to_file(tmp_path, driver="GeoJSON")
+    os.replace(tmp_path, path)
+
+
+def _geometry_column(path):
+    """Nombre de la columna de geometría principal según los metadatos GeoParquet."""
+    metadata = pq.read_schema(path).metadata or {}
+    geo = json.loads(metadata.get(b"geo", b"{}"))
+    return geo.get("primary_column", "geometry")
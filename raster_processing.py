@@ -0,0 +1,276 @@
+"""Reproyección por bloques de rasters a EPSG:4326 para overlays de imagen única.
+
+La salida se planifica antes de leer píxeles (resolución máxima, factor de
+reducción o zoom objetivo) y se reproyecta por ventanas en paralelo: cada hilo
+tiene su propio dataset y escribe su bloque en un array respaldado por disco,
+así que la memoria usada depende del tamaño de bloque, no del raster.
+
+Los datos se reproyectan en su tipo original (16 bits, float...) y se pasan a
+8 bits al final, por franjas de filas, con un estiramiento por percentiles
+calculado sobre overviews o ventanas de muestra. El nodata se vuelve canal
+alfa y el PNG se escribe en streaming, sin tener la imagen entera en memoria.
+"""
+import math
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import rasterio
+from rasterio.transform import array_bounds, from_bounds
+from rasterio.warp import calculate_default_transform, reproject, Resampling
+from rasterio.windows import Window, transform as window_transform
+
+from scratch import scratch
+
+DST_CRS = 'EPSG:4326'
+DEFAULT_WORKERS = os.cpu_count() or 1
+# Presupuesto de memoria de trabajo para los bloques en vuelo (todas las hebras)
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# Percentiles del estiramiento de contraste para datos que no son uint8
+DEFAULT_PERCENTILES = (2, 98)
+# Lado máximo de la muestra usada para calcular percentiles
+STRETCH_SAMPLE_SIZE = 1024
+
+
+def plan_output(src, max_size=None, downsample=None, target_zoom=None, dst_crs=DST_CRS):
+    """Transform, ancho y alto del raster destino. No lee píxeles.
+
+    - max_size: lado máximo de la imagen de salida en píxeles.
+    - downsample: factor de reducción explícito (2 = mitad de resolución).
+    - target_zoom: no generar más detalle del que se ve a ese zoom de Leaflet.
+    """
+    transform, width, height = calculate_default_transform(
+        src.crs, dst_crs, src.width, src.height, *src.bounds)
+
+    factor = 1.0
+    if downsample:
+        factor = max(factor, float(downsample))
+    if max_size:
+        factor = max(factor, max(width, height) / float(max_size))
+    if target_zoom is not None:
+        # Grados por píxel de pantalla a ese zoom (a lo ancho, en el ecuador)
+        deg_per_px = 360.0 / (256 * 2 ** target_zoom)
+        factor = max(factor, deg_per_px / abs(transform.a))
+
+    if factor > 1:
+        bounds = array_bounds(height, width, transform)
+        width = max(1, int(math.ceil(width / factor)))
+        height = max(1, int(math.ceil(height / factor)))
+        west, south, east, north = bounds[0], bounds[1], bounds[2], bounds[3]
+        transform = from_bounds(west, south, east, north, width, height)
+    return transform, width, height
+
+
+def block_windows(width, height, block_size):
+    """Ventanas que cubren la salida en bloques de `block_size` x `block_size`."""
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+
+def block_size_for_budget(memory_budget, workers, bytes_per_pixel=1):
+    """Lado del bloque (múltiplo de 256) para que los bloques en vuelo quepan en el presupuesto."""
+    # Bloque destino + buffers de lectura/warp de GDAL: ~4x el bloque por hebra
+    pixels = memory_budget / (max(1, workers) * bytes_per_pixel * 4)
+    return max(256, int(math.sqrt(pixels)) // 256 * 256)
+
+
+def output_nodata(src):
+    """Valor nodata del destino: el del origen o, si no tiene, 0 (enteros) / NaN (float)."""
+    if src.nodata is not None:
+        return src.nodata
+    return np.nan if np.issubdtype(np.dtype(src.dtypes[0]), np.floating) else 0
+
+
+def _sample(src, bands, sample_size):
+    """Muestra enmascarada (bandas, alto, ancho) para estadísticas, sin leer todo el raster."""
+    if src.overviews(bands[0]) or max(src.width, src.height) <= sample_size:
+        # Lectura decimada: con overviews GDAL lee solo la overview adecuada
+        scale = max(1.0, max(src.width, src.height) / sample_size)
+        out_shape = (len(bands), max(1, int(src.height / scale)), max(1, int(src.width / scale)))
+        return src.read(bands, out_shape=out_shape, masked=True)
+
+    # Sin overviews: rejilla de 4x4 ventanas repartidas por la imagen
+    side = max(1, sample_size // 4)
+    rows = np.linspace(0, max(0, src.height - side), 4).astype(int)
+    cols = np.linspace(0, max(0, src.width - side), 4).astype(int)
+    parts = [src.read(bands, window=Window(c, r, min(side, src.width), min(side, src.height)), masked=True)
+             for r in rows for c in cols]
+    return np.ma.concatenate([p.reshape(len(bands), -1) for p in parts], axis=1)
+
+
+def compute_stretch(src, bands, percentiles=DEFAULT_PERCENTILES, sample_size=STRETCH_SAMPLE_SIZE):
+    """Límites (low, high) por banda para llevar los datos a 0-255.
+
+    Retorna None si el raster ya es uint8 (se usa tal cual).
+    """
+    if np.dtype(src.dtypes[0]) == np.uint8:
+        return None
+    sample = _sample(src, bands, sample_size).reshape(len(bands), -1)
+    low = np.zeros(len(bands), dtype=np.float64)
+    high = np.ones(len(bands), dtype=np.float64)
+    for i in range(len(bands)):
+        values = sample[i].compressed()
+        values = values[np.isfinite(values)]
+        if values.size:
+            low[i], high[i] = np.percentile(values, percentiles)
+        if high[i] <= low[i]:
+            high[i] = low[i] + 1
+    return low, high
+
+
+def to_uint8(data, stretch):
+    """Convierte un bloque (..., bandas) a uint8 aplicando el estiramiento por banda."""
+    if stretch is None:
+        return data if data.dtype == np.uint8 else np.clip(data, 0, 255).astype(np.uint8)
+    low, high = stretch
+    scaled = (data.astype(np.float32) - low.astype(np.float32)) * (255.0 / (high - low)).astype(np.float32)
+    np.nan_to_num(scaled, copy=False)
+    return np.clip(scaled, 0, 255, out=scaled).astype(np.uint8)
+
+
+def valid_mask(data, nodata):
+    """Píxeles con dato en un bloque (..., bandas): alguna banda distinta de nodata."""
+    if isinstance(nodata, float) and math.isnan(nodata):
+        return ~np.all(np.isnan(data), axis=-1)
+    return ~np.all(data == nodata, axis=-1)
+
+
+def write_png_streaming(png_path, width, height, channels, row_chunks):
+    """Escribe un PNG de 8 bits a partir de franjas (filas, ancho, canales) uint8.
+
+    La compresión es incremental: solo hay una franja en memoria a la vez.
+    """
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]  # L, LA, RGB, RGBA
+
+    def chunk(f, tag, payload):
+        f.write(struct.pack(">I", len(payload)))
+        f.write(tag + payload)
+        f.write(struct.pack(">I", zlib.crc32(tag + payload) & 0xFFFFFFFF))
+
+    compressor = zlib.compressobj(6)
+    with open(png_path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+        for rows in row_chunks:
+            # Cada fila va precedida del byte de filtro (0 = sin filtro)
+            raw = np.zeros((rows.shape[0], width * channels + 1), dtype=np.uint8)
+            raw[:, 1:] = rows.reshape(rows.shape[0], -1)
+            data = compressor.compress(raw.tobytes())
+            if data:
+                chunk(f, b"IDAT", data)
+        chunk(f, b"IDAT", compressor.flush())
+        chunk(f, b"IEND", b"")
+
+
+def reproject_to_memmap(path, bands, transform, width, height, dtype=np.uint8, nodata=0,
+                        workers=DEFAULT_WORKERS, memory_budget=DEFAULT_MEMORY_BUDGET,
+                        resampling=Resampling.nearest, progress=None, scratch_dir=None):
+    """Reproyecta `bands` de `path` a un memmap (alto, ancho, bandas) en disco.
+
+    Bandas y ventanas se reparten entre `workers` hebras; GDAL libera el GIL
+    durante el warp, así que escala con los núcleos. Los píxeles sin dato quedan
+    con `nodata`. Retorna (memmap, ruta).
+    """
+    fd, out_path = tempfile.mkstemp(suffix=".raw", dir=scratch_dir or scratch.root)
+    os.close(fd)
+    out = np.memmap(out_path, dtype=dtype, mode="w+", shape=(height, width, len(bands)))
+
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+
+    def dataset():
+        src = getattr(local, "src", None)
+        if src is None:
+            src = local.src = rasterio.open(path)
+            with opened_lock:
+                opened.append(src)
+        return src
+
+    def warp(idx, band, window):
+        src = dataset()
+        block = np.full((int(window.height), int(window.width)), nodata, dtype=dtype)
+        reproject(
+            source=rasterio.band(src, band),
+            destination=block,
+            src_transform=src.transform,
+            src_crs=src.crs,
+            src_nodata=src.nodata,
+            dst_nodata=nodata,
+            dst_transform=window_transform(window, transform),
+            dst_crs=DST_CRS,
+            resampling=resampling,
+            num_threads=1)
+        row, col = int(window.row_off), int(window.col_off)
+        out[row:row + block.shape[0], col:col + block.shape[1], idx] = block
+
+    block_size = block_size_for_budget(memory_budget, workers, np.dtype(dtype).itemsize)
+    tasks = [(idx, band, window)
+             for window in block_windows(width, height, block_size)
+             for idx, band in enumerate(bands)]
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(warp, *task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if progress:
+                    progress(done, len(tasks))
+        out.flush()
+    except BaseException:
+        del out
+        os.remove(out_path)
+        raise
+    finally:
+        for src in opened:
+            src.close()
+    return out, out_path
+
+
+def raster_to_png(path, png_path=None, max_size=None, downsample=None, target_zoom=None,
+                  workers=DEFAULT_WORKERS, memory_budget=DEFAULT_MEMORY_BUDGET, progress=None):
+    """Reproyecta un raster a EPSG:4326 y lo guarda como PNG con transparencia.
+
+    Los intermedios (array reproyectado y PNG) van al área de trabajo, con
+    reserva previa de espacio; `path` puede ser una ruta /vsimem/ de GDAL.
+
+    Retorna (png_path, folium_bounds) con bounds [[lat_min, lon_min], [lat_max, lon_max]].
+    """
+    with rasterio.open(path) as src:
+        transform, width, height = plan_output(src, max_size, downsample, target_zoom)
+        # Asumimos RGB o Gris: las 3 primeras bandas si hay más de 2, si no la primera
+        bands = [1, 2, 3] if src.count >= 3 else [1]
+        dtype = np.dtype(src.dtypes[0])
+        nodata = output_nodata(src)
+        stretch = compute_stretch(src, bands)
+
+    # Array intermedio + PNG (cota superior: sin comprimir)
+    scratch.reserve(width * height * (len(bands) * dtype.itemsize + len(bands) + 1))
+    data, raw_path = reproject_to_memmap(
+        path, bands, transform, width, height, dtype=dtype, nodata=nodata,
+        workers=workers, memory_budget=memory_budget, progress=progress)
+    try:
+        # Franjas de filas acotadas por el presupuesto (datos float + salida uint8)
+        rows_per_chunk = max(1, memory_budget // (width * (len(bands) + 1) * 8))
+
+        def row_chunks():
+            for row in range(0, height, rows_per_chunk):
+                block = data[row:row + rows_per_chunk]
+                out = np.empty(block.shape[:2] + (len(bands) + 1,), dtype=np.uint8)
+                out[..., :-1] = to_uint8(block, stretch)
+                out[..., -1] = np.where(valid_mask(block, nodata), 255, 0)
+                yield out
+
+        if png_path is None:
+            png_path = scratch.path(".png")
+        write_png_streaming(png_path, width, height, len(bands) + 1, row_chunks())
+    finally:
+        del data
+        os.remove(raw_path)
+
+    lon_min, lat_min, lon_max, lat_max = array_bounds(height, width, transform)
+    return png_path, [[lat_min, lon_min], [lat_max, lon_max]]
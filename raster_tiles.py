@@ -0,0 +1,154 @@
+"""Pirámide de teselas XYZ perezosa para rasters georreferenciados.
+
+En vez de reproyectar la imagen completa a un único PNG, cada tesela 256x256 se
+genera al pedirla: se lee solo la ventana del origen que cubre la tesela, a la
+resolución de salida (GDAL aprovecha las overviews del archivo si existen), y
+se guarda en disco para no recalcularla. La memoria por tesela es constante.
+"""
+import io
+import math
+import os
+import queue
+import threading
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import from_bounds
+
+from raster_processing import compute_stretch, to_uint8
+from tile_server import TileSource, ORIGIN_SHIFT, tile_bounds_3857, tile_server
+
+TILE_SIZE = 256
+# Datasets (con su WarpedVRT) abiertos por raster: el servidor atiende cada
+# petición en una hebra nueva, así que se reutilizan desde un pool
+DATASET_POOL_SIZE = int(os.environ.get("GEOEDITOR_RASTER_POOL", "0")) or min(8, 2 * (os.cpu_count() or 1))
+
+
+def native_zoom(path):
+    """Zoom XYZ cuya resolución equivale a la del raster en EPSG:3857."""
+    with rasterio.open(path) as src, WarpedVRT(src, crs="EPSG:3857") as vrt:
+        res = max(vrt.res)
+    return max(0, min(22, int(math.ceil(math.log2(2 * ORIGIN_SHIFT / TILE_SIZE / res)))))
+
+
+def raster_bounds_4326(path):
+    """Bounds en formato Folium [[lat_min, lon_min], [lat_max, lon_max]]."""
+    with rasterio.open(path) as src:
+        lon_min, lat_min, lon_max, lat_max = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+    return [[lat_min, lon_min], [lat_max, lon_max]]
+
+
+class RasterTileLayer:
+    """Genera teselas PNG (RGBA) de un raster bajo demanda, con caché en disco."""
+
+    def __init__(self, path, tile_dir=None, resampling=Resampling.bilinear):
+        self.path = path
+        self.tile_dir = tile_dir
+        self.resampling = resampling
+        # Pool de (dataset, vrt): rasterio no es thread-safe, cada render usa uno en exclusiva
+        self._pool = queue.Queue()
+        self._opened = []
+        self._pool_lock = threading.Lock()
+
+        with rasterio.open(path) as src:
+            self.indexes = [1, 2, 3] if src.count >= 3 else [1]
+            # Un único estiramiento para toda la pirámide: sin saltos de contraste entre teselas
+            self.stretch = compute_stretch(src, self.indexes)
+        self.max_zoom = native_zoom(path)
+
+    def _checkout(self):
+        """(dataset, vrt) libre del pool; abre uno nuevo si no hay y no se llegó al límite."""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if len(self._opened) < DATASET_POOL_SIZE:
+                src = rasterio.open(self.path)
+                pair = (src, WarpedVRT(src, crs="EPSG:3857", resampling=self.resampling))
+                self._opened.append(pair)
+                return pair
+        return self._pool.get()
+
+    def close(self):
+        """Cierra los datasets abiertos (al dar de baja la fuente del servidor)."""
+        with self._pool_lock:
+            for src, vrt in self._opened:
+                vrt.close()
+                src.close()
+            self._opened = []
+            while not self._pool.empty():
+                self._pool.get_nowait()
+
+    def _tile_path(self, z, x, y):
+        return os.path.join(self.tile_dir, str(z), str(x), f"{y}.png")
+
+    def render(self, z, x, y):
+        if self.tile_dir:
+            tile_path = self._tile_path(z, x, y)
+            if os.path.exists(tile_path):
+                with open(tile_path, "rb") as f:
+                    return f.read()
+
+        pair = self._checkout()
+        try:
+            data = self._render_png(pair[1], z, x, y)
+        finally:
+            self._pool.put(pair)
+
+        if self.tile_dir and data is not None:
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            tmp_path = f"{tile_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, tile_path)
+        return data
+
+    def _render_png(self, vrt, z, x, y):
+        t_minx, t_miny, t_maxx, t_maxy = tile_bounds_3857(z, x, y)
+        v_minx, v_miny, v_maxx, v_maxy = vrt.bounds
+        minx, miny = max(t_minx, v_minx), max(t_miny, v_miny)
+        maxx, maxy = min(t_maxx, v_maxx), min(t_maxy, v_maxy)
+        if minx >= maxx or miny >= maxy:
+            return None
+
+        # Rectángulo destino dentro de la tesela (en píxeles)
+        px = TILE_SIZE / (t_maxx - t_minx)
+        col0 = int(round((minx - t_minx) * px))
+        col1 = int(round((maxx - t_minx) * px))
+        row0 = int(round((t_maxy - maxy) * px))
+        row1 = int(round((t_maxy - miny) * px))
+        if col1 <= col0 or row1 <= row0:
+            return None
+
+        window = from_bounds(minx, miny, maxx, maxy, transform=vrt.transform)
+        out_shape = (len(self.indexes), row1 - row0, col1 - col0)
+        # Lectura decimada: GDAL usa la overview adecuada y nunca lee más que la ventana
+        data = vrt.read(self.indexes, window=window, out_shape=out_shape, resampling=self.resampling)
+        mask = vrt.read_masks(1, window=window, out_shape=out_shape[1:], resampling=Resampling.nearest)
+
+        tile = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        rgb = to_uint8(np.moveaxis(data, 0, -1), self.stretch)
+        tile[row0:row1, col0:col1, :3] = rgb if len(self.indexes) == 3 else rgb[..., :1]
+        tile[row0:row1, col0:col1, 3] = mask
+        if not tile[..., 3].any():
+            return None
+
+        buffer = io.BytesIO()
+        Image.fromarray(tile, mode="RGBA").save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+def raster_tile_source(path, tile_dir=None):
+    """Publica el raster en el servidor local. Retorna el TileRegistration.
+
+    Su max_zoom es el zoom nativo: por encima Leaflet reescala la última
+    tesela en vez de pedir más.
+    """
+    layer = RasterTileLayer(path, tile_dir=tile_dir)
+    return tile_server.publish(TileSource(layer.render, "image/png", "png", max_zoom=layer.max_zoom,
+                                          close=layer.close))
@@ -0,0 +1,155 @@
+"""Área de trabajo en disco (scratch) con cuota y limpieza.
+
+Los intermedios que no caben en memoria (arrays de reproyección, PNG antes de
+entrar en la caché) se escriben aquí en vez de sueltos en /tmp. El área tiene
+una cuota en bytes: antes de escribir se reserva espacio y, si no alcanza, se
+borran primero los archivos abandonados (más viejos que SCRATCH_TTL, p. ej. de
+un proceso que murió) y si aun así no alcanza se rechaza la escritura.
+
+Los archivos que una sesión necesita por tiempo indefinido (capas volcadas
+por el presupuesto de memoria) se piden con pin(): van a PINNED_DIR, cuentan
+para la cuota y el barrido no los borra mientras viva el proceso que los
+creó; se borran con close() o al recolectarse su PinnedFile.
+"""
+import os
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+SCRATCH_DIR = os.environ.get("GEOEDITOR_SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "geoeditor-scratch"))
+SCRATCH_QUOTA = int(os.environ.get("GEOEDITOR_SCRATCH_MB", "4096")) * 1024 * 1024
+SCRATCH_TTL = float(os.environ.get("GEOEDITOR_SCRATCH_TTL_H", "6")) * 3600
+# Intervalo mínimo entre barridos de archivos abandonados
+SWEEP_INTERVAL = 60
+# Subcarpeta de los archivos fijados (pin), con el pid del proceso dueño como prefijo
+PINNED_DIR = "pinned"
+
+
+class ScratchQuotaError(OSError):
+    """No queda espacio en el área de trabajo para el intermedio pedido."""
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _owner_alive(path):
+    """¿Sigue vivo el proceso que fijó `path`? (prefijo `<pid>-` del nombre)."""
+    try:
+        pid = int(os.path.basename(path).split("-", 1)[0])
+    except ValueError:
+        return False
+    if pid == os.getpid() or os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # existe pero es de otro usuario
+    return True
+
+
+class PinnedFile:
+    """Archivo fijado del área; se borra con close() o al recolectarse."""
+
+    def __init__(self, path):
+        self.path = path
+        self._finalizer = weakref.finalize(self, _remove, path)
+
+    def close(self):
+        self._finalizer()
+
+
+class ScratchArea:
+    """Carpeta de intermedios con cuota y caducidad (compartida entre procesos por ruta)."""
+
+    def __init__(self, root=SCRATCH_DIR, quota=SCRATCH_QUOTA, ttl=SCRATCH_TTL):
+        self.root = root
+        self.quota = quota
+        self.ttl = ttl
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        self.pinned_root = os.path.join(self.root, PINNED_DIR)
+        os.makedirs(self.pinned_root, exist_ok=True)
+
+    def _files(self, folder=None):
+        for entry in os.scandir(folder or self.root):
+            if entry.is_file():
+                try:
+                    yield entry.path, entry.stat()
+                except OSError:
+                    pass
+
+    def _all_files(self):
+        yield from self._files()
+        yield from self._files(self.pinned_root)
+
+    def usage(self):
+        return sum(st.st_size for _, st in self._all_files())
+
+    def sweep(self, force=False):
+        """Borra los archivos más viejos que `ttl` y los fijados por procesos que ya no existen.
+
+        Retorna los bytes liberados.
+        """
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < SWEEP_INTERVAL:
+                return 0
+            self._last_sweep = now
+        freed = 0
+        abandoned = [(path, st) for path, st in self._files() if now - st.st_mtime > self.ttl]
+        abandoned += [(path, st) for path, st in self._files(self.pinned_root) if not _owner_alive(path)]
+        for path, st in abandoned:
+            try:
+                os.remove(path)
+                freed += st.st_size
+            except OSError:
+                pass
+        return freed
+
+    def reserve(self, nbytes):
+        """Comprueba que caben `nbytes` más; si no, barre abandonados y reintenta."""
+        self.sweep()
+        if self.usage() + nbytes <= self.quota:
+            return
+        self.sweep(force=True)
+        used = self.usage()
+        if used + nbytes > self.quota:
+            raise ScratchQuotaError(
+                f"Área de trabajo llena: {used // 2**20} MB usados, se piden {nbytes // 2**20} MB "
+                f"(cuota {self.quota // 2**20} MB, GEOEDITOR_SCRATCH_MB)")
+
+    def path(self, suffix="", nbytes=0):
+        """Ruta de un archivo nuevo (vacío) en el área, tras reservar `nbytes`."""
+        self.reserve(nbytes)
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.root)
+        os.close(fd)
+        return path
+
+    def pin(self, suffix="", nbytes=0):
+        """Como path(), pero el barrido no lo borra mientras viva este proceso. Retorna un PinnedFile."""
+        self.reserve(nbytes)
+        fd, path = tempfile.mkstemp(prefix=f"{os.getpid()}-", suffix=suffix, dir=self.pinned_root)
+        os.close(fd)
+        return PinnedFile(path)
+
+    @contextmanager
+    def file(self, suffix="", nbytes=0):
+        """Como path(), pero el archivo se borra al salir del bloque si sigue ahí."""
+        path = self.path(suffix, nbytes)
+        try:
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# Instancia compartida por todo el proceso
+scratch = ScratchArea()
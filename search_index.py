@@ -0,0 +1,131 @@
+"""Índices de búsqueda por atributo para el Buscador.
+
+Cada columna se indexa una sola vez: valores únicos (como texto) ordenados para
+búsqueda por prefijo con bisección, filas agrupadas por valor y, solo si se pide
+una búsqueda aproximada, un índice de trigramas. Los bounds de cada entidad se
+calculan una vez por capa, así que localizar un valor no toca las geometrías.
+"""
+import difflib
+import threading
+
+import numpy as np
+import pandas as pd
+import shapely
+
+DEFAULT_TOP_K = 20
+# Candidatos por trigramas que se reordenan con difflib en la búsqueda aproximada
+FUZZY_CANDIDATES = 200
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ColumnSearchIndex:
+    """Índice de una columna: prefijo por bisección, exacto por grupos, aproximado por trigramas."""
+
+    def __init__(self, series):
+        codes, uniques = pd.factorize(series.astype(str), sort=False)
+        self.values = np.asarray(uniques, dtype=object)
+        folded = np.array([v.casefold() for v in self.values], dtype=object)
+
+        # Orden alfabético (sin mayúsculas) para prefijos
+        self._order = np.argsort(folded, kind="stable")
+        self._sorted = folded[self._order]
+
+        # Filas agrupadas por valor: rows[starts[i]:starts[i + 1]] son las del valor i
+        valid = codes >= 0
+        rows = np.flatnonzero(valid)
+        by_value = np.argsort(codes[valid], kind="stable")
+        self._rows = rows[by_value]
+        self._starts = np.searchsorted(codes[valid][by_value], np.arange(len(self.values) + 1))
+
+        self._folded = folded
+        self._trigram_index = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def count(self, value_id):
+        return int(self._starts[value_id + 1] - self._starts[value_id])
+
+    def rows(self, value_id):
+        """Posiciones de fila con ese valor."""
+        return self._rows[self._starts[value_id]:self._starts[value_id + 1]]
+
+    def prefix(self, query, k=DEFAULT_TOP_K):
+        """Ids de valor que empiezan por `query` (orden alfabético)."""
+        q = query.casefold()
+        lo = np.searchsorted(self._sorted, q, side="left")
+        hi = np.searchsorted(self._sorted, q + "\U0010ffff", side="left")
+        return self._order[lo:min(hi, lo + k)].tolist()
+
+    def fuzzy(self, query, k=DEFAULT_TOP_K, cutoff=0.5):
+        """Ids de valor parecidos a `query`, del más al menos parecido."""
+        q = query.casefold()
+        index = self._build_trigrams()
+        postings = [index[t] for t in _trigrams(q) if t in index]
+        if not postings:
+            return []
+        # Candidatos: los que comparten más trigramas con la consulta
+        hits = np.bincount(np.concatenate(postings), minlength=len(self.values))
+        n = min(FUZZY_CANDIDATES, int((hits > 0).sum()))
+        candidates = np.argpartition(-hits, n - 1)[:n]
+        scored = [(difflib.SequenceMatcher(None, q, self._folded[c]).ratio(), c) for c in candidates]
+        scored = [item for item in scored if item[0] >= cutoff]
+        scored.sort(key=lambda item: (-item[0], self._folded[item[1]]))
+        return [int(c) for _, c in scored[:k]]
+
+    def search(self, query, k=DEFAULT_TOP_K):
+        """Prefijo primero; si no llega a `k` resultados se completa con aproximados."""
+        if not query:
+            return self._order[:k].tolist()
+        found = self.prefix(query, k)
+        if len(found) < k:
+            seen = set(found)
+            found += [c for c in self.fuzzy(query, k) if c not in seen][:k - len(found)]
+        return found
+
+    def _build_trigrams(self):
+        with self._lock:
+            if self._trigram_index is None:
+                postings = {}
+                for value_id, text in enumerate(self._folded):
+                    for tri in _trigrams(text):
+                        postings.setdefault(tri, []).append(value_id)
+                self._trigram_index = {t: np.asarray(ids, dtype=np.int64) for t, ids in postings.items()}
+        return self._trigram_index
+
+
+class LayerSearchIndex:
+    """Índices por columna de una capa (creados la primera vez que se consultan)."""
+
+    def __init__(self, gdf):
+        self.gdf = gdf
+        self.bounds = shapely.bounds(gdf.geometry.values)
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def column(self, col):
+        with self._lock:
+            if col not in self._columns:
+                self._columns[col] = ColumnSearchIndex(self.gdf[col])
+            return self._columns[col]
+
+    def search(self, col, query, k=DEFAULT_TOP_K):
+        """[(value_id, valor, nº entidades)] para la consulta."""
+        index = self.column(col)
+        return [(v, index.values[v], index.count(v)) for v in index.search(query, k)]
+
+    def locate(self, col, value_id):
+        """(filas, bounds [minx, miny, maxx, maxy]) de las entidades con ese valor."""
+        rows = self.column(col).rows(value_id)
+        b = self.bounds[rows]
+        return rows, [float(np.nanmin(b[:, 0])), float(np.nanmin(b[:, 1])), float(np.nanmax(b[:, 2])), float(np.nanmax(b[:, 3]))]
+
+
+def layer_search_index(gdf):
+    """Índice de búsqueda de una capa. Para compartirlo entre sesiones se pide como derivado del almacén de capas."""
+    return LayerSearchIndex(gdf)
@@ -0,0 +1,237 @@
+"""Consultas espaciales sobre capas: recorte por vista de mapa, simplificación por
+zoom y consultas por ubicación (intersección, vecinos más cercanos, distancia)."""
+import math
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from pyproj import CRS
+
+# Presupuesto por defecto de entidades enviadas al navegador por capa
+DEFAULT_FEATURE_BUDGET = 5000
+
+# Margen alrededor de la vista para que un paneo corto no deje huecos
+VIEW_PADDING = 0.15
+
+# Altas acumuladas (fracción del árbol) a partir de las que se reconstruye el STRtree
+REBUILD_RATIO = 0.1
+REBUILD_MIN = 256
+# Metros por grado de latitud (aprox.), para acotar candidatos antes de medir en metros
+METERS_PER_DEGREE = 111320.0
+
+
+def zoom_tolerance(zoom, pixels=0.5):
+    """Tolerancia de simplificación (grados) equivalente a `pixels` píxeles en `zoom`."""
+    return pixels * 360.0 / (256 * 2 ** zoom)
+
+
+def view_bounds_from_center(center, zoom, width_px=1200, height_px=500):
+    """Aproxima [minx, miny, maxx, maxy] de la vista a partir de centro y zoom."""
+    lat, lon = center
+    deg_per_px = 360.0 / (256 * 2 ** zoom)
+    half_w = width_px / 2 * deg_per_px
+    # En Web Mercator el alto en grados se contrae con la latitud
+    half_h = height_px / 2 * deg_per_px * math.cos(math.radians(lat))
+    return [lon - half_w, lat - half_h, lon + half_w, lat + half_h]
+
+
+def bounds_to_center_zoom(bounds, width_px=1200, height_px=500, max_zoom=18):
+    """Centro y zoom que encuadran bounds Folium [[lat_min, lon_min], [lat_max, lon_max]]."""
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    center = [(lat_min + lat_max) / 2, (lon_min + lon_max) / 2]
+
+    def merc(lat):
+        lat = max(min(lat, 85.0), -85.0)
+        return math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+
+    lon_span = max(lon_max - lon_min, 1e-9)
+    y_span = max(merc(lat_max) - merc(lat_min), 1e-12)
+    zoom_x = math.log2(width_px * 360.0 / (256 * lon_span))
+    zoom_y = math.log2(height_px * 2 * math.pi / (256 * y_span))
+    return center, int(max(0, min(max_zoom, math.floor(min(zoom_x, zoom_y)))))
+
+
+def folium_bounds_to_bbox(bounds):
+    """Convierte los bounds de st_folium ({_southWest, _northEast}) a [minx, miny, maxx, maxy]."""
+    if not bounds or not bounds.get('_southWest') or not bounds.get('_northEast'):
+        return None
+    sw, ne = bounds['_southWest'], bounds['_northEast']
+    if sw.get('lat') is None or ne.get('lat') is None:
+        return None
+    return [sw['lng'], sw['lat'], ne['lng'], ne['lat']]
+
+
+def pad_bbox(bbox, ratio=VIEW_PADDING):
+    minx, miny, maxx, maxy = bbox
+    dx, dy = (maxx - minx) * ratio, (maxy - miny) * ratio
+    return [minx - dx, miny - dy, maxx + dx, maxy + dy]
+
+
+def viewport_subset(gdf, bbox, zoom, max_features=DEFAULT_FEATURE_BUDGET):
+    """Entidades de `gdf` que intersectan `bbox`, simplificadas para `zoom`.
+
+    Usa el índice espacial de la capa (se construye una sola vez y queda
+    guardado en el GeoDataFrame). Si hay más entidades que `max_features`
+    se conservan las de mayor extensión, que son las visibles a ese zoom.
+
+    Retorna (subset, total_en_vista).
+    """
+    if gdf.empty:
+        return gdf, 0
+
+    hits = gdf.sindex.query(shapely.box(*pad_bbox(bbox)), predicate='intersects')
+    total = len(hits)
+    if total > max_features:
+        b = shapely.bounds(gdf.geometry.values[hits])
+        extent = np.maximum(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1])
+        keep = np.argpartition(-extent, max_features - 1)[:max_features]
+        hits = hits[keep]
+    hits = np.sort(hits)
+
+    subset = gdf.iloc[hits]
+    if zoom is not None:
+        simplified = shapely.simplify(subset.geometry.values, zoom_tolerance(zoom), preserve_topology=True)
+        subset = subset.set_geometry(simplified, crs=gdf.crs)
+    return subset, total
+
+
+class LayerIndex:
+    """STRtree persistente de una capa con bajas y altas incrementales.
+
+    Cada entidad se identifica por una etiqueta (el índice de la capa). Las
+    bajas solo se marcan en el árbol; las altas van a una lista lineal hasta que
+    superan REBUILD_RATIO del árbol y entonces se reconstruye una sola vez.
+    """
+
+    def __init__(self, geoms, labels=None):
+        geoms = np.asarray(geoms, dtype=object)
+        labels = np.arange(len(geoms)) if labels is None else np.asarray(labels)
+        self._build(geoms, labels)
+
+    def _build(self, geoms, labels):
+        self._geoms = geoms
+        self._tree = shapely.STRtree(geoms)
+        self._labels = labels
+        # Nulos y vacíos no los devuelve ninguna consulta: no cuentan como entidades
+        self._alive = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+        self._extra_geoms = []
+        self._extra_labels = []
+
+    @classmethod
+    def from_gdf(cls, gdf):
+        return cls(np.asarray(gdf.geometry.array), gdf.index.to_numpy())
+
+    def __len__(self):
+        return int(self._alive.sum()) + len(self._extra_labels)
+
+    # --- MANTENIMIENTO INCREMENTAL ---
+    def remove(self, labels, renumber=True):
+        """Da de baja entidades. Con `renumber`, las etiquetas posteriores se desplazan
+        como tras un reset_index (posiciones contiguas)."""
+        removed = np.unique(np.asarray(list(labels), dtype=self._labels.dtype))
+        if removed.size == 0:
+            return
+        self._alive &= ~np.isin(self._labels, removed)
+        removed_set = set(removed.tolist())
+        keep = [i for i, label in enumerate(self._extra_labels) if label not in removed_set]
+        self._extra_geoms = [self._extra_geoms[i] for i in keep]
+        self._extra_labels = [self._extra_labels[i] for i in keep]
+        if renumber:
+            self._labels = self._labels - np.searchsorted(removed, self._labels)
+            extra = np.asarray(self._extra_labels, dtype=self._labels.dtype)
+            self._extra_labels = (extra - np.searchsorted(removed, extra)).tolist()
+
+    def add(self, geoms, labels):
+        """Da de alta entidades nuevas (p. ej. dibujos guardados en la tabla)."""
+        for geom, label in zip(geoms, labels):
+            if geom is not None and not geom.is_empty:
+                self._extra_geoms.append(geom)
+                self._extra_labels.append(label)
+        if len(self._extra_labels) > max(REBUILD_MIN, REBUILD_RATIO * len(self._geoms)):
+            self.compact()
+
+    def compact(self):
+        """Reconstruye el árbol con las entidades vivas y las altas pendientes."""
+        geoms = np.concatenate([self._geoms[self._alive], np.asarray(self._extra_geoms, dtype=object)])
+        labels = np.concatenate([self._labels[self._alive], np.asarray(self._extra_labels, dtype=self._labels.dtype)])
+        self._build(geoms, labels)
+
+    # --- CONSULTAS ---
+    def _candidates(self, geom, predicate=None, distance=None):
+        """(etiquetas, geometrías) que cumplen el predicado, del árbol y de las altas."""
+        if predicate == 'dwithin':
+            hits = self._tree.query(geom, predicate=predicate, distance=distance)
+        else:
+            hits = self._tree.query(geom, predicate=predicate)
+        hits = hits[self._alive[hits]]
+        labels, geoms = self._labels[hits], self._geoms[hits]
+        if self._extra_geoms:
+            extra = np.asarray(self._extra_geoms, dtype=object)
+            if predicate == 'dwithin':
+                ok = shapely.dwithin(extra, geom, distance)
+            elif predicate:
+                ok = getattr(shapely, predicate)(extra, geom)
+            else:
+                ok = shapely.intersects(shapely.envelope(extra), shapely.envelope(geom))
+            labels = np.concatenate([labels, np.asarray(self._extra_labels, dtype=labels.dtype)[ok]])
+            geoms = np.concatenate([geoms, extra[ok]])
+        return labels, geoms
+
+    def intersecting(self, geom):
+        """Etiquetas de las entidades que intersectan `geom`."""
+        return np.sort(self._candidates(geom, 'intersects')[0])
+
+    def nearest(self, geom, n=1, crs="EPSG:4326"):
+        """Etiquetas y distancias (metros si la capa es geográfica) de las `n` más cercanas."""
+        if len(self) == 0:
+            return np.array([], dtype=int), np.array([])
+        # Ventana creciente hasta reunir al menos n candidatos, o hasta cubrir toda la capa
+        extent = shapely.box(*shapely.total_bounds(np.concatenate(
+            [self._geoms[self._alive], np.asarray(self._extra_geoms, dtype=object)])))
+        radius = max(geom.length, 1e-4)
+        while True:
+            window = shapely.buffer(shapely.envelope(geom), radius)
+            labels, geoms = self._candidates(window)
+            if len(labels) >= n or len(labels) == len(self) or window.covers(extent):
+                break
+            radius *= 4
+        # La ventana es un cuadrado y las distancias se miden en metros: se repite la
+        # búsqueda con el radio de la n-ésima distancia para no perder ninguna más cercana.
+        distances = _metric_distance(geoms, geom, crs)
+        limit = np.sort(distances)[min(n, len(distances)) - 1]
+        labels, distances = self.within_distance(geom, limit, crs)
+        return labels[:n], distances[:n]
+
+    def within_distance(self, geom, meters, crs="EPSG:4326"):
+        """Etiquetas y distancias de las entidades a menos de `meters` de `geom`."""
+        labels, geoms = self._within(geom, meters, crs)
+        distances = _metric_distance(geoms, geom, crs)
+        ok = distances <= meters
+        order = np.argsort(distances[ok])
+        return labels[ok][order], distances[ok][order]
+
+    def _within(self, geom, meters, crs):
+        if CRS.from_user_input(crs).is_geographic:
+            # Cota en grados que cubre `meters` incluso con la contracción de longitudes
+            lat = min(abs(geom.centroid.y), 89.0)
+            degrees = meters / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+        else:
+            degrees = meters
+        return self._candidates(geom, 'dwithin', degrees)
+
+
+def _metric_distance(geoms, geom, crs):
+    """Distancias de `geoms` a `geom`; en metros (UTM local) si el CRS es geográfico."""
+    if len(geoms) == 0:
+        return np.array([])
+    series = gpd.GeoSeries(geoms, crs=crs)
+    target = gpd.GeoSeries([geom], crs=crs)
+    if series.crs is not None and series.crs.is_geographic:
+        utm = target.estimate_utm_crs()
+        series, target = series.to_crs(utm), target.to_crs(utm)
+    return series.distance(target.iloc[0]).to_numpy()
+
+
+def layer_index(gdf):
+    """Índice espacial de una capa. Para compartirlo entre sesiones se pide como derivado del almacén de capas."""
+    return LayerIndex.from_gdf(gdf)
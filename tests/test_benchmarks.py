@@ -0,0 +1,27 @@
+"""Código de salida de benchmarks.main."""
+import json
+
+import benchmarks
+
+METRICS = {"best_s": 1.0, "median_s": 1.0, "peak_rss_mb": 10.0, "run_rss_mb": 1.0, "payload_bytes": 100}
+
+
+def _baseline(tmp_path, names):
+    path = tmp_path / "base.json"
+    path.write_text(json.dumps({"sizes": {}, "results": {name: METRICS for name in names}}))
+    return str(path)
+
+
+def test_errored_case_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(benchmarks, "run_isolated",
+                        lambda name, sizes, workdir: {"error": "falló"} if name == "search" else METRICS)
+    base = _baseline(tmp_path, benchmarks.CASES)
+    assert benchmarks.main(["--baseline", base]) == 1
+    assert benchmarks.main(["--baseline", base, "--only", "table_edit"]) == 0
+
+
+def test_missing_baseline_case_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(benchmarks, "run_isolated", lambda name, sizes, workdir: METRICS)
+    base = _baseline(tmp_path, list(benchmarks.CASES) + ["caso_quitado"])
+    assert benchmarks.main(["--baseline", base]) == 1
+    assert benchmarks.main(["--baseline", _baseline(tmp_path, benchmarks.CASES)]) == 0
@@ -0,0 +1,17 @@
+"""Reparto de núcleos entre rasters en ingesta (ingest.raster_share)."""
+import ingest
+
+
+def test_single_raster_gets_all_cores(monkeypatch):
+    monkeypatch.setattr(ingest.os, "cpu_count", lambda: 4)
+    with ingest.raster_share() as workers:
+        assert workers == 4
+
+
+def test_cores_split_among_running_rasters(monkeypatch):
+    monkeypatch.setattr(ingest.os, "cpu_count", lambda: 4)
+    with ingest.raster_share() as first:
+        with ingest.raster_share() as second:
+            assert (first, second) == (4, 2)
+    with ingest.raster_share() as again:
+        assert again == 4
@@ -0,0 +1,49 @@
+"""Journals de sesión: borrado al guardar o al terminar la sesión y barrido de huérfanos."""
+import gc
+import os
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+from journal import EditJournal, session_journal, sweep_session_journals
+from work_layer import with_feature_ids
+
+
+def _layer():
+    return with_feature_ids(gpd.GeoDataFrame({'n': [1]}, geometry=[Point(0, 0)], crs=4326))
+
+
+def test_session_journal_removed_when_discarded(tmp_path):
+    journal = session_journal(str(tmp_path / "p.parquet"), "0123abcd")
+    journal.log_insert(_layer())
+    journal.compact(_layer())
+    assert os.path.exists(journal.path) and os.path.exists(journal.project_path)
+    journal.discard()
+    assert os.listdir(tmp_path) == []
+
+
+def test_session_journal_removed_with_session(tmp_path):
+    journal = session_journal(str(tmp_path / "p.parquet"), "0123abcd")
+    journal.log_insert(_layer())
+    del journal
+    gc.collect()
+    assert os.listdir(tmp_path) == []
+
+
+def test_project_journal_is_kept(tmp_path):
+    journal = EditJournal(str(tmp_path / "p.parquet"))
+    journal.log_insert(_layer())
+    journal.discard()
+    assert os.path.exists(journal.path)
+
+
+def test_sweep_removes_orphans_only(tmp_path):
+    project = str(tmp_path / "p.parquet")
+    for name in ("p.0123abcd.parquet", "p.0123abcd.parquet.journal", "p.parquet.journal", "p.copia.parquet"):
+        (tmp_path / name).write_text("x")
+    sweep_session_journals(project)
+    assert sorted(os.listdir(tmp_path)) == ["p.copia.parquet", "p.parquet.journal"]
+    # Una vez por proceso: los journals de sesiones vivas no se tocan
+    (tmp_path / "p.4567cdef.parquet.journal").write_text("x")
+    sweep_session_journals(project)
+    assert "p.4567cdef.parquet.journal" in os.listdir(tmp_path)
@@ -0,0 +1,45 @@
+"""Capas volcadas a disco por el presupuesto de memoria (layer_memory.spill)."""
+import gc
+import os
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+import layer_memory
+from scratch import ScratchArea
+
+
+def _layer():
+    gdf = gpd.GeoDataFrame({'n': range(3)}, geometry=[Point(i, i) for i in range(3)], crs=4326)
+    return {'type': 'vector', 'data': gdf}
+
+
+def test_spilled_layer_survives_sweep(tmp_path, monkeypatch):
+    area = ScratchArea(str(tmp_path), ttl=0)
+    monkeypatch.setattr(layer_memory, "scratch", area)
+    layer = _layer()
+    layer_memory.spill(layer)
+    area.sweep(force=True)
+    assert layer_memory.ensure_resident(layer)
+    assert layer['data']['n'].tolist() == [0, 1, 2]
+    assert os.listdir(area.pinned_root) == []
+
+
+def test_spill_file_removed_with_layer(tmp_path, monkeypatch):
+    area = ScratchArea(str(tmp_path))
+    monkeypatch.setattr(layer_memory, "scratch", area)
+    layer = _layer()
+    layer_memory.spill(layer)
+    assert len(os.listdir(area.pinned_root)) == 1
+    del layer
+    gc.collect()
+    assert os.listdir(area.pinned_root) == []
+
+
+def test_sweep_removes_files_pinned_by_dead_processes(tmp_path):
+    area = ScratchArea(str(tmp_path))
+    orphan = os.path.join(area.pinned_root, "999999999-x.parquet")
+    open(orphan, "w").close()
+    pinned = area.pin(".parquet")
+    area.sweep(force=True)
+    assert os.listdir(area.pinned_root) == [os.path.basename(pinned.path)]
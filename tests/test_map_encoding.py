@@ -0,0 +1,27 @@
+"""Codificación de capas para el mapa (map_encoding)."""
+import geopandas as gpd
+from shapely.geometry import LineString, MultiLineString, box
+
+from map_encoding import encode_geometries, is_topojson_candidate, to_topojson
+
+
+def test_line_layer_is_not_a_coverage_candidate():
+    gdf = gpd.GeoDataFrame(geometry=[
+        LineString([(0, 0), (1, 1), (2, 0)]),
+        MultiLineString([[(2, 0), (3, 1)], [(3, 1), (4, 0)]]),
+    ], crs="EPSG:4326")
+    assert not is_topojson_candidate(gdf)
+    # Con coverage=True se simplifica entidad por entidad en vez de fallar
+    encoded = encode_geometries(gdf, 10, coverage=True)
+    assert len(encoded) == 2
+
+
+def test_polygon_layer_with_nulls_keeps_positions():
+    gdf = gpd.GeoDataFrame({"a": [1, 2, 3]}, geometry=[box(0, 0, 1, 1), None, box(1, 0, 2, 1)],
+                           crs="EPSG:4326")
+    assert is_topojson_candidate(gdf)
+    encoded = encode_geometries(gdf, 10, coverage=True)
+    assert list(encoded.index) == [0, 1, 2]
+    assert encoded.geometry.iloc[1] is None
+    assert encoded.geometry.iloc[0].equals(box(0, 0, 1, 1))
+    assert to_topojson(encoded, ["a"])["type"] == "Topology"
@@ -0,0 +1,20 @@
+"""Índice espacial de capas (spatial_index.LayerIndex)."""
+import numpy as np
+from shapely.geometry import Point
+
+from spatial_index import LayerIndex
+
+
+def test_nearest_ignores_null_geometries():
+    index = LayerIndex([Point(-70.60, -33.40), None, Point(-70.61, -33.41)])
+    assert len(index) == 2
+    labels, distances = index.nearest(Point(-70.60, -33.40), n=5)
+    assert sorted(labels.tolist()) == [0, 2]
+    assert np.all(np.isfinite(distances))
+
+
+def test_nearest_with_null_additions():
+    index = LayerIndex([Point(0, 0)])
+    index.add([None, Point(1, 1)], [1, 2])
+    labels, _ = index.nearest(Point(0, 0), n=10, crs="EPSG:3857")
+    assert labels.tolist() == [0, 2]
@@ -0,0 +1,205 @@
+"""Servidor local de teselas XYZ (solo localhost, sin servicios externos).
+
+Cada fuente registrada es una función `render(z, x, y) -> bytes | None` que
+genera la tesela bajo demanda. Las teselas generadas quedan en un LRU en memoria
+acotado por bytes, así que panear sobre una zona ya vista no recalcula nada.
+
+URL de las teselas: http://<host>:<puerto>/<fuente>/{z}/{x}/{y}.<ext>
+
+Las capas se publican con TileRegistration: un nombre único por instancia
+(nunca el nombre visible de la capa, que puede repetirse entre sesiones) y
+baja del servidor con close() o cuando el registro se recolecta, así que la
+fuente vive lo mismo que quien la creó (p. ej. un derivado del almacén de
+capas).
+"""
+import math
+import os
+import re
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TILE_HOST = os.environ.get("GEOEDITOR_TILE_HOST", "127.0.0.1")
+TILE_PORT = int(os.environ.get("GEOEDITOR_TILE_PORT", "0"))  # 0 = puerto libre cualquiera
+TILE_CACHE_LIMIT = int(os.environ.get("GEOEDITOR_TILE_CACHE_MB", "256")) * 1024 * 1024
+
+# Semieje de Web Mercator (EPSG:3857)
+ORIGIN_SHIFT = 20037508.342789244
+
+_TILE_PATH = re.compile(r"^/([A-Za-z0-9_\-]+)/(\d+)/(\d+)/(\d+)\.(\w+)$")
+
+
+def tile_bounds_3857(z, x, y):
+    """Bounds (minx, miny, maxx, maxy) de la tesela z/x/y en EPSG:3857."""
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+
+def tile_bounds_4326(z, x, y):
+    """Bounds (lon_min, lat_min, lon_max, lat_max) de la tesela z/x/y."""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y))
+
+
+class TileSource:
+    """Fuente registrada: función de render + tipo de contenido (+ close() al darla de baja)."""
+
+    def __init__(self, render, content_type, extension, min_zoom=0, max_zoom=22, close=None):
+        self.render = render
+        self.close = close
+        self.content_type = content_type
+        self.extension = extension
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+
+
+class TileRegistration:
+    """Fuente publicada con un nombre único; se da de baja con close() o al recolectarse."""
+
+    def __init__(self, server, source):
+        self.name = uuid.uuid4().hex
+        self.max_zoom = source.max_zoom
+        self._server = server
+        server.register(self.name, source)
+        self._finalizer = weakref.finalize(self, server.unregister, self.name)
+
+    @property
+    def url(self):
+        return self._server.tile_url(self.name)
+
+    def close(self):
+        self._finalizer()
+
+
+class TileServer:
+    """Servidor HTTP en un hilo de fondo con registro de fuentes y caché LRU."""
+
+    def __init__(self, host=TILE_HOST, port=TILE_PORT, cache_limit=TILE_CACHE_LIMIT):
+        self.host = host
+        self.port = port
+        self.cache_limit = cache_limit
+        self._sources = {}
+        self._cache = OrderedDict()  # {(fuente, z, x, y): bytes}
+        self._cache_bytes = 0
+        self._lock = threading.RLock()
+        self._httpd = None
+
+    # --- REGISTRO ---
+    def register(self, name, source):
+        with self._lock:
+            if name in self._sources:
+                self._drop_cached(name)
+            self._sources[name] = source
+
+    def unregister(self, name):
+        with self._lock:
+            source = self._sources.pop(name, None)
+            self._drop_cached(name)
+        if source is not None and source.close:
+            source.close()
+
+    def publish(self, source):
+        """Registra `source` con un nombre nuevo. Retorna su TileRegistration."""
+        return TileRegistration(self, source)
+
+    def tile_url(self, name):
+        """Plantilla {z}/{x}/{y} para Leaflet. Arranca el servidor si hace falta."""
+        self.start()
+        source = self._sources[name]
+        return f"http://{self.host}:{self.port}/{name}/{{z}}/{{x}}/{{y}}.{source.extension}"
+
+    # --- TESELAS ---
+    def get_tile(self, name, z, x, y):
+        """Devuelve (bytes, content_type) o (None, None) si la fuente no existe."""
+        source = self._sources.get(name)
+        if source is None:
+            return None, None
+        if not (source.min_zoom <= z <= source.max_zoom) or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return b"", source.content_type
+
+        key = (name, z, x, y)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key], source.content_type
+
+        data = source.render(z, x, y) or b""
+
+        with self._lock:
+            # La fuente pudo cambiar mientras se generaba: no cachear basura
+            if self._sources.get(name) is source and key not in self._cache:
+                self._cache[key] = data
+                self._cache_bytes += len(data)
+                while self._cache_bytes > self.cache_limit and self._cache:
+                    _, old = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(old)
+        return data, source.content_type
+
+    def _drop_cached(self, name):
+        for key in [k for k in self._cache if k[0] == name]:
+            self._cache_bytes -= len(self._cache.pop(key))
+
+    # --- SERVIDOR ---
+    def start(self):
+        with self._lock:
+            if self._httpd is not None:
+                return
+            self._httpd = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+            self._httpd.daemon_threads = True
+            self.port = self._httpd.server_address[1]
+            threading.Thread(target=self._httpd.serve_forever, name="tile-server", daemon=True).start()
+
+    def stop(self):
+        with self._lock:
+            if self._httpd is not None:
+                self._httpd.shutdown()
+                self._httpd.server_close()
+                self._httpd = None
+
+
+def _make_handler(server):
+    class TileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = _TILE_PATH.match(self.path.split("?", 1)[0])
+            if not match:
+                self.send_error(404)
+                return
+            name, z, x, y = match.group(1), int(match.group(2)), int(match.group(3)), int(match.group(4))
+            try:
+                data, content_type = server.get_tile(name, z, x, y)
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            if data is None:
+                self.send_error(404)
+                return
+            if not data:
+                self.send_response(204)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            # El mapa vive en un iframe de otro origen (puerto de Streamlit)
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Cache-Control", "max-age=3600")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # Silenciar el log por petición
+
+    return TileHandler
+
+
+# Instancia compartida por todas las sesiones del proceso
+tile_server = TileServer()
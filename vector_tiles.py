@@ -0,0 +1,100 @@
+"""Teselas vectoriales (Mapbox Vector Tiles) generadas bajo demanda desde un GeoDataFrame."""
+import mapbox_vector_tile
+import numpy as np
+import pandas as pd
+import shapely
+
+from tile_server import TileSource, tile_bounds_3857, tile_server
+
+MVT_EXTENT = 4096
+# Margen de recorte en unidades de tesela, evita costuras visibles entre teselas
+MVT_BUFFER = 64
+# Límite de entidades por tesela; a zoom bajo se priorizan las más grandes
+MAX_TILE_FEATURES = 5000
+# Nombre de la capa dentro de cada tesela (lo usa el estilo en Leaflet.VectorGrid)
+MVT_LAYER_NAME = "features"
+
+
+class VectorTileLayer:
+    """Capa reproyectada a EPSG:3857 con índice espacial, lista para generar teselas."""
+
+    def __init__(self, gdf, properties=None, max_features=MAX_TILE_FEATURES):
+        gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+        if gdf.crs is not None and gdf.crs.to_epsg() != 3857:
+            gdf = gdf.to_crs(epsg=3857)
+        self.geoms = np.asarray(gdf.geometry.array)
+        self.tree = shapely.STRtree(self.geoms)
+        bounds = shapely.bounds(self.geoms)
+        self.extent = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+        self.max_features = max_features
+
+        if properties is None:
+            properties = [c for c in gdf.columns if c != gdf.geometry.name][:3]
+        # Atributos como tipos simples de Python (MVT solo admite str/num/bool)
+        self.properties = {}
+        for col in properties:
+            series = gdf[col]
+            if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+                self.properties[col] = series.to_numpy()
+            else:
+                self.properties[col] = series.astype(str).to_numpy()
+
+    def render(self, z, x, y):
+        minx, miny, maxx, maxy = tile_bounds_3857(z, x, y)
+        pad = (maxx - minx) * MVT_BUFFER / MVT_EXTENT
+        clip_box = (minx - pad, miny - pad, maxx + pad, maxy + pad)
+
+        hits = self.tree.query(shapely.box(*clip_box))
+        if len(hits) == 0:
+            return None
+        if len(hits) > self.max_features:
+            keep = np.argpartition(-self.extent[hits], self.max_features - 1)[:self.max_features]
+            hits = hits[keep]
+
+        # Medio pixel de tesela como tolerancia: invisible y reduce mucho los vértices
+        tolerance = (maxx - minx) / MVT_EXTENT / 2
+        clipped = shapely.clip_by_rect(self.geoms[hits], *clip_box)
+        clipped = shapely.simplify(clipped, tolerance, preserve_topology=True)
+
+        features = []
+        for pos, geom in zip(hits, clipped):
+            if geom is None or geom.is_empty:
+                continue
+            props = {}
+            for col, values in self.properties.items():
+                value = values[pos]
+                if pd.isna(value):
+                    continue
+                props[col] = value.item() if hasattr(value, "item") else value
+            features.append({"geometry": geom, "properties": props})
+        if not features:
+            return None
+
+        return mapbox_vector_tile.encode(
+            [{"name": MVT_LAYER_NAME, "features": features}],
+            default_options={
+                "quantize_bounds": (minx, miny, maxx, maxy),
+                "extents": MVT_EXTENT,
+                "on_invalid_geometry": mapbox_vector_tile.encoder.on_invalid_geometry_make_valid,
+            },
+        )
+
+
+def vector_tile_source(gdf, properties=None):
+    """Publica la capa en el servidor local. Retorna el TileRegistration (url; close() la da de baja)."""
+    layer = VectorTileLayer(gdf, properties=properties)
+    return tile_server.publish(TileSource(layer.render, "application/x-protobuf", "pbf"))
+
+
+def vector_grid_style(color, weight=1, fill_opacity=0.1):
+    """Opciones de Leaflet.VectorGrid para dibujar la capa con el estilo de las referencias."""
+    return {
+        "vectorTileLayerStyles": {
+            MVT_LAYER_NAME: {
+                "color": color, "weight": weight,
+                "fill": True, "fillColor": color, "fillOpacity": fill_opacity,
+                "radius": 3,
+            }
+        },
+        "interactive": True,
+    }
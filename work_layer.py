@@ -0,0 +1,129 @@
+"""Capa de trabajo: identificadores estables de entidad y aplicación de ediciones.
+
+Cada entidad de la capa de trabajo tiene un id (el índice del GeoDataFrame,
+FEATURE_ID) que no cambia al borrar otras entidades ni al reordenar la tabla.
+st.data_editor informa los cambios por posición de fila en la vista mostrada;
+se traducen a ids y se aplican de una vez por columna, así que el coste depende
+de las filas cambiadas y no del tamaño de la capa.
+"""
+import numpy as np
+import pandas as pd
+
+FEATURE_ID = "fid"
+# Contador de ids guardado con la capa (GeoParquet conserva gdf.attrs)
+NEXT_ID_ATTR = "next_fid"
+# Tipos de campo que se pueden crear desde la barra lateral
+COLUMN_TYPES = ["Texto", "Número Entero", "Número Decimal"]
+
+
+def with_feature_ids(gdf, start=0):
+    """Asigna ids a una capa recién cargada o a dibujos nuevos.
+
+    Si la capa ya trae ids válidos (índice o columna FEATURE_ID, guardados antes
+    por la app) se reutilizan; si no, se numeran desde `start`.
+    """
+    if gdf.index.name == FEATURE_ID and gdf.index.is_unique and pd.api.types.is_integer_dtype(gdf.index):
+        return gdf
+    if FEATURE_ID in gdf.columns:
+        ids = pd.to_numeric(gdf[FEATURE_ID], errors="coerce")
+        if ids.notna().all() and ids.is_unique:
+            gdf = gdf.drop(columns=FEATURE_ID)
+            gdf.index = pd.Index(ids.astype("int64").to_numpy(), name=FEATURE_ID)
+            return gdf
+        gdf = gdf.drop(columns=FEATURE_ID)
+    gdf.index = pd.RangeIndex(start, start + len(gdf), name=FEATURE_ID)
+    return gdf
+
+
+def next_feature_id(gdf):
+    """Primer id sin usar: el contador guardado con la capa o, si no lo trae, el siguiente al máximo.
+
+    Los ids no se reutilizan aunque se borre la entidad con el id más alto: la
+    sesión lleva el contador y se guarda con el proyecto.
+    """
+    top = int(gdf.index.max()) + 1 if len(gdf) else 0
+    return max(top, int(gdf.attrs.get(NEXT_ID_ATTR, 0)))
+
+
+def add_column(gdf, name, kind):
+    """Crea un campo vacío de tipo `kind` (uno de COLUMN_TYPES). No hace nada si ya existe."""
+    if name in gdf.columns:
+        return gdf
+    if kind == "Número Entero":
+        gdf[name] = pd.Series(dtype='Int64')
+    elif kind == "Número Decimal":
+        gdf[name] = pd.Series(dtype='float')
+    else:
+        gdf[name] = None
+    return gdf
+
+
+def apply_edits(gdf, view_ids, changes):
+    """Aplica los cambios de st.data_editor (`changes`) a `gdf`.
+
+    `view_ids` son los ids de las filas mostradas, en orden: las claves de
+    edited_rows y deleted_rows son posiciones en esa vista. Las ediciones se
+    agrupan por columna y se asignan con un solo .loc; los borrados no
+    renumeran nada.
+
+    Retorna (gdf, {columna: (ids, valores)}, ids_borrados).
+    """
+    view_ids = np.asarray(view_ids)
+
+    by_column = {}
+    for pos, edits in changes.get("edited_rows", {}).items():
+        pos = int(pos)
+        if pos >= len(view_ids):
+            continue
+        for col, val in edits.items():
+            if col in gdf.columns:
+                ids, values = by_column.setdefault(col, ([], []))
+                ids.append(view_ids[pos])
+                values.append(val)
+
+    for col, (ids, values) in by_column.items():
+        gdf.loc[ids, col] = values
+
+    positions = [int(p) for p in changes.get("deleted_rows", []) if int(p) < len(view_ids)]
+    deleted = view_ids[positions]
+    if len(deleted):
+        gdf = gdf.drop(index=deleted)
+    return gdf, by_column, deleted.tolist()
+
+
+def table_page(gdf, columns, sort_by=None, descending=False, filter_col=None, filter_text="",
+               page=0, page_size=100):
+    """Una página de la tabla de atributos, filtrada y ordenada en el servidor.
+
+    Filtro y orden solo leen la columna implicada; el resto de columnas se
+    copian únicamente para las filas de la página.
+
+    Retorna (página, total_filtrado).
+    """
+    ids = gdf.index.to_numpy()
+    if filter_col in gdf.columns and filter_text:
+        mask = gdf[filter_col].astype(str).str.contains(filter_text, case=False, regex=False, na=False)
+        ids = ids[mask.to_numpy()]
+
+    if sort_by in gdf.columns:
+        values = gdf[sort_by].loc[ids] if len(ids) < len(gdf) else gdf[sort_by]
+        order = values.reset_index(drop=True).sort_values(
+            ascending=not descending, kind="stable", na_position="last").index.to_numpy()
+        ids = ids[order]
+    elif descending:
+        ids = ids[::-1]
+
+    start = page * page_size
+    return gdf.loc[ids[start:start + page_size], columns], len(ids)
+
+
+def split_selection(gdf, column="Seleccionar"):
+    """Separa una columna de selección guardada en archivos antiguos.
+
+    Retorna (gdf sin la columna, ids seleccionados). La selección de la sesión
+    vive aparte de los datos, como conjunto de ids.
+    """
+    if column not in gdf.columns:
+        return gdf, set()
+    selected = set(gdf.index[gdf[column].fillna(False).astype(bool).to_numpy()].tolist())
+    return gdf.drop(columns=column), selected